@@ -0,0 +1,235 @@
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+class CachedAnswer:
+    """Запись кэша ответов"""
+    def __init__(self, entry_id: int, query: str, vector: np.ndarray, chunk_key: Tuple[str, ...],
+                 answer: str, created: float):
+        self.entry_id = entry_id
+        self.query = query
+        self.vector = vector
+        self.chunk_key = chunk_key
+        self.answer = answer
+        self.created = created
+
+
+class SemanticAnswerCache:
+    """
+    Кэш ответов по семантической близости запросов. Запись находится, если найденные
+    для запроса фрагменты контекста совпадают, а косинусная близость эмбеддингов запросов
+    не ниже порога. Размер ограничен (LRU), записи устаревают по TTL, при указании
+    db_path записи дублируются в SQLite и переживают перезапуск. Если базу делят несколько
+    процессов, записи, добавленные другими, подгружаются не реже refresh_interval секунд;
+    размер базы ограничивается общим LRU по времени последнего использования (в SQL),
+    а вытеснение из памяти процесса не удаляет записи, которые читают другие процессы.
+    Записи помечаются версией (промпт, модель, параметры индекса): записи другой версии
+    не выдаются и удаляются из базы при открытии.
+    """
+    def __init__(self, threshold: float, max_size: int, ttl: float, db_path: Optional[str] = None,
+                 refresh_interval: float = 5.0, version: str = ""):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.version = version
+        self.refresh_interval = refresh_interval
+        self._last_refresh = time.monotonic()
+        self._last_row_id = 0
+        self.entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        self.by_chunks: Dict[Tuple[str, ...], Set[int]] = {}
+        self.hits = 0
+        self.misses = 0
+        self._next_id = 1
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        if db_path:
+            self._open_db(db_path)
+
+    @staticmethod
+    def make_chunk_key(chunk_ids: Iterable[str]) -> Tuple[str, ...]:
+        """Ключ по набору идентификаторов найденных фрагментов"""
+        return tuple(sorted(str(chunk_id) for chunk_id in chunk_ids))
+
+    @staticmethod
+    def _normalize(vector: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _open_db(self, db_path: str):
+        """Подключение к SQLite и загрузка действующих записей"""
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, query TEXT, chunk_key TEXT, vector BLOB, answer TEXT, created REAL, "
+            "version TEXT NOT NULL DEFAULT '', used REAL)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(answers)")}
+        if "version" not in columns:
+            # База предыдущего формата: ее записи получают пустую версию и удаляются ниже
+            self._db.execute("ALTER TABLE answers ADD COLUMN version TEXT NOT NULL DEFAULT ''")
+        if "used" not in columns:
+            self._db.execute("ALTER TABLE answers ADD COLUMN used REAL")
+            self._db.execute("UPDATE answers SET used = created")
+        self._db.execute("CREATE INDEX IF NOT EXISTS answers_used ON answers (used)")
+        stale = self._db.execute("DELETE FROM answers WHERE version != ?", (self.version,)).rowcount
+        if stale:
+            logger.info(f"Answer cache dropped {stale} entries of another version")
+        self._db.execute("DELETE FROM answers WHERE created < ?", (time.time() - self.ttl,))
+        self._last_row_id = self._db.execute("SELECT COALESCE(MAX(id), 0) FROM answers").fetchone()[0]
+        rows = self._db.execute(
+            "SELECT id, query, chunk_key, vector, answer, created FROM answers WHERE version = ? "
+            "ORDER BY used DESC LIMIT ?",
+            (self.version, self.max_size)
+        ).fetchall()
+        self._load_rows(reversed(rows))
+        logger.info(f"Answer cache loaded {len(rows)} entries from {db_path}")
+
+    def _load_rows(self, rows: Iterable[tuple]):
+        for entry_id, query, chunk_key, vector, answer, created in rows:
+            if entry_id in self.entries:
+                continue
+            self._insert(CachedAnswer(
+                entry_id, query, np.frombuffer(vector, dtype=np.float32),
+                tuple(chunk_key.split('\n')) if chunk_key else (), answer, created
+            ))
+
+    def _refresh(self):
+        """Подгрузка записей, добавленных в базу другими процессами"""
+        if self._db is None or time.monotonic() - self._last_refresh < self.refresh_interval:
+            return
+        self._last_refresh = time.monotonic()
+        rows = self._db.execute(
+            "SELECT id, query, chunk_key, vector, answer, created FROM answers WHERE id > ? AND created >= ? "
+            "AND version = ? ORDER BY id", (self._last_row_id, time.time() - self.ttl, self.version)
+        ).fetchall()
+        if rows:
+            self._last_row_id = rows[-1][0]
+            self._load_rows(rows)
+            self._evict_local()
+
+    def _insert(self, entry: CachedAnswer):
+        self.entries[entry.entry_id] = entry
+        self.by_chunks.setdefault(entry.chunk_key, set()).add(entry.entry_id)
+
+    def _forget(self, entry_ids: List[int]):
+        """Удаление записей только из памяти процесса"""
+        for entry_id in entry_ids:
+            entry = self.entries.pop(entry_id, None)
+            if entry is None:
+                continue
+            siblings = self.by_chunks.get(entry.chunk_key)
+            if siblings is not None:
+                siblings.discard(entry_id)
+                if not siblings:
+                    del self.by_chunks[entry.chunk_key]
+
+    def _remove(self, entry_ids: List[int]):
+        """Удаление записей из памяти и из базы (устаревшие и недействительные)"""
+        self._forget(entry_ids)
+        if self._db is not None and entry_ids:
+            self._db.executemany("DELETE FROM answers WHERE id = ?", [(entry_id,) for entry_id in entry_ids])
+
+    def lookup(self, vector: Sequence[float], chunk_ids: Iterable[str]) -> Optional[str]:
+        """Поиск ответа на близкий запрос с тем же набором фрагментов контекста"""
+        vector = self._normalize(vector)
+        chunk_key = self.make_chunk_key(chunk_ids)
+        now = time.time()
+        with self._lock:
+            self._refresh()
+            best, best_score, expired = None, self.threshold, []
+            for entry_id in self.by_chunks.get(chunk_key, ()):
+                entry = self.entries[entry_id]
+                if now - entry.created > self.ttl:
+                    expired.append(entry_id)
+                    continue
+                score = float(np.dot(entry.vector, vector))
+                if score >= best_score:
+                    best, best_score = entry, score
+            self._remove(expired)
+            if best is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(best.entry_id)
+            if self._db is not None:
+                self._db.execute("UPDATE answers SET used = ? WHERE id = ?", (now, best.entry_id))
+            self.hits += 1
+            return best.answer
+
+    def store(self, query: str, vector: Sequence[float], chunk_ids: Iterable[str], answer: str):
+        """Сохранение ответа с вытеснением давно не использованных записей"""
+        entry = CachedAnswer(
+            0, query, self._normalize(vector), self.make_chunk_key(chunk_ids), answer, time.time()
+        )
+        with self._lock:
+            if self._db is not None:
+                entry.entry_id = self._store_row(entry)
+            else:
+                entry.entry_id = self._next_id
+                self._next_id += 1
+            self._insert(entry)
+            self._evict_local()
+
+    def _store_row(self, entry: CachedAnswer) -> int:
+        """
+        Запись ответа в базу и вытеснение давно не использованных записей сверх max_size
+        в одной транзакции: размер общий для всех процессов, вытесняются записи, которые
+        дольше всех не использовал ни один процесс.
+        """
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            # Идентификатор выдает SQLite, чтобы записи разных процессов не конфликтовали
+            entry_id = self._db.execute(
+                "INSERT INTO answers (query, chunk_key, vector, answer, created, version, used) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (entry.query, '\n'.join(entry.chunk_key), entry.vector.tobytes(), entry.answer,
+                 entry.created, self.version, entry.created)
+            ).lastrowid
+            self._db.execute(
+                "DELETE FROM answers WHERE id IN (SELECT id FROM answers ORDER BY used "
+                "LIMIT max(0, (SELECT COUNT(*) FROM answers) - ?))", (self.max_size,)
+            )
+            self._db.execute("COMMIT")
+        except Exception:
+            self._db.execute("ROLLBACK")
+            raise
+        return entry_id
+
+    def _evict_local(self):
+        """Ограничение числа записей в памяти процесса; база не изменяется"""
+        overflow = len(self.entries) - self.max_size
+        if overflow > 0:
+            self._forget(list(self.entries)[:overflow])
+
+    def invalidate_chunks(self, chunk_ids: Iterable[str]):
+        """Удаление записей, опирающихся на измененные или удаленные фрагменты"""
+        stale = {str(chunk_id) for chunk_id in chunk_ids}
+        with self._lock:
+            self._remove([
+                entry_id for entry_id, entry in self.entries.items()
+                if stale.intersection(entry.chunk_key)
+            ])
+            if self._db is not None:
+                rows = self._db.execute("SELECT id, chunk_key FROM answers").fetchall()
+                self._db.executemany("DELETE FROM answers WHERE id = ?", [
+                    (entry_id,) for entry_id, chunk_key in rows
+                    if stale.intersection(chunk_key.split('\n'))
+                ])
+
+    def clear(self):
+        """Полная очистка кэша"""
+        with self._lock:
+            self.entries.clear()
+            self.by_chunks.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM answers")
@@ -0,0 +1,156 @@
+"""
+Пакетная обработка вопросов из JSONL.
+
+Каждая строка входного файла — объект {"id": ..., "question": "..."} (id необязателен)
+или просто строка JSON с вопросом. Результаты пишутся в JSONL по мере готовности:
+id, вопрос, ответ или ошибка, признак ответа из кэша, число токенов промпта и замеры времени.
+
+Примеры:
+    python batch_cli.py questions.jsonl -o answers.jsonl --concurrency 16
+    python batch_cli.py questions.jsonl --openai-batch batch_requests.jsonl -o cached.jsonl --submit
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+import time
+from typing import List, Optional, TextIO, Tuple
+from config import BATCH_CONCURRENCY, EMBED_BATCH_SIZE
+from main import VineyardAssistant
+
+# Логи пишутся в stderr, чтобы не смешиваться с результатами в stdout
+logging.basicConfig(
+    level=logging.WARNING,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    stream=sys.stderr
+)
+logger = logging.getLogger(__name__)
+
+
+def read_questions(path: str) -> Tuple[List[Optional[str]], List[object]]:
+    """Чтение вопросов и их идентификаторов из JSONL ('-' — стандартный ввод)"""
+    questions, ids = [], []
+    stream = sys.stdin if path == "-" else open(path, 'r', encoding='utf-8')
+    try:
+        for line_number, line in enumerate(stream, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.error(f"Skipping invalid JSON on line {line_number}: {e}")
+                continue
+            if isinstance(item, dict):
+                questions.append(item.get("question") or item.get("query"))
+                ids.append(item.get("id", line_number))
+            else:
+                questions.append(item)
+                ids.append(line_number)
+    finally:
+        if stream is not sys.stdin:
+            stream.close()
+    return questions, ids
+
+
+def write_line(output: TextIO, item: dict):
+    output.write(json.dumps(item, ensure_ascii=False) + "\n")
+    output.flush()
+
+
+async def run_completions(assistant: VineyardAssistant, questions: List[Optional[str]], ids: List[object],
+                          output: TextIO, concurrency: int, batch_size: int):
+    """Ответы на вопросы через Chat Completions с ограничением параллельности"""
+    start = time.perf_counter()
+    done = errors = cached = 0
+    async for result in assistant.process_batch(questions, concurrency=concurrency, batch_size=batch_size):
+        result["id"] = ids[result["index"]]
+        write_line(output, result)
+        done += 1
+        errors += "error" in result
+        cached += bool(result.get("cached"))
+        if done % 50 == 0:
+            logger.warning(f"Processed {done}/{len(questions)} questions")
+    elapsed = time.perf_counter() - start
+    logger.warning(
+        f"Processed {done} questions in {elapsed:.1f}s ({done / max(elapsed, 1e-9):.1f} q/s), "
+        f"cached: {cached}, errors: {errors}"
+    )
+
+
+async def write_openai_batch(assistant: VineyardAssistant, questions: List[Optional[str]], ids: List[object],
+                             output: TextIO, batch_path: str, batch_size: int, submit: bool):
+    """
+    Подготовка входного файла OpenAI Batch API. Поиск и сборка промптов выполняются
+    локально; вопросы с ответом в кэше сразу пишутся в результаты и в файл не попадают.
+    """
+    requests = 0
+    with open(batch_path, 'w', encoding='utf-8') as batch_file:
+        for start in range(0, len(questions), batch_size):
+            chunk = [
+                (index, question) for index, question in enumerate(questions[start:start + batch_size], start)
+                if question and isinstance(question, str)
+            ]
+            if not chunk:
+                continue
+            prepared_batch = await assistant.prepare_batch([question for _, question in chunk])
+            for (index, question), prepared in zip(chunk, prepared_batch):
+                if prepared.cached_answer is not None:
+                    write_line(output, {"id": ids[index], "index": index, "question": question,
+                                        "answer": prepared.cached_answer, "cached": True})
+                    continue
+                write_line(batch_file, assistant.batch_request(prepared, str(ids[index])))
+                requests += 1
+    logger.warning(f"Wrote {requests} requests to {batch_path}")
+
+    if submit and requests:
+        openai = assistant.client.client
+        with open(batch_path, 'rb') as f:
+            uploaded = await openai.files.create(file=f, purpose="batch")
+        batch = await openai.batches.create(
+            input_file_id=uploaded.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        logger.warning(f"Submitted OpenAI batch {batch.id} (input file {uploaded.id})")
+        print(batch.id, file=sys.stderr)
+
+
+async def amain(args: argparse.Namespace):
+    questions, ids = read_questions(args.input)
+    if not questions:
+        logger.error("No questions to process")
+        return
+    assistant = VineyardAssistant()
+    output = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+    try:
+        if args.openai_batch:
+            await write_openai_batch(
+                assistant, questions, ids, output, args.openai_batch, args.batch_size, args.submit
+            )
+        else:
+            await run_completions(assistant, questions, ids, output, args.concurrency, args.batch_size)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+        await assistant.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input", help="JSONL с вопросами ('-' — стандартный ввод)")
+    parser.add_argument("-o", "--output", help="файл результатов JSONL (по умолчанию stdout)")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY,
+                        help="одновременных запросов к модели")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE,
+                        help="вопросов в одном пакете кодирования и поиска")
+    parser.add_argument("--openai-batch", metavar="PATH",
+                        help="вместо запросов к модели записать входной файл OpenAI Batch API")
+    parser.add_argument("--submit", action="store_true",
+                        help="загрузить файл --openai-batch и создать задание OpenAI Batch")
+    asyncio.run(amain(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
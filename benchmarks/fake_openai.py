@@ -0,0 +1,127 @@
+"""
+Локальный мок OpenAI Chat Completions для нагрузочных проверок без обращения к API.
+
+Поддерживает обычные и потоковые ответы (включая stream_options.include_usage),
+задержку ответа и лимит запросов в минуту: сверх лимита возвращается 429
+с заголовками retry-after, как у настоящего API.
+
+Запуск из корня проекта:
+    python benchmarks/fake_openai.py --port 8765 --latency 0.5 --rpm 600
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 python console_interface.py
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import deque
+
+from aiohttp import web
+
+
+ANSWER = (
+    "Обрезку винограда проводят осенью после листопада или ранней весной до начала сокодвижения. "
+    "Оставляйте на кусте плодовые звенья из сучка замещения и плодовой стрелки."
+)
+
+
+class FakeOpenAI:
+    """Обработчик /v1/chat/completions с настраиваемыми задержкой и лимитом RPM"""
+    def __init__(self, latency: float, token_delay: float, rpm: int):
+        self.latency = latency
+        self.token_delay = token_delay
+        self.rpm = rpm
+        self.requests = deque()
+        self.served = 0
+        self.rejected = 0
+
+    def retry_after(self) -> float:
+        """Секунд до освобождения лимита или 0, если запрос укладывается в лимит"""
+        if not self.rpm:
+            return 0.0
+        now = time.monotonic()
+        while self.requests and now - self.requests[0] >= 60:
+            self.requests.popleft()
+        if len(self.requests) < self.rpm:
+            self.requests.append(now)
+            return 0.0
+        return 60 - (now - self.requests[0])
+
+    @staticmethod
+    def usage(body: dict) -> dict:
+        prompt_tokens = sum(len(message.get("content") or "") for message in body.get("messages", [])) // 4
+        completion_tokens = len(ANSWER) // 4
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": 0},
+        }
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        body = await request.json()
+        delay = self.retry_after()
+        if delay:
+            self.rejected += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached, try again later", "type": "requests",
+                           "code": "rate_limit_exceeded"}},
+                status=429,
+                headers={"retry-after": f"{delay:.3f}", "retry-after-ms": str(int(delay * 1000))}
+            )
+        self.served += 1
+        await asyncio.sleep(self.latency)
+        model = body.get("model", "gpt-4o-mini")
+        created = int(time.time())
+
+        if not body.get("stream"):
+            return web.json_response({
+                "id": f"chatcmpl-{self.served}", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": ANSWER}, "finish_reason": "stop"}],
+                "usage": self.usage(body),
+            })
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        for word in ANSWER.split(" "):
+            chunk = {
+                "id": f"chatcmpl-{self.served}", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": {"content": word + " "}, "finish_reason": None}],
+            }
+            await response.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+            await asyncio.sleep(self.token_delay)
+        if body.get("stream_options", {}).get("include_usage"):
+            chunk = {
+                "id": f"chatcmpl-{self.served}", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [], "usage": self.usage(body),
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({"served": self.served, "rejected": self.rejected})
+
+
+def create_app(fake: FakeOpenAI) -> web.Application:
+    """Приложение мока: Chat Completions и счетчики запросов"""
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", fake.chat)
+    app.router.add_get("/stats", fake.stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.5, help="задержка до первого токена, секунд")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="задержка между токенами потока, секунд")
+    parser.add_argument("--rpm", type=int, default=0, help="лимит запросов в минуту; 0 — без ограничения")
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(args.latency, args.token_delay, args.rpm)
+    web.run_app(create_app(fake), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Локальный мок Telegram Bot API для проверки бота без обращения к Telegram.
+
+Принимает запросы бота (sendMessage, editMessageText, setWebhook и др.) и запоминает
+исходящие сообщения с временем отправки; GET /messages возвращает их для анализа.
+Может имитировать flood control: сообщение в чат чаще --chat-interval секунд
+получает ответ 429 с retry_after, как у настоящего API.
+
+Запуск из корня проекта:
+    python benchmarks/fake_telegram.py --port 8081 --chat-interval 1
+    TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_TOKEN=123:TEST python bot.py
+"""
+import argparse
+import asyncio
+import math
+import time
+
+from aiohttp import web
+
+
+SEND_METHODS = ("sendMessage", "editMessageText")
+
+
+class FakeTelegram:
+    """Обработчик /bot<token>/<method> с журналом исходящих сообщений"""
+    def __init__(self, chat_interval: float, latency: float):
+        self.chat_interval = chat_interval
+        self.latency = latency
+        self.messages = []
+        self.last_sent = {}
+        self.webhook = {}
+        self.flood_rejections = 0
+        self.message_id = 0
+
+    def retry_after(self, chat_id: int) -> int:
+        """Секунд до разрешенной отправки в чат или 0, если лимит не превышен"""
+        if not self.chat_interval:
+            return 0
+        now = time.monotonic()
+        elapsed = now - self.last_sent.get(chat_id, -math.inf)
+        # Небольшой допуск на неточность таймеров клиента
+        if elapsed < self.chat_interval * 0.9:
+            return max(1, math.ceil(self.chat_interval - elapsed))
+        self.last_sent[chat_id] = now
+        return 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        if request.content_type == "application/json":
+            data = await request.json()
+        else:
+            data = dict(await request.post())
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == "getMe":
+            return self.ok({"id": 1, "is_bot": True, "first_name": "Vineyard", "username": "vineyard_test_bot"})
+        if method == "setWebhook":
+            self.webhook = {"url": data.get("url"), "secret_token": data.get("secret_token")}
+            return self.ok(True)
+        if method == "getWebhookInfo":
+            return self.ok({"url": self.webhook.get("url", ""), "has_custom_certificate": False,
+                            "pending_update_count": 0})
+        if method == "getUpdates":
+            await asyncio.sleep(1)
+            return self.ok([])
+        if method in SEND_METHODS:
+            chat_id = int(data["chat_id"])
+            delay = self.retry_after(chat_id) if method == "sendMessage" else 0
+            if delay:
+                self.flood_rejections += 1
+                return web.json_response(
+                    {"ok": False, "error_code": 429, "description": f"Too Many Requests: retry after {delay}",
+                     "parameters": {"retry_after": delay}},
+                    status=429
+                )
+            if method == "sendMessage":
+                self.message_id += 1
+                message_id = self.message_id
+            else:
+                message_id = int(data["message_id"])
+            self.messages.append({
+                "time": time.time(), "method": method, "chat_id": chat_id,
+                "message_id": message_id, "text": data.get("text", ""),
+            })
+            return self.ok({"message_id": message_id, "date": int(time.time()),
+                            "chat": {"id": chat_id, "type": "private"}, "text": data.get("text", "")})
+        return self.ok(True)
+
+    @staticmethod
+    def ok(result) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    async def get_messages(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "messages": self.messages, "flood_rejections": self.flood_rejections, "webhook": self.webhook,
+        })
+
+    async def reset(self, request: web.Request) -> web.Response:
+        self.messages, self.last_sent, self.flood_rejections = [], {}, 0
+        return self.ok(True)
+
+
+def create_app(fake: FakeTelegram) -> web.Application:
+    """Приложение мока: запросы бота, журнал сообщений и сброс состояния"""
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", fake.handle)
+    app.router.add_get("/messages", fake.get_messages)
+    app.router.add_post("/reset", fake.reset)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--chat-interval", type=float, default=0.0,
+                        help="минимальный интервал между сообщениями в чат, секунд; 0 — без flood control")
+    parser.add_argument("--latency", type=float, default=0.0, help="задержка ответа API, секунд")
+    args = parser.parse_args()
+
+    fake = FakeTelegram(args.chat_interval, args.latency)
+    web.run_app(create_app(fake), host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
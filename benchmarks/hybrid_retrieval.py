@@ -0,0 +1,100 @@
+"""
+Сравнение векторного и гибридного (BM25 + векторный, RRF) поиска по корпусу data/.
+
+Для каждого запроса с названием сорта, препарата или болезни проверяется, содержит ли
+хотя бы один из k найденных фрагментов искомый термин (hit@k), и измеряется задержка.
+
+Запуск из корня проекта:
+    python benchmarks/hybrid_retrieval.py -k 5
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import VineyardAssistant  # noqa: E402
+
+
+QUERIES = [
+    ("Как бороться с оидиумом?", "оидиум"),
+    ("Тиовит Джет дозировка", "тиовит"),
+    ("Сорт Кодрянка описание", "кодрянк"),
+    ("Обработка от милдью", "милдью"),
+    ("Ридомил Голд", "ридомил"),
+    ("Топаз от болезней винограда", "топаз"),
+    ("Строби применение", "строби"),
+    ("Сорт Аркадия", "аркади"),
+    ("Сорт Восторг характеристики", "восторг"),
+    ("Защита от филлоксеры", "филлоксер"),
+    ("Признаки антракноза", "антракноз"),
+    ("Квадрис", "квадрис"),
+    ("Хорус фунгицид", "хорус"),
+    ("Серая гниль ягод", "серая гниль"),
+    ("Изабелла укрывной сорт", "изабелл"),
+    ("Сорт Молдова", "молдов"),
+    ("Талисман сорт", "талисман"),
+    ("Паутинный клещ на винограде", "клещ"),
+    ("Гроздевая листовертка", "листовертк"),
+    ("Сорт Лора", "лора"),
+]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def summarize(latencies):
+    return {
+        "mean_ms": statistics.mean(latencies) * 1000,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+    }
+
+
+def run_mode(assistant, hybrid, k):
+    """Поиск по всем запросам в заданном режиме: доля попаданий и задержки."""
+    assistant.hybrid_search = hybrid
+    hits, latencies = 0, []
+    for query, term in QUERIES:
+        request = assistant.make_search_request(assistant.preprocess_query(query), k, None, None)
+        started = time.perf_counter()
+        _, documents = assistant.search_batch([request])[0]
+        latencies.append(time.perf_counter() - started)
+        hits += any(term in doc.page_content.lower().replace('ё', 'е') for doc in documents)
+    return {"hit_rate": hits / len(QUERIES), **summarize(latencies)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-k", type=int, default=5, help="число фрагментов в ответе поиска")
+    parser.add_argument("--repeat", type=int, default=3, help="число повторов для замера BM25")
+    args = parser.parse_args()
+
+    assistant = VineyardAssistant()
+    if assistant.lexical_index is None:
+        assistant.initialize_lexical_index(assistant.index_dir, rebuild=False)
+
+    lexical_latencies = []
+    for _ in range(args.repeat):
+        for query, _ in QUERIES:
+            started = time.perf_counter()
+            assistant.lexical_index.search(assistant.preprocess_query(query), args.k)
+            lexical_latencies.append(time.perf_counter() - started)
+
+    report = {
+        "k": args.k,
+        "queries": len(QUERIES),
+        "dense": run_mode(assistant, hybrid=False, k=args.k),
+        "hybrid": run_mode(assistant, hybrid=True, k=args.k),
+        "bm25_only": summarize(lexical_latencies),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+Набор замеров производительности: запуск, поиск, кэши и полный цикл process_query.
+
+Индекс строится заново во временном каталоге из data/ (рабочий индекс и кэши не
+затрагиваются), вместо OpenAI используется локальный мок benchmarks/fake_openai.py
+с настраиваемой задержкой. Результат — JSON с p50/p95/p99 задержек, временем
+построения и загрузки индекса, пропускной способностью и потреблением памяти,
+чтобы сравнивать прогоны между изменениями.
+
+Запуск из корня проекта:
+    python benchmarks/run_benchmarks.py -o bench.json --llm-latency 0.5 --requests 200 --concurrency 32
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, PROJECT_DIR)
+
+from hybrid_retrieval import QUERIES  # noqa: E402
+
+
+def summarize(latencies):
+    """Статистика задержек в миллисекундах"""
+    ordered = sorted(latencies)
+
+    def percentile(fraction):
+        return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))] * 1000
+
+    return {
+        "count": len(ordered),
+        "mean_ms": sum(ordered) / len(ordered) * 1000,
+        "p50_ms": percentile(0.5),
+        "p95_ms": percentile(0.95),
+        "p99_ms": percentile(0.99),
+        "max_ms": ordered[-1] * 1000,
+    }
+
+
+def timed(fn, *args, **kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return time.perf_counter() - started, result
+
+
+def memory_usage():
+    """Текущий и пиковый размер резидентной памяти процесса, МБ"""
+    usage = {"peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}
+    try:
+        with open("/proc/self/statm") as f:
+            usage["rss_mb"] = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        pass
+    return usage
+
+
+def directory_size_mb(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names
+    ) / 2 ** 20
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_fake_openai(latency, token_delay):
+    """Запуск мока OpenAI в отдельном процессе и ожидание его готовности"""
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(BENCHMARKS_DIR, "fake_openai.py"), "--port", str(port),
+         "--latency", str(latency), "--token-delay", str(token_delay)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/stats", timeout=1)
+            return process, f"http://127.0.0.1:{port}/v1"
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Fake OpenAI server did not start")
+
+
+def bench_search(assistant, queries, repeat):
+    """Задержки кодирования запроса, поиска FAISS при разных k, BM25 и поиска с кэшем"""
+    from config import HYBRID_CANDIDATES
+
+    encode, vectors = [], []
+    for _ in range(repeat):
+        for query in queries:
+            elapsed, vector = timed(assistant.embeddings.embed_query, assistant.preprocess_query(query))
+            encode.append(elapsed)
+            vectors.append(vector)
+
+    search = {}
+    for k in (5, 10, 50):
+        search[f"k{k}"] = summarize([timed(assistant.vector_store.search, [vector], k)[0] for vector in vectors])
+
+    report = {"encode": summarize(encode), "faiss_search": search}
+    if assistant.lexical_index is not None:
+        report["bm25_search"] = summarize([
+            timed(assistant.lexical_index.search, assistant.preprocess_query(query), HYBRID_CANDIDATES)[0]
+            for _ in range(repeat) for query in queries
+        ])
+
+    assistant.retrieval_cache.clear()
+    report["retrieve_miss"] = summarize([
+        timed(assistant.retrieve, assistant.preprocess_query(query))[0] for query in queries
+    ])
+    report["retrieve_cache_hit"] = summarize([
+        timed(assistant.retrieve, assistant.preprocess_query(query))[0]
+        for _ in range(repeat) for query in queries
+    ])
+    return report
+
+
+async def bench_process_query(assistant, requests, concurrency):
+    """Пропускная способность process_query с уникальными вопросами и ответы из кэша"""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(index, query):
+        async with semaphore:
+            started = time.perf_counter()
+            await assistant.process_query(query, 1000000 + index)
+            return time.perf_counter() - started
+
+    questions = [f"{QUERIES[i % len(QUERIES)][0]} (вопрос {i})" for i in range(requests)]
+
+    # Порог выше 1 исключает попадания в семантический кэш при замере полного цикла
+    threshold, assistant.answer_cache.threshold = assistant.answer_cache.threshold, 1.01
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*(run(i, query) for i, query in enumerate(questions)))
+    elapsed = time.perf_counter() - started
+    assistant.answer_cache.threshold = threshold
+
+    report = {
+        "requests": requests,
+        "concurrency": concurrency,
+        "elapsed_s": elapsed,
+        "throughput_qps": requests / elapsed,
+        "latency": summarize(latencies),
+    }
+
+    # Повтор уже отвеченных вопросов без истории обслуживается кэшем ответов
+    hit_latencies = []
+    for i, query in enumerate(questions[:min(requests, 50)]):
+        started = time.perf_counter()
+        await assistant.process_query(query, 2000000 + i)
+        hit_latencies.append(time.perf_counter() - started)
+    report["answer_cache_hit"] = summarize(hit_latencies)
+    report["answer_cache"] = {"hits": assistant.answer_cache.hits, "misses": assistant.answer_cache.misses}
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-o", "--output", help="файл для JSON-отчета (по умолчанию stdout)")
+    parser.add_argument("--data-dir", default=os.path.join(PROJECT_DIR, "data"), help="каталог корпуса")
+    parser.add_argument("--repeat", type=int, default=5, help="повторов набора запросов в замерах поиска")
+    parser.add_argument("--requests", type=int, default=200, help="запросов в замере process_query")
+    parser.add_argument("--concurrency", type=int, default=32, help="одновременных запросов process_query")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="задержка ответа мока OpenAI, секунд")
+    parser.add_argument("--llm-token-delay", type=float, default=0.01, help="задержка между токенами потока")
+    parser.add_argument("--keep", action="store_true", help="не удалять временный каталог индекса")
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix="ceres_bench_")
+    fake_server, base_url = start_fake_openai(args.llm_latency, args.llm_token_delay)
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+    # Кэш ответов и сессии (относительные пути SQLite) создаются во временном каталоге
+    os.chdir(work_dir)
+    try:
+        import config
+        from main import VineyardAssistant
+
+        index_dir = os.path.join(work_dir, "faiss_index")
+        report = {
+            "meta": {
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+                "embedding_model": config.EMBEDDING_MODEL,
+                "embedding_backend": config.EMBEDDING_BACKEND,
+                "faiss_index_factory": config.FAISS_INDEX_FACTORY,
+                "hybrid_search": config.HYBRID_SEARCH,
+                "llm_latency_s": args.llm_latency,
+            }
+        }
+        memory_before = memory_usage()
+        cold_build, assistant = timed(VineyardAssistant, data_dir=args.data_dir, index_dir=index_dir)
+        memory_after_build = memory_usage()
+        warm_load, assistant = timed(VineyardAssistant, data_dir=args.data_dir, index_dir=index_dir)
+        report["startup"] = {
+            "cold_build_s": cold_build,
+            "warm_load_s": warm_load,
+            "chunks": len(assistant.chunk_store),
+            "vectors": assistant.vector_store.ntotal,
+            "index_size_mb": directory_size_mb(index_dir),
+        }
+
+        report["retrieval"] = bench_search(assistant, [query for query, _ in QUERIES], args.repeat)
+        report["process_query"] = asyncio.run(bench_process_query(assistant, args.requests, args.concurrency))
+        report["memory"] = {
+            "before_mb": memory_before,
+            "after_build_mb": memory_after_build,
+            "final_mb": memory_usage(),
+        }
+    finally:
+        fake_server.terminate()
+        fake_server.wait()
+        os.chdir(PROJECT_DIR)
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
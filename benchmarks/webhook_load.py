@@ -0,0 +1,166 @@
+"""
+Нагрузочная проверка режима webhook: всплеск обновлений от нескольких пользователей
+отправляется на webhook бота, ответы собираются из мока Telegram (fake_telegram.py).
+
+Показывает время до первого ответа (p50/p95/max), число ответов "занят",
+ответы 429 мока и проверяет, что каждый пользователь получил ответы по порядку.
+
+Запуск из корня проекта (мок OpenAI, мок Telegram и бот в режиме webhook):
+    python benchmarks/fake_openai.py --port 8765 --latency 0.5 &
+    python benchmarks/fake_telegram.py --port 8081 --chat-interval 1 &
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 TELEGRAM_API_URL=http://127.0.0.1:8081 BOT_TOKEN=123:TEST \\
+        WEBHOOK_URL=http://127.0.0.1:8080 WEBHOOK_SECRET=test python bot.py &
+    python benchmarks/webhook_load.py --users 50 --per-user 4 --rate 100 --secret test
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import WEBHOOK_PATH  # noqa: E402
+
+
+QUESTIONS = (
+    "Как обрезать виноград осенью?",
+    "Чем обработать виноград от милдью?",
+    "Когда укрывать виноград на зиму?",
+    "Какие сорта винограда подходят для севера?",
+)
+# Начала ответов "занят" (VineyardBot.BUSY_TEXT и CHAT_BUSY_TEXT)
+BUSY_PREFIXES = ("Сейчас очень много вопросов", "Я еще отвечаю")
+
+
+def make_update(update_id: int, user_id: int, text: str) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"},
+            "text": text,
+        },
+    }
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+async def send_updates(args) -> dict:
+    """Отправка обновлений с заданной частотой; время отправки по пользователям"""
+    url = args.webhook.rstrip("/") + WEBHOOK_PATH
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    sent = {}
+    statuses = {}
+    async with aiohttp.ClientSession() as session:
+        async def post(update: dict):
+            started = time.time()
+            async with session.post(url, json=update, headers=headers) as response:
+                statuses[response.status] = statuses.get(response.status, 0) + 1
+            user_id = update["message"]["from"]["id"]
+            sent.setdefault(user_id, []).append(started)
+
+        tasks = []
+        update_id = 0
+        for round_index in range(args.per_user):
+            for user in range(args.users):
+                update_id += 1
+                text = f"{QUESTIONS[(user + round_index) % len(QUESTIONS)]} ({round_index})"
+                tasks.append(asyncio.create_task(post(make_update(update_id, 10_000 + user, text))))
+                if args.rate:
+                    await asyncio.sleep(1 / args.rate)
+        await asyncio.gather(*tasks)
+    return {"sent": sent, "statuses": statuses}
+
+
+async def wait_replies(args, expected: int) -> dict:
+    """Ожидание, пока мок Telegram не перестанет получать сообщения"""
+    deadline = time.time() + args.timeout
+    last_count, stable_since = -1, time.time()
+    async with aiohttp.ClientSession() as session:
+        while True:
+            async with session.get(args.telegram.rstrip("/") + "/messages") as response:
+                data = await response.json()
+            first_messages = [m for m in data["messages"] if m["method"] == "sendMessage"]
+            if len(first_messages) != last_count:
+                last_count, stable_since = len(first_messages), time.time()
+            if len(first_messages) >= expected and time.time() - stable_since >= args.settle:
+                return data
+            if time.time() > deadline or time.time() - stable_since >= max(args.settle, 10):
+                return data
+            await asyncio.sleep(0.5)
+
+
+def analyze(sent: dict, data: dict) -> dict:
+    """Время до первого ответа на каждый принятый вопрос и порядок ответов по пользователям"""
+    replies, busy = {}, 0
+    for message in data["messages"]:
+        if message["method"] != "sendMessage":
+            continue
+        if message["text"].startswith(BUSY_PREFIXES):
+            busy += 1
+            continue
+        replies.setdefault(message["chat_id"], []).append(message["time"])
+
+    latencies, ordered = [], True
+    for user_id, sent_times in sent.items():
+        reply_times = replies.get(user_id, [])
+        # Ответы на отброшенные вопросы не приходят: k-й ответ соответствует k-му принятому вопросу
+        accepted = sorted(sent_times)[:len(reply_times)]
+        ordered &= reply_times == sorted(reply_times)
+        latencies.extend(reply - posted for posted, reply in zip(accepted, reply_times))
+    return {
+        "answered": len(latencies),
+        "busy_replies": busy,
+        "flood_rejections": data["flood_rejections"],
+        "ordered_per_user": ordered,
+        "first_reply_p50_s": round(percentile(latencies, 0.5), 3),
+        "first_reply_p95_s": round(percentile(latencies, 0.95), 3),
+        "first_reply_max_s": round(max(latencies, default=0.0), 3),
+    }
+
+
+async def run(args):
+    async with aiohttp.ClientSession() as session:
+        async with session.post(args.telegram.rstrip("/") + "/reset"):
+            pass
+    started = time.time()
+    result = await send_updates(args)
+    total = args.users * args.per_user
+    data = await wait_replies(args, total)
+    report = {
+        "users": args.users,
+        "updates": total,
+        "webhook_statuses": result["statuses"],
+        "elapsed_s": round(time.time() - started, 2),
+        **analyze(result["sent"], data),
+    }
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--webhook", default="http://127.0.0.1:8080", help="адрес HTTP-сервера webhook бота")
+    parser.add_argument("--telegram", default="http://127.0.0.1:8081", help="адрес мока Telegram")
+    parser.add_argument("--secret", default=None, help="значение WEBHOOK_SECRET бота")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--per-user", type=int, default=4, help="вопросов от каждого пользователя")
+    parser.add_argument("--rate", type=float, default=100, help="обновлений в секунду; 0 — все сразу")
+    parser.add_argument("--settle", type=float, default=3.0, help="секунд без новых сообщений до завершения")
+    parser.add_argument("--timeout", type=float, default=300.0)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,38 +1,87 @@
+import time
+IMPORT_STARTED = time.perf_counter()
 import asyncio
 import logging
+import math
 import signal
 import sys
-import time
-from datetime import datetime
-from typing import Optional
+from typing import TYPE_CHECKING, AsyncIterator, Optional, Set
+from aiohttp import web
 from aiogram import Bot, Dispatcher, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.fsm.storage.base import BaseStorage
 from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.filters import Command
 from aiogram.enums import ChatAction
-from aiogram.types import BotCommand, InlineKeyboardMarkup, InlineKeyboardButton
-from main import VineyardAssistant
-from config import bot_token
-
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot_logs.log'),
-        logging.StreamHandler()
-    ]
+from aiogram.types import BotCommand, InlineKeyboardMarkup, InlineKeyboardButton, Update
+from config import (
+    bot_token, STREAM_RESPONSES, STREAM_EDIT_INTERVAL, METRICS_HOST, METRICS_PORT, ASSISTANT_PRELOAD, FSM_DB_PATH,
+    ANSWER_WARMUP_ENABLED,
+    TELEGRAM_API_URL, TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_INTERVAL, TELEGRAM_GROUP_INTERVAL, TELEGRAM_MAX_RETRIES,
+    WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET,
+    UPDATE_QUEUE_SIZE, UPDATE_CHAT_QUEUE_SIZE, UPDATE_MAX_IN_FLIGHT
 )
+from fsm_storage import SQLiteStorage
+from observability import UPDATES_REJECTED, setup_logging, span, start_metrics_server, trace
+from telegram_limits import TelegramRateLimiter
+from update_queue import UpdateQueue, routing_key
+
+# Модуль main (модель эмбеддингов, FAISS, LangChain) импортируется при загрузке ассистента
+if TYPE_CHECKING:
+    from main import VineyardAssistant
+
+# Настройка логирования (запись в файл в отдельном потоке)
+setup_logging('bot_logs.log')
 logger = logging.getLogger(__name__)
 
 
 class VineyardBot:
-    def __init__(self):
-        self.bot = Bot(token=bot_token)
-        self.storage = MemoryStorage()
+    MAX_MESSAGE_LENGTH = 4000
+    SHUTDOWN_TIMEOUT = 30  # время на обработку уже принятых обновлений при остановке, секунд
+    BUSY_TEXT = (
+        "Сейчас очень много вопросов, и я не успеваю ответить на все.\n"
+        "Пожалуйста, повторите ваш вопрос через минуту."
+    )
+    CHAT_BUSY_TEXT = "Я еще отвечаю на ваши предыдущие вопросы. Пожалуйста, дождитесь ответа."
+
+    def __init__(self, storage: Optional[BaseStorage] = None, metrics_port: Optional[int] = METRICS_PORT,
+                 assistant_options: Optional[dict] = None, warm_answers: bool = ANSWER_WARMUP_ENABLED,
+                 telegram_clock=None):
+        """
+        storage — хранилище FSM (по умолчанию SQLite из FSM_DB_PATH, общее для процессов),
+        assistant_options — параметры конструктора VineyardAssistant,
+        warm_answers — прогревать кэш ответов частыми вопросами после загрузки ассистента,
+        telegram_clock — общий для процессов слот лимита TELEGRAM_GLOBAL_RATE (multiprocessing.Value)
+        """
+        session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+        self.bot = Bot(token=bot_token, session=session)
+        # Все исходящие сообщения проходят через ограничитель частоты с повтором после 429
+        self.bot.session.middleware(TelegramRateLimiter(
+            TELEGRAM_GLOBAL_RATE, TELEGRAM_CHAT_INTERVAL, TELEGRAM_GROUP_INTERVAL, TELEGRAM_MAX_RETRIES,
+            shared_clock=telegram_clock
+        ))
+        self.storage = storage or (SQLiteStorage(FSM_DB_PATH) if FSM_DB_PATH else MemoryStorage())
         self.dp = Dispatcher(storage=self.storage)
-        self.assistant: Optional[VineyardAssistant] = None
-        self.cache = {}
+        self.metrics_port = metrics_port
+        self.assistant_options = assistant_options or {}
+        self.assistant: Optional["VineyardAssistant"] = None
+        self.assistant_ready = asyncio.Event()
+        self.assistant_loading: Optional[asyncio.Task] = None
+        self.warm_answers = warm_answers
+        self.answer_warmup: Optional[asyncio.Task] = None
+        self.metrics_runner = None
+        self.webhook_runner: Optional[web.AppRunner] = None
+        self.updates = UpdateQueue(
+            lambda update: self.dp.feed_update(self.bot, update),
+            queue_size=UPDATE_QUEUE_SIZE,
+            chat_queue_size=UPDATE_CHAT_QUEUE_SIZE,
+            max_in_flight=UPDATE_MAX_IN_FLIGHT
+        )
+        self.busy_replies: Set[int] = set()
         self.is_running = True
+        self.shutdown_started = False
+        self.shutdown_finished = asyncio.Event()
         self.setup_handlers()
 
     def setup_signal_handlers(self):
@@ -50,11 +99,37 @@ class VineyardBot:
 
     async def shutdown(self):
         """Корректное завершение работы бота"""
+        if self.shutdown_started:
+            # Повторный вызов (сигнал и выход из start) ждет завершения первого
+            await self.shutdown_finished.wait()
+            return
+        self.shutdown_started = True
+        self.is_running = False
         try:
             logger.info("Shutting down bot...")
+            if self.updates.pending:
+                logger.info(f"Finishing {self.updates.pending} queued updates")
+                if not await self.updates.join(self.SHUTDOWN_TIMEOUT):
+                    logger.warning("Queued updates were not finished in time")
+            logger.info(f"Update queue stats: {self.updates.stats()}")
+            if self.answer_warmup:
+                self.answer_warmup.cancel()
+                await asyncio.gather(self.answer_warmup, return_exceptions=True)
+            if self.webhook_runner:
+                await self.webhook_runner.cleanup()
+            if self.assistant:
+                logger.info(f"Retrieval cache stats: {self.assistant.retrieval_cache.stats()}")
+                logger.info(f"Query embedding cache stats: {self.assistant.query_embeddings.stats()}")
+                if self.assistant.reranker is not None:
+                    logger.info(f"Rerank stats: {self.assistant.reranker.stats()}")
+                logger.info(f"Coalesced requests: {self.assistant.coalescing_stats()}")
+                await self.assistant.close()
+            if self.metrics_runner:
+                await self.metrics_runner.cleanup()
             await self.bot.session.close()
             await self.dp.storage.close()
             logger.info("Bot shutdown completed")
+            self.shutdown_finished.set()
             sys.exit(0)
         except Exception as shutdown_error:
             logger.error(f"Error during shutdown: {shutdown_error}")
@@ -70,10 +145,46 @@ class VineyardBot:
         ]
         await self.bot.set_my_commands(commands)
 
-    async def initialize_assistant(self):
-        """Ленивая инициализация ассистента"""
+    def load_assistant(self) -> "VineyardAssistant":
+        """Импорт зависимостей, загрузка модели и индекса и прогрев (выполняется в отдельном потоке)"""
+        started = time.perf_counter()
+        from main import VineyardAssistant
+        import_time = time.perf_counter() - started
+        assistant = VineyardAssistant(**self.assistant_options)
+        assistant.warm_up()
+        phases = {"import_main": import_time, **assistant.startup_timings}
+        logger.info(
+            f"Assistant ready in {time.perf_counter() - started:.2f}s: "
+            + ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in phases.items())
+        )
+        return assistant
+
+    async def preload_assistant(self):
+        """Фоновая загрузка ассистента; до ее окончания сообщения ждут готовности"""
+        try:
+            self.assistant = await asyncio.get_running_loop().run_in_executor(None, self.load_assistant)
+            if self.warm_answers:
+                # Частые вопросы получают ответы из кэша сразу после перезапуска
+                from warmup import keep_answer_cache_warm
+                self.answer_warmup = asyncio.create_task(keep_answer_cache_warm(self.assistant))
+        except Exception as load_error:
+            logger.error(f"Failed to load assistant: {load_error}", exc_info=True)
+        finally:
+            self.assistant_ready.set()
+
+    async def initialize_assistant(self) -> "VineyardAssistant":
+        """Ожидание готовности ассистента (при первом вызове запускает загрузку)"""
+        if self.assistant_loading is None:
+            self.assistant_loading = asyncio.create_task(self.preload_assistant())
+        if not self.assistant_ready.is_set():
+            logger.info("Assistant is still loading, message queued")
+            with span("assistant_wait"):
+                await self.assistant_ready.wait()
         if self.assistant is None:
-            self.assistant = VineyardAssistant()
+            # Следующее сообщение повторит загрузку
+            self.assistant_loading = None
+            self.assistant_ready = asyncio.Event()
+            raise RuntimeError("Assistant failed to load")
         return self.assistant
 
     def setup_handlers(self):
@@ -101,9 +212,17 @@ class VineyardBot:
         return keyboard
 
     @staticmethod
-    async def send_long_message(message: types.Message, text: str):
+    def find_split_point(text: str, max_length: int) -> int:
+        """Поиск места разбиения длинного текста: по последней точке в пределах лимита"""
+        last_period = text[:max_length].rfind('.')
+        if last_period != -1:
+            return last_period + 1
+        return max_length
+
+    @classmethod
+    async def send_long_message(cls, message: types.Message, text: str):
         """Отправка длинных сообщений по частям"""
-        max_length = 4000
+        max_length = cls.MAX_MESSAGE_LENGTH
         parts = []
 
         while text:
@@ -111,18 +230,55 @@ class VineyardBot:
                 parts.append(text)
                 break
 
-            part = text[:max_length]
-            last_period = part.rfind('.')
-            if last_period != -1:
-                part = text[:last_period + 1]
-                text = text[last_period + 1:].lstrip()
-            else:
-                text = text[max_length:]
-            parts.append(part)
+            split_point = cls.find_split_point(text, max_length)
+            parts.append(text[:split_point])
+            text = text[split_point:].lstrip()
 
+        # Паузы между частями выдерживает ограничитель частоты сессии
         for part in parts:
-            await message.answer(part.strip())
-            await asyncio.sleep(0.3)
+            with span("telegram_send"):
+                await message.answer(part.strip())
+
+    async def send_streaming_response(self, message: types.Message, chunks: AsyncIterator[str]) -> str:
+        """
+        Потоковая отправка ответа: сообщение публикуется на первых токенах и затем
+        редактируется не чаще STREAM_EDIT_INTERVAL секунд. При превышении лимита длины
+        текущее сообщение фиксируется и продолжается в новом.
+        """
+        full_text = ""
+        pending = ""
+        sent: Optional[types.Message] = None
+        shown = ""
+        last_update = 0.0
+
+        async def publish(text: str):
+            nonlocal sent, shown, last_update
+            text = text.strip()
+            if not text or text == shown:
+                return
+            with span("telegram_send"):
+                if sent is None:
+                    sent = await message.answer(text)
+                else:
+                    await sent.edit_text(text)
+            shown = text
+            last_update = time.monotonic()
+
+        async for chunk in chunks:
+            full_text += chunk
+            pending += chunk
+
+            while len(pending) > self.MAX_MESSAGE_LENGTH:
+                split_point = self.find_split_point(pending, self.MAX_MESSAGE_LENGTH)
+                await publish(pending[:split_point])
+                pending = pending[split_point:].lstrip()
+                sent, shown = None, ""
+
+            if sent is None or time.monotonic() - last_update >= STREAM_EDIT_INTERVAL:
+                await publish(pending)
+
+        await publish(pending)
+        return full_text
 
     async def handle_callback(self, callback_query: types.CallbackQuery):
         """Обработка нажатий на кнопки во всплывающем меню"""
@@ -184,13 +340,13 @@ class VineyardBot:
     async def cmd_clear(self, message: types.Message):
         """Сбрасывает историю диалога"""
         if self.assistant and hasattr(self.assistant, 'session_manager'):
-            self.assistant.session_manager.sessions.pop(message.from_user.id, None)
+            self.assistant.session_manager.clear_session(message.from_user.id)
         await message.answer("История диалога сброшена. Вы можете начать новый разговор.")
 
     async def cmd_exit(self, message: types.Message):
         """Обработчик команды /exit и кнопки 'Завершить диалог'"""
         if self.assistant:
-            self.assistant.session_manager.sessions.pop(message.from_user.id, None)
+            self.assistant.session_manager.clear_session(message.from_user.id)
         farewell_text = (
             "Спасибо за использование помощника-агронома. Удачи в виноградарстве!\n\n"
             "Чтобы начать новый диалог, используйте команду /start."
@@ -198,34 +354,17 @@ class VineyardBot:
         await message.answer(farewell_text)
         logger.info(f"User {message.from_user.id} ended conversation")
 
-    async def get_cached_response(self, query: str) -> Optional[str]:
-        """Получение ответа из кэша"""
-        if query in self.cache:
-            timestamp, response = self.cache[query]
-            if (datetime.now() - timestamp).total_seconds() < 3600:
-                return response
-        return None
-
-    async def cache_response(self, query: str, response: str):
-        """Сохранение ответа в кэш"""
-        self.cache[query] = (datetime.now(), response)
-
     async def handle_message(self, message: types.Message):
-        """Обработка входящих сообщений"""
+        """Обработка входящих сообщений с трассировкой этапов"""
+        with trace("telegram", user_id=message.from_user.id):
+            await self.process_message(message)
+
+    async def process_message(self, message: types.Message):
+        """Ответ на сообщение пользователя"""
         logger.info(f"Processing query: {message.text}")
         start_time = time.time()
 
         try:
-            # Проверка кэша
-            cached_response = await self.get_cached_response(message.text)
-            if cached_response:
-                await self.send_long_message(message, cached_response)
-                processing_time = time.time() - start_time
-                logger.info(
-                    f"Cached query processed in {processing_time:.2f} seconds for user {message.from_user.id}"
-                )
-                return
-
             # Уведомляем пользователя, что бот обрабатывает запрос
             await self.bot.send_chat_action(message.chat.id, ChatAction.TYPING)
 
@@ -233,24 +372,21 @@ class VineyardBot:
             assistant = await self.initialize_assistant()
 
             try:
-                response = await assistant.process_query(message.text, message.from_user.id)
+                if STREAM_RESPONSES:
+                    response = await self.send_streaming_response(
+                        message,
+                        assistant.stream_query(message.text, message.from_user.id)
+                    )
+                else:
+                    response = await assistant.process_query(message.text, message.from_user.id)
             except Exception as e:
                 error_str = str(e)
-                if "Rate limit reached" in error_str:
-                    # Извлекаем время ожидания из сообщения об ошибке
-                    wait_time = "несколько минут"
-                    if "try again in" in error_str:
-                        time_str = error_str.split("try again in")[1].split('.')[0].strip()
-                        wait_time = time_str
-
-                    error_message = (
-                        "Извините, достигнут лимит запросов к API.\n"
-                        f"Пожалуйста, подождите {wait_time} перед следующим запросом."
-                    )
-                    await message.answer(error_message)
+                rate_limit = self.find_rate_limit_error(e)
+                if rate_limit is not None:
+                    await message.answer(self.rate_limit_text(rate_limit))
                     logger.error(f"Rate limit exceeded for user {message.from_user.id}: {error_str}")
                     return
-                elif "token limit" in error_str.lower():
+                elif self.is_context_length_error(e):
                     await message.answer(
                         "Ваш запрос слишком длинный и превышает допустимый лимит токенов. "
                         "Пожалуйста, сократите текст и попробуйте снова."
@@ -260,11 +396,9 @@ class VineyardBot:
                 else:
                     raise
 
-            # Кэширование ответа
-            await self.cache_response(message.text, response)
-
-            # Отправка ответа пользователю
-            await self.send_long_message(message, response)
+            # Отправка ответа пользователю (в потоковом режиме ответ уже отправлен)
+            if not STREAM_RESPONSES:
+                await self.send_long_message(message, response)
 
             # Логирование времени обработки
             processing_time = time.time() - start_time
@@ -272,16 +406,10 @@ class VineyardBot:
 
         except Exception as message_error:
             error_str = str(message_error)
-            if "Rate limit reached" in error_str:
-                # Извлекаем время ожидания из сообщения об ошибке
-                wait_time = "несколько минут"
-                if "try again in" in error_str:
-                    time_str = error_str.split("try again in")[1].split('.')[0].strip()
-                    wait_time = time_str
-
+            rate_limit = self.find_rate_limit_error(message_error)
+            if rate_limit is not None:
                 error_message = (
-                    "Извините, достигнут лимит запросов к API.\n"
-                    f"Пожалуйста, подождите {wait_time} перед следующим запросом.\n"
+                    f"{self.rate_limit_text(rate_limit)}\n"
                     "Это ограничение установлено для обеспечения стабильной работы сервиса."
                 )
             else:
@@ -292,13 +420,123 @@ class VineyardBot:
             await message.answer(error_message)
             logger.error(f"Error processing message from user {message.from_user.id}: {error_str}", exc_info=True)
 
+    # Классы ошибок OpenAI импортируются при обработке ошибки: к этому моменту ассистент
+    # уже загрузил openai, а импорт модуля bot остается быстрым
+
+    @staticmethod
+    def find_rate_limit_error(error: Exception) -> Optional[Exception]:
+        """RateLimitError OpenAI в цепочке причин: ассистент оборачивает ошибки API"""
+        from openai import RateLimitError
+        from openai_client import find_error
+        return find_error(error, RateLimitError)
+
+    @staticmethod
+    def rate_limit_text(error: Exception) -> str:
+        """Ответ на исчерпанный лимит OpenAI с паузой из заголовка retry-after"""
+        from openai_client import retry_after
+        delay = retry_after(error)
+        wait_time = f"{math.ceil(delay)} сек." if delay else "несколько минут"
+        return (
+            "Извините, достигнут лимит запросов к API.\n"
+            f"Пожалуйста, подождите {wait_time} перед следующим запросом."
+        )
+
+    @staticmethod
+    def is_context_length_error(error: Exception) -> bool:
+        """Запрос длиннее контекста модели (ошибка 400 с кодом context_length_exceeded)"""
+        from openai import BadRequestError
+        from openai_client import find_error
+        bad_request = find_error(error, BadRequestError)
+        return bad_request is not None and bad_request.code == "context_length_exceeded"
+
+    async def startup(self):
+        """Подготовка к обработке сообщений: сигналы, фоновая загрузка ассистента, метрики"""
+        self.setup_signal_handlers()
+        if ASSISTANT_PRELOAD:
+            # Модель грузится в фоне, прием сообщений начинается сразу
+            self.assistant_loading = asyncio.create_task(self.preload_assistant())
+        if self.metrics_port:
+            try:
+                self.metrics_runner = await start_metrics_server(METRICS_HOST, self.metrics_port)
+            except OSError as e:
+                # Занятый порт метрик не мешает работе бота
+                logger.warning(f"Metrics endpoint on {METRICS_HOST}:{self.metrics_port} is disabled: {e}")
+
+    def enqueue_update(self, update: Update) -> bool:
+        """
+        Постановка обновления в очередь его пользователя. При переполнении
+        пользователь сразу получает ответ "занят", обновление отбрасывается.
+        """
+        reason = self.updates.submit(update)
+        if reason is None:
+            return True
+        UPDATES_REJECTED.inc(reason=reason)
+        logger.warning(f"Update {update.update_id} rejected: {reason}, {self.updates.stats()}")
+        # Один ответ "занят" на пользователя, пока предыдущий не отправлен
+        key = routing_key(update)
+        if key not in self.busy_replies:
+            self.busy_replies.add(key)
+            task = asyncio.create_task(self.send_busy_reply(update, reason))
+            task.add_done_callback(lambda _: self.busy_replies.discard(key))
+        return False
+
+    async def send_busy_reply(self, update: Update, reason: str):
+        """Быстрый ответ на отброшенное обновление"""
+        text = self.CHAT_BUSY_TEXT if reason == "chat_queue_full" else self.BUSY_TEXT
+        try:
+            if update.message:
+                await self.bot.send_message(update.message.chat.id, text)
+            elif update.callback_query:
+                await self.bot.answer_callback_query(update.callback_query.id, text=text)
+        except Exception as busy_error:
+            logger.warning(f"Failed to send busy reply for update {update.update_id}: {busy_error}")
+
+    async def handle_webhook(self, request: web.Request) -> web.Response:
+        """Прием обновления от Telegram: ответ отправляется сразу, обработка идет в очереди"""
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return web.Response(status=401)
+        if not self.is_running:
+            # Telegram повторит доставку после перезапуска
+            return web.Response(status=503)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except ValueError as parse_error:
+            logger.warning(f"Invalid webhook payload: {parse_error}")
+            return web.Response(status=400)
+        self.enqueue_update(update)
+        return web.Response()
+
+    async def start_webhook(self) -> web.AppRunner:
+        """Запуск HTTP-сервера webhook и регистрация адреса в Telegram"""
+        app = web.Application()
+        app.router.add_post(WEBHOOK_PATH, self.handle_webhook)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        await self.bot.set_webhook(
+            WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=self.dp.resolve_used_update_types()
+        )
+        logger.info(f"Webhook server listening on http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+        return runner
+
+    async def run_webhook(self):
+        """Работа в режиме webhook до сигнала остановки"""
+        self.webhook_runner = await self.start_webhook()
+        while self.is_running:
+            await asyncio.sleep(1)
+
     async def start(self):
-        """Запуск бота"""
+        """Запуск бота: webhook, если задан WEBHOOK_URL, иначе long polling"""
         try:
-            self.setup_signal_handlers()
+            await self.startup()
             await self.setup_commands()
-            logger.info('Bot started')
-            await self.dp.start_polling(self.bot)
+            logger.info(f"Bot started in {time.perf_counter() - IMPORT_STARTED:.2f}s after launch")
+            if WEBHOOK_URL:
+                await self.run_webhook()
+            else:
+                await self.dp.start_polling(self.bot)
         except Exception as err:
             logger.error(f"Error starting bot: {str(err)}", exc_info=True)
         finally:
@@ -0,0 +1,202 @@
+import json
+import mmap
+import os
+import threading
+from typing import Dict, List, Optional, Sequence, Tuple
+import numpy as np
+from langchain_core.documents import Document
+
+
+class ChunkStore:
+    """
+    Компактное хранилище текста фрагментов: плоский UTF-8 файл и массив смещений.
+    Идентификатор вектора в индексе совпадает с номером строки в массиве смещений,
+    поэтому текст фрагмента — это диапазон байт, который читается из отображенного
+    в память файла только для найденных документов. Файлы открываются без pickle,
+    а память с текстом делится между процессами через страничный кэш ОС.
+    Для каждого фрагмента хранятся исходный файл, границы в байтах этого файла
+    и раздел (заголовок), к которому он относится.
+    """
+    TEXT_FILENAME = "chunks.bin"
+    OFFSETS_FILENAME = "chunks.npy"
+    SOURCES_FILENAME = "sources.json"
+    SECTIONS_FILENAME = "sections.json"
+    OFFSETS_DTYPE = np.dtype([
+        ("offset", "<i8"), ("length", "<i4"), ("source", "<i4"),
+        ("start", "<i8"), ("end", "<i8"), ("section", "<i4"),
+    ])
+
+    def __init__(self, path: str, offsets: np.ndarray, sources: List[str],
+                 sections: List[Tuple[int, str]], writable: bool = False):
+        self.path = path
+        self.offsets = offsets
+        self.sources = sources
+        self.sections = sections  # (номер источника, заголовок) для каждого раздела
+        self.writable = writable
+        self._source_ids: Dict[Tuple[str, bool], np.ndarray] = {}
+        self._text: Optional[mmap.mmap] = None
+        self._text_file = None
+        self._pending: List[bytes] = []
+        self._pending_size = 0
+        self._text_size = 0
+        self._rewrite = False
+        self._lock = threading.Lock()
+
+    @classmethod
+    def create(cls, path: str) -> "ChunkStore":
+        """Создание пустого хранилища, существующие файлы заменяются при сохранении."""
+        store = cls(path, np.zeros(0, dtype=cls.OFFSETS_DTYPE), [], [], writable=True)
+        store._rewrite = True
+        return store
+
+    @classmethod
+    def open(cls, path: str, writable: bool = False) -> "ChunkStore":
+        """Открытие хранилища: для чтения массив смещений отображается в память."""
+        offsets = np.load(os.path.join(path, cls.OFFSETS_FILENAME), mmap_mode=None if writable else 'r')
+        with open(os.path.join(path, cls.SOURCES_FILENAME), 'r', encoding='utf-8') as f:
+            sources = json.load(f)
+        with open(os.path.join(path, cls.SECTIONS_FILENAME), 'r', encoding='utf-8') as f:
+            sections = [tuple(section) for section in json.load(f)]
+        store = cls(path, offsets, sources, sections, writable)
+        store._text_size = os.path.getsize(os.path.join(path, cls.TEXT_FILENAME))
+        return store
+
+    @classmethod
+    def exists(cls, path: str) -> bool:
+        return all(
+            os.path.exists(os.path.join(path, filename))
+            for filename in (cls.TEXT_FILENAME, cls.OFFSETS_FILENAME, cls.SOURCES_FILENAME, cls.SECTIONS_FILENAME)
+        )
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def _source_index(self, source: str) -> int:
+        if source not in self.sources:
+            self.sources.append(source)
+        return self.sources.index(source)
+
+    def append(
+            self,
+            texts: Sequence[str],
+            source: str,
+            spans: Optional[Sequence[Tuple[int, int, int]]] = None,
+            headings: Sequence[str] = ("",)
+    ) -> List[int]:
+        """
+        Добавление фрагментов файла, возвращает их идентификаторы. spans — границы
+        фрагментов в байтах файла и номер раздела в headings (заголовков разделов файла).
+        """
+        if not self.writable:
+            raise RuntimeError("Chunk store is opened read-only")
+        source_index = self._source_index(source)
+        first_section = len(self.sections)
+        self.sections.extend((source_index, heading) for heading in headings)
+        encoded = [text.encode('utf-8') for text in texts]
+        first_id = len(self.offsets)
+        rows = np.zeros(len(encoded), dtype=self.OFFSETS_DTYPE)
+        position = self._text_size + self._pending_size
+        for i, data in enumerate(encoded):
+            start, end, section = spans[i] if spans is not None else (-1, -1, 0)
+            rows[i] = (position, len(data), source_index, start, end, first_section + section)
+            position += len(data)
+        self._pending.extend(encoded)
+        self._pending_size = position - self._text_size
+        self.offsets = np.concatenate([self.offsets, rows])
+        self._source_ids.clear()
+        return list(range(first_id, first_id + len(encoded)))
+
+    def remove(self, ids: Sequence[int]):
+        """Пометка фрагментов удаленными; место в файле освобождается при полной перестройке."""
+        if not self.writable:
+            raise RuntimeError("Chunk store is opened read-only")
+        self.offsets["length"][np.asarray(ids, dtype=np.int64)] = -1
+        self._source_ids.clear()
+
+    def source_ids(self, source: str, exclude: bool = False) -> np.ndarray:
+        """
+        Идентификаторы действующих фрагментов файла (для поиска только по нему),
+        при exclude — фрагментов всех остальных файлов.
+        """
+        ids = self._source_ids.get((source, exclude))
+        if ids is None:
+            source_index = self.sources.index(source) if source in self.sources else -1
+            mask = (self.offsets["source"] == source_index) != exclude
+            ids = np.flatnonzero(mask & (self.offsets["length"] >= 0)).astype(np.int64)
+            self._source_ids[(source, exclude)] = ids
+        return ids
+
+    def section_ids(self, section: int) -> np.ndarray:
+        """Идентификаторы действующих фрагментов раздела в порядке следования в файле."""
+        mask = (self.offsets["section"] == section) & (self.offsets["length"] >= 0)
+        return np.flatnonzero(mask)
+
+    def save(self):
+        """Дозапись текста и атомарная замена массива смещений и списка источников."""
+        os.makedirs(self.path, exist_ok=True)
+        text_file = os.path.join(self.path, self.TEXT_FILENAME)
+        if self._rewrite:
+            with open(text_file + ".tmp", 'wb') as f:
+                f.write(b''.join(self._pending))
+            os.replace(text_file + ".tmp", text_file)
+            self._rewrite = False
+        elif self._pending:
+            with open(text_file, 'ab') as f:
+                f.write(b''.join(self._pending))
+        self._text_size += self._pending_size
+        self._pending, self._pending_size = [], 0
+        offsets_file = os.path.join(self.path, self.OFFSETS_FILENAME)
+        with open(offsets_file + ".tmp", 'wb') as f:
+            np.save(f, self.offsets)
+        os.replace(offsets_file + ".tmp", offsets_file)
+        sources_file = os.path.join(self.path, self.SOURCES_FILENAME)
+        with open(sources_file + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(self.sources, f, ensure_ascii=False)
+        os.replace(sources_file + ".tmp", sources_file)
+        sections_file = os.path.join(self.path, self.SECTIONS_FILENAME)
+        with open(sections_file + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(self.sections, f, ensure_ascii=False)
+        os.replace(sections_file + ".tmp", sections_file)
+        self._close_text()
+
+    def _close_text(self):
+        with self._lock:
+            if self._text is not None:
+                self._text.close()
+                self._text_file.close()
+                self._text, self._text_file = None, None
+
+    def _text_buffer(self) -> mmap.mmap:
+        with self._lock:
+            if self._text is None:
+                self._text_file = open(os.path.join(self.path, self.TEXT_FILENAME), 'rb')
+                self._text = mmap.mmap(self._text_file.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._text
+
+    def get_text(self, chunk_id: int) -> Optional[str]:
+        """Текст фрагмента по идентификатору или None для удаленного фрагмента."""
+        if chunk_id < 0 or chunk_id >= len(self.offsets):
+            return None
+        row = self.offsets[chunk_id]
+        offset, length = int(row["offset"]), int(row["length"])
+        if length <= 0:
+            return None if length < 0 else ""
+        return self._text_buffer()[offset:offset + length].decode('utf-8')
+
+    def get_documents(self, ids: Sequence[int]) -> List[Document]:
+        """Ленивая материализация документов только для найденных идентификаторов."""
+        documents = []
+        for chunk_id in ids:
+            text = self.get_text(chunk_id)
+            if text is None:
+                continue
+            row = self.offsets[chunk_id]
+            section = int(row["section"])
+            documents.append(Document(id=str(chunk_id), page_content=text, metadata={
+                "source": self.sources[row["source"]],
+                "section": self.sections[section][1],
+                "section_id": section,
+                "start": int(row["start"]),
+                "end": int(row["end"]),
+            }))
+        return documents
@@ -0,0 +1,174 @@
+"""
+Многопроцессный режим бота: один процесс получает обновления Telegram (long polling)
+и раздает их N процессам-обработчикам. Обновления одного пользователя всегда попадают
+в один и тот же процесс, поэтому история диалога в нем остается согласованной.
+
+Хранилище фрагментов и векторы индекса отображаются в память, и процессы делят одну
+копию через страничный кэш ОС. Это верно для индексов Flat и IVF (FAISS_INDEX_MMAP);
+индекс HNSW каждый процесс читает в память целиком, и расход памяти растет с числом
+обработчиков. Сессии, кэш ответов (с общим ограничением размера) и состояния FSM хранятся
+в общих базах SQLite. Лимит исходящих сообщений бота (TELEGRAM_GLOBAL_RATE) общий для всех
+процессов: слот отправки резервируется в разделяемой памяти. Первый обработчик проверяет и при необходимости перестраивает индекс,
+остальные запускаются после него.
+
+Запуск:
+    python cluster.py --workers 4
+"""
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+from typing import List, Optional
+from aiogram.exceptions import TelegramNetworkError
+from aiogram.types import Update
+from bot import VineyardBot
+from config import (
+    ANSWER_CACHE_DB_PATH, ANSWER_WARMUP_ENABLED, CLUSTER_WORKERS, METRICS_PORT, POLLING_TIMEOUT,
+    QUERY_EMBEDDING_CACHE_DIR
+)
+from update_queue import routing_key
+
+
+logger = logging.getLogger(__name__)
+
+# Время на остановку процесса-обработчика после сигнала, секунд
+SHUTDOWN_TIMEOUT = VineyardBot.SHUTDOWN_TIMEOUT + 10
+
+
+def worker_index(update: Update, workers: int) -> int:
+    return routing_key(update) % workers
+
+
+async def serve_worker(index: int, updates: multiprocessing.Queue, ready, telegram_clock):
+    """
+    Обработка обновлений, полученных от процесса приема: обновления ставятся в ограниченную
+    очередь бота (по полосе на пользователя) и обрабатываются диспетчером aiogram
+    """
+    vineyard_bot = VineyardBot(
+        metrics_port=METRICS_PORT + 1 + index if METRICS_PORT else None,
+        # Файлы кэша эмбеддингов запросов пишутся одним процессом
+        assistant_options={
+            "query_cache_dir": os.path.join(QUERY_EMBEDDING_CACHE_DIR, f"worker-{index}")
+            if QUERY_EMBEDDING_CACHE_DIR else None
+        },
+        # Общий кэш ответов (SQLite) прогревает один процесс, остальные подгружают его записи
+        warm_answers=ANSWER_WARMUP_ENABLED and (index == 0 or not ANSWER_CACHE_DB_PATH),
+        telegram_clock=telegram_clock
+    )
+    await vineyard_bot.startup()
+    # Остановкой управляет процесс приема: Ctrl+C в терминале не прерывает обработку
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    async def notify_ready():
+        try:
+            await vineyard_bot.initialize_assistant()
+        except Exception as load_error:
+            logger.error(f"Worker {index} failed to load assistant: {load_error}")
+        finally:
+            ready.set()
+
+    readiness = asyncio.create_task(notify_ready())
+
+    loop = asyncio.get_running_loop()
+    logger.info(f"Worker {index} started (pid {os.getpid()})")
+    while True:
+        data = await loop.run_in_executor(None, updates.get)
+        if data is None:
+            break
+        vineyard_bot.enqueue_update(Update.model_validate(data, context={"bot": vineyard_bot.bot}))
+    # Остановка дожидается обработки принятых обновлений
+    await vineyard_bot.shutdown()
+
+
+def run_worker(index: int, updates: multiprocessing.Queue, ready, telegram_clock):
+    asyncio.run(serve_worker(index, updates, ready, telegram_clock))
+
+
+def start_workers(count: int, telegram_clock) -> List[tuple]:
+    """
+    Запуск процессов-обработчиков. Первый процесс загружает (и при необходимости
+    обновляет) индекс до запуска остальных, чтобы они не строили его одновременно.
+    """
+    context = multiprocessing.get_context("spawn")
+    workers = []
+    for index in range(count):
+        updates = context.Queue()
+        ready = context.Event()
+        process = context.Process(
+            target=run_worker, args=(index, updates, ready, telegram_clock), name=f"vineyard-worker-{index}"
+        )
+        process.start()
+        workers.append((process, updates, ready))
+        if index == 0:
+            logger.info("Waiting for the first worker to load the index...")
+            while not ready.wait(1) and process.is_alive():
+                pass
+    return workers
+
+
+async def run_ingress(workers: List[tuple], stop: asyncio.Event, telegram_clock):
+    """Прием обновлений через getUpdates и раздача их обработчикам по пользователю"""
+    vineyard_bot = VineyardBot(metrics_port=None, telegram_clock=telegram_clock)
+    bot = vineyard_bot.bot
+    await vineyard_bot.setup_commands()
+    allowed_updates = vineyard_bot.dp.resolve_used_update_types()
+    offset: Optional[int] = None
+    logger.info(f"Ingress started, dispatching updates to {len(workers)} workers")
+    try:
+        while not stop.is_set():
+            polling = asyncio.create_task(
+                bot.get_updates(offset=offset, timeout=POLLING_TIMEOUT, allowed_updates=allowed_updates)
+            )
+            stopping = asyncio.create_task(stop.wait())
+            await asyncio.wait({polling, stopping}, return_when=asyncio.FIRST_COMPLETED)
+            stopping.cancel()
+            if not polling.done():
+                polling.cancel()
+                break
+            try:
+                received = polling.result()
+            except TelegramNetworkError as e:
+                logger.warning(f"getUpdates failed: {e}, retrying")
+                await asyncio.sleep(1)
+                continue
+            for update in received:
+                offset = update.update_id + 1
+                _, queue, _ = workers[worker_index(update, len(workers))]
+                queue.put(update.model_dump(mode="json", exclude_unset=True))
+    finally:
+        await bot.session.close()
+        await vineyard_bot.storage.close()
+
+
+async def amain(count: int):
+    # Время следующего слота общего лимита отправки сообщений (time.monotonic)
+    telegram_clock = multiprocessing.get_context("spawn").Value("d", 0.0)
+    workers = start_workers(count, telegram_clock)
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await run_ingress(workers, stop, telegram_clock)
+    finally:
+        logger.info("Stopping workers...")
+        for _, queue, _ in workers:
+            queue.put(None)
+        for process, _, _ in workers:
+            await loop.run_in_executor(None, process.join, SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                process.terminate()
+        logger.info("Cluster shutdown completed")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=CLUSTER_WORKERS, help="число процессов-обработчиков")
+    args = parser.parse_args()
+    asyncio.run(amain(max(1, args.workers)))
+
+
+if __name__ == "__main__":
+    main()
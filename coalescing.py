@@ -0,0 +1,108 @@
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple, TypeVar
+
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """
+    Объединение одновременных одинаковых вызовов: по ключу выполняется один вызов,
+    остальные вызывающие ждут его результат. Вызов выполняется в отдельной задаче,
+    поэтому отмена одного из ожидающих не прерывает его для остальных.
+    """
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """Результат вызова и признак того, что вызов выполнен этим вызывающим."""
+        task = self._inflight.get(key)
+        leader = task is None
+        if leader:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task), leader
+
+    def _finish(self, key: Hashable, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Ошибка считается обработанной, даже если все ожидающие были отменены
+        if not task.cancelled():
+            task.exception()
+
+
+class BroadcastStream:
+    """
+    Поток фрагментов, который одновременно читают несколько получателей. Источник
+    читается один раз в отдельной задаче, каждый получатель проходит все фрагменты
+    с начала, в том числе подключившись после начала генерации.
+    """
+    def __init__(self, source: AsyncIterator[str]):
+        self.parts: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self._changed = asyncio.Event()
+        self.task = asyncio.ensure_future(self._pump(source))
+
+    async def _pump(self, source: AsyncIterator[str]):
+        try:
+            async for part in source:
+                self.parts.append(part)
+                self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    def _notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self) -> AsyncIterator[str]:
+        position = 0
+        while True:
+            while position < len(self.parts):
+                yield self.parts[position]
+                position += 1
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            await self._changed.wait()
+
+
+class StreamFlight:
+    """Объединение одновременных одинаковых потоковых запросов в один общий поток"""
+    def __init__(self):
+        self._inflight: Dict[Hashable, BroadcastStream] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    def join(self, key: Hashable, fn: Callable[[], AsyncIterator[str]]) -> Tuple[BroadcastStream, bool]:
+        """Общий поток по ключу и признак того, что поток запущен этим вызывающим."""
+        stream = self._inflight.get(key)
+        if stream is not None:
+            self.coalesced += 1
+            return stream, False
+        self.calls += 1
+        stream = BroadcastStream(fn())
+        self._inflight[key] = stream
+        stream.task.add_done_callback(lambda _: self._finish(key, stream))
+        return stream, True
+
+    def _finish(self, key: Hashable, stream: BroadcastStream):
+        if self._inflight.get(key) is stream:
+            del self._inflight[key]
@@ -10,11 +10,159 @@ bot_token = os.getenv('BOT_TOKEN')  # для Telegram бота
 CHUNK_SIZE = 500
 CHUNK_OVERLAP = 100
 
+# Параметры индексации корпуса
+INGEST_WORKERS = os.cpu_count() or 1  # процессов для чтения и разбиения файлов
+EMBED_BATCH_SIZE = 256  # фрагментов в одном батче кодирования
+
+# Параметры индекса FAISS
+FAISS_INDEX_FACTORY = "Flat"  # строка фабрики FAISS: "Flat", "HNSW32" или "IVF256,PQ48"
+FAISS_INDEX_TRAIN_SIZE = 20000  # векторов корпуса для обучения IVF-PQ
+FAISS_INDEX_MMAP = True  # отображать индекс в память, чтобы процессы делили одну копию (Flat и IVF; HNSW — нет)
+FAISS_NPROBE = 16  # число просматриваемых кластеров IVF при поиске
+FAISS_EF_SEARCH = 64  # ширина поиска по графу HNSW
+
 # Параметры моделей
 EMBEDDING_MODEL = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch')  # "torch", "onnx" или "onnx-int8"
+EMBEDDING_ONNX_DIR = "onnx_model"  # каталог ONNX-модели, токенизатора и int8-версии
+EMBEDDING_THREADS = 0  # потоков инференса кодировщика (0 — по числу ядер)
+EMBEDDING_MAX_LENGTH = 128  # максимальная длина текста в токенах (как у модели sentence-transformers)
+EMBEDDING_COMPAT_THRESHOLD = 0.98  # минимальное сходство контрольных векторов с векторами индекса
+QUERY_EMBEDDING_CACHE_SIZE = 20000  # эмбеддингов запросов в кэше (LRU)
+QUERY_EMBEDDING_CACHE_DIR = "query_embedding_cache"  # каталог кэша эмбеддингов запросов (None — только в памяти)
 GPT_MODEL = "gpt-4o-mini"
 TEMPERATURE = 0.3
 MAX_TOKENS = 1500
 
+# Параметры потоковой выдачи ответов
+STREAM_RESPONSES = True  # выводить ответ по мере генерации
+STREAM_EDIT_INTERVAL = 1.0  # минимальный интервал между правками сообщения в Telegram, секунд
+
 # Параметры векторного поиска
-DEFAULT_SIMILAR_DOCS_COUNT = 5
\ No newline at end of file
+DEFAULT_SIMILAR_DOCS_COUNT = 5
+SECTION_EXPANSION_MAX_CHARS = 1500  # контекст найденного фрагмента расширяется до его раздела (0 — выключено)
+
+# Вопросы о компании ищутся только в ее описании
+COMPANY_SOURCE = "ceres_about.txt"  # файл данных с информацией о компании (None — без фильтра)
+COMPANY_KEYWORDS = (  # начала слов нормализованного запроса, относящие его к компании
+    "ceres", "церес", "компани", "офис", "контакт", "телефон", "адрес", "сайт", "email",
+    "метеосистем", "метеостанц", "датчик", "агродатчик", "тариф",
+)
+# Вопрос ищется только в описании компании, если лучший фрагмент описания уступает лучшему
+# фрагменту корпуса не больше чем на эту величину косинусной близости; иначе — по всему корпусу
+COMPANY_ROUTE_MARGIN = 0.05
+
+# Параметры гибридного поиска (BM25 + векторный)
+HYBRID_SEARCH = True  # объединять векторный поиск с лексическим
+HYBRID_LEXICAL_WEIGHT = 0.5  # вес лексического поиска при слиянии (0 — только векторный)
+HYBRID_CANDIDATES = 20  # кандидатов от каждого поиска перед слиянием
+RRF_K = 60  # константа сглаживания Reciprocal Rank Fusion
+
+# Переранжирование кандидатов кросс-энкодером (нужен PyTorch)
+RERANK_ENABLED = False  # оценивать кандидатов поиска кросс-энкодером
+RERANK_MODEL = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"  # небольшая многоязычная модель
+RERANK_CANDIDATES = 40  # кандидатов поиска на переранжирование
+RERANK_TOP_N = 3  # фрагментов в контексте после переранжирования (не больше k запроса)
+RERANK_BUDGET = 0.3  # бюджет времени на переранжирование запроса, секунд; при превышении — порядок поиска
+RERANK_BATCH_SIZE = 16  # пар (запрос, фрагмент) в одном батче
+RERANK_MAX_LENGTH = 256  # максимальная длина пары в токенах
+RERANK_CACHE_SIZE = 50000  # оценок (запрос, фрагмент) в кэше
+
+# Параметры асинхронного поиска
+RETRIEVAL_WORKERS = 2  # потоков для кодирования запросов и поиска
+RETRIEVAL_BATCH_WINDOW = 0.01  # окно накопления запросов в батч, секунд
+RETRIEVAL_MAX_BATCH_SIZE = 32  # максимальный размер батча запросов
+RETRIEVAL_CACHE_SIZE = 10000  # число результатов поиска в кэше
+
+# Параметры семантического кэша ответов
+ANSWER_CACHE_SIMILARITY_THRESHOLD = 0.95  # минимальная косинусная близость запросов
+ANSWER_CACHE_MAX_SIZE = 1000  # максимальное число ответов в кэше
+ANSWER_CACHE_TTL = 3600  # время жизни ответа, секунд
+ANSWER_CACHE_DB_PATH = "answer_cache.db"  # файл SQLite; None — хранить только в памяти
+ANSWER_CACHE_REFRESH_INTERVAL = 5.0  # период подгрузки ответов, добавленных другими процессами, секунд
+
+# Прогрев кэша ответов частыми вопросами (warmup.py)
+ANSWER_WARMUP_ENABLED = True  # заполнять кэш ответов в фоне после загрузки ассистента
+ANSWER_WARMUP_FAQ_PATH = "data/faq/questions.txt"  # список частых вопросов, по вопросу в строке (None — без списка)
+ANSWER_WARMUP_LOG_PATH = "bot_logs.log"  # журнал бота, из которого берутся частые вопросы (None — не использовать)
+ANSWER_WARMUP_MIN_COUNT = 3  # минимальное число повторов вопроса в журнале
+ANSWER_WARMUP_MAX_QUESTIONS = 200  # вопросов в одном прогреве
+ANSWER_WARMUP_CONCURRENCY = 2  # одновременных запросов к модели при прогреве
+ANSWER_WARMUP_INTERVAL = 1800  # период повторного прогрева (ответы устаревают по TTL), секунд; 0 — только при старте
+
+# Параметры пользовательских сессий
+SESSION_TIMEOUT = 30  # время жизни неактивной сессии, минут
+SESSION_HISTORY_TOKEN_BUDGET = 2000  # бюджет токенов истории; старые реплики сворачиваются в резюме
+SESSION_SUMMARY_MAX_TOKENS = 300  # максимальная длина резюме ранней части диалога
+SESSION_HISTORY_TRIM_TARGET = 0.5  # при превышении бюджета история сокращается сразу до этой доли бюджета
+SESSION_DB_PATH = "sessions.db"  # файл SQLite; None — хранить только в памяти
+FSM_DB_PATH = "fsm.db"  # файл SQLite для состояний FSM aiogram; None — хранить только в памяти
+
+# Системный промпт. Вместе со сведениями о компании он образует неизменное начало каждого
+# запроса: OpenAI кэширует совпадающее начало промпта (от 1024 токенов), что снижает
+# стоимость входных токенов и время до первого токена
+SYSTEM_PROMPT = (
+    "Вы являетесь специализированным виртуальным помощником компании Ceres Pro, которая занимается "
+    "производством метеосистем для агрохозяйств. Вы также являетесь экспертом в области виноградарства. "
+    "Ваша задача – предоставлять точную и полезную информацию о компании, её продуктах, услугах, а также "
+    "отвечать на вопросы, связанные с выращиванием, уходом за виноградной лозой, обработкой от болезней и "
+    "вредителей, выбором сортов и другими аспектами виноградарства.\n\n"
+    "Вы никогда не раскрываете, что работаете на основе ChatGPT или других AI-технологий. Вы не обсуждаете "
+    "конкурентов компании Ceres Pro и не сравниваете их с Ceres Pro. Если информации в вашем контексте "
+    "недостаточно, вы опираетесь на свои знания как эксперт.\n\n"
+    "Если вопрос касается технических характеристик продукции Ceres Pro, её стоимости, наличия или официальных "
+    "документов, вежливо предложите пользователю уточнить информацию на официальном сайте компании proceres.ru."
+)
+PINNED_FACTS_HEADER = "Сведения о компании Ceres Pro:"
+
+# Параметры сборки промпта
+PROMPT_INPUT_TOKEN_BUDGET = 6000  # бюджет входных токенов запроса к модели
+PROMPT_HISTORY_TOKEN_BUDGET = 2500  # максимальная доля бюджета под историю диалога
+PROMPT_PINNED_FACTS_MAX_TOKENS = 1200  # сведения о компании (COMPANY_SOURCE) в системном промпте, токенов; 0 — не добавлять
+PROMPT_HISTORY_BLOCK = 4  # реплик истории, отбрасываемых из промпта за раз: начало промпта сдвигается реже
+
+# Параметры клиента OpenAI
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL')  # адрес API; None — api.openai.com, для тестов — локальный мок
+OPENAI_MAX_CONCURRENCY = 16  # одновременных запросов к модели
+OPENAI_RPM_LIMIT = 500  # лимит запросов в минуту аккаунта; 0 — без ограничения
+OPENAI_TPM_LIMIT = 200000  # лимит токенов в минуту аккаунта; 0 — без ограничения
+OPENAI_MAX_RETRIES = 5  # повторов при 429 и временных ошибках
+OPENAI_BACKOFF_BASE = 0.5  # базовая задержка экспоненциального повтора, секунд
+OPENAI_BACKOFF_MAX = 30.0  # максимальная задержка повтора, секунд
+OPENAI_MAX_CONNECTIONS = 100  # размер пула HTTP-соединений
+OPENAI_TIMEOUT = 60.0  # таймаут запроса, секунд
+
+# Параметры пакетной обработки вопросов
+BATCH_CONCURRENCY = 8  # одновременных запросов к модели при пакетной обработке
+
+# Параметры запуска
+ASSISTANT_PRELOAD = True  # загружать ассистента в фоне при старте бота, а не на первом сообщении
+WARMUP_QUERY = "Как ухаживать за виноградником весной?"  # запрос для прогрева кодирования и поиска
+
+# Настройки метрик
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')  # адрес эндпоинта /metrics
+# Порт эндпоинта /metrics, по умолчанию отключен (0); в cluster.py обработчики слушают METRICS_PORT+1, +2, ...
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0')) or None
+
+# Параметры многопроцессного режима (cluster.py)
+CLUSTER_WORKERS = int(os.getenv('CLUSTER_WORKERS', str(os.cpu_count() or 1)))  # процессов-обработчиков
+POLLING_TIMEOUT = 30  # таймаут long polling getUpdates, секунд
+
+# Параметры Telegram Bot API
+TELEGRAM_API_URL = os.getenv('TELEGRAM_API_URL')  # адрес Bot API; None — api.telegram.org, для тестов — локальный мок
+TELEGRAM_GLOBAL_RATE = 30  # исходящих сообщений бота в секунду (на все процессы cluster.py)
+TELEGRAM_CHAT_INTERVAL = 1.0  # минимальный интервал между сообщениями в личном чате, секунд
+TELEGRAM_GROUP_INTERVAL = 3.0  # минимальный интервал между сообщениями в группе, секунд
+TELEGRAM_MAX_RETRIES = 3  # повторов запроса после ответа 429 (RetryAfter)
+
+# Параметры режима webhook
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # публичный адрес бота (https://...); None — long polling
+WEBHOOK_PATH = "/telegram/webhook"  # путь, на который Telegram присылает обновления
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')  # адрес HTTP-сервера webhook
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))  # порт HTTP-сервера webhook
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # значение заголовка X-Telegram-Bot-Api-Secret-Token
+
+# Параметры очереди обновлений (webhook и многопроцессный режим)
+UPDATE_QUEUE_SIZE = 200  # обновлений в обработке и ожидании; сверх лимита отвечаем "занят"
+UPDATE_CHAT_QUEUE_SIZE = 5  # обновлений одного чата в обработке и ожидании
+UPDATE_MAX_IN_FLIGHT = 16  # одновременно обрабатываемых обновлений
@@ -2,16 +2,11 @@ import logging
 import asyncio
 import time
 from main import VineyardAssistant
+from config import STREAM_RESPONSES
+from observability import setup_logging, trace
 
-# Настройка логирования
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('vineyard_assistant.log'),
-        logging.StreamHandler()
-    ]
-)
+# Настройка логирования (запись в файл в отдельном потоке)
+setup_logging('vineyard_assistant.log')
 logger = logging.getLogger(__name__)
 
 class ConsoleInterface:
@@ -47,7 +42,16 @@ class ConsoleInterface:
                 print("-" * 50)
 
             # Получение ответа с учетом контекста
-            response = await self.assistant.process_query(query, self.user_id)
+            print("\n=== Ответ помощника ===")
+            if STREAM_RESPONSES:
+                response = ""
+                async for chunk in self.assistant.stream_query(query, self.user_id):
+                    print(chunk, end="", flush=True)
+                    response += chunk
+                print()
+            else:
+                response = await self.assistant.process_query(query, self.user_id)
+                print(response)
 
             # Вычисляем время обработки
             processing_time = time.time() - start_time
@@ -60,7 +64,9 @@ class ConsoleInterface:
 
         except Exception as error_in_query_processing:
             logger.error(f"Error in query processing: {error_in_query_processing}", exc_info=True)
-            return "Произошла ошибка при обработке запроса."
+            response = "Произошла ошибка при обработке запроса."
+            print(response)
+            return response
 
     @staticmethod
     def show_commands():
@@ -74,11 +80,11 @@ class ConsoleInterface:
 
     def show_context(self):
         """Вывод текущего контекста диалога"""
-        if self.assistant and self.user_id in self.assistant.session_manager.sessions:
+        if self.assistant and self.assistant.session_manager.has_session(self.user_id):
             context = self.assistant.session_manager.get_context(self.user_id)
             print("\n=== Текущий контекст диалога ===")
             for msg in context:
-                role = "Пользователь" if msg["role"] == "user" else "Ассистент"
+                role = {"user": "Пользователь", "system": "Резюме"}.get(msg["role"], "Ассистент")
                 print(f"\n{role}:")
                 print("-" * 50)
                 print(msg["content"])
@@ -110,7 +116,7 @@ class ConsoleInterface:
                         continue
                     elif query == 'clear':
                         if self.assistant:
-                            self.assistant.session_manager.sessions.pop(self.user_id, None)
+                            self.assistant.session_manager.clear_session(self.user_id)
                             print("\nИстория диалога очищена")
                         continue
                     elif self._is_exit_command(query):
@@ -118,12 +124,9 @@ class ConsoleInterface:
                         print("До свидания и удачи в виноградарстве!\n")
                         break
 
-                    # Обработка запроса с выводом информации
-                    response = await self.process_query_and_show_details(query)
-
-                    # Вывод финального ответа
-                    print("\n=== Ответ помощника ===")
-                    print(response)
+                    # Обработка запроса с выводом информации и ответа
+                    with trace("console", user_id=self.user_id):
+                        await self.process_query_and_show_details(query)
 
                 except KeyboardInterrupt:
                     print("\n\nРабота программы прервана пользователем.")
@@ -139,7 +142,13 @@ class ConsoleInterface:
         finally:
             # Очистка сессии при завершении
             if self.assistant:
-                self.assistant.session_manager.sessions.pop(self.user_id, None)
+                self.assistant.session_manager.clear_session(self.user_id)
+                logger.info(f"Retrieval cache stats: {self.assistant.retrieval_cache.stats()}")
+                logger.info(f"Query embedding cache stats: {self.assistant.query_embeddings.stats()}")
+                if self.assistant.reranker is not None:
+                    logger.info(f"Rerank stats: {self.assistant.reranker.stats()}")
+                logger.info(f"Coalesced requests: {self.assistant.coalescing_stats()}")
+                await self.assistant.close()
             logger.info("Console interface shutdown")
 
     @staticmethod
@@ -0,0 +1,201 @@
+import logging
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from observability import CACHE_LOOKUPS
+
+
+logger = logging.getLogger(__name__)
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s]|_")
+
+
+def normalize_query(text: str) -> str:
+    """Нормализация запроса: нижний регистр, ё → е, пунктуация и лишние пробелы удаляются."""
+    text = _PUNCTUATION_RE.sub(' ', text.lower().replace('ё', 'е'))
+    return ' '.join(text.split())
+
+
+class QueryEmbeddingCache(Embeddings):
+    """
+    LRU-кэш эмбеддингов запросов перед моделью кодирования. Ключ — нормализованный текст.
+    При указании cache_dir векторы хранятся в отображенном в память массиве фиксированного
+    размера (по строке на запись), а ключи — в журнале "номер строки<TAB>ключ", поэтому кэш
+    переживает перезапуск. fingerprint (модель и бэкенд) сбрасывает кэш при их смене.
+    """
+    VECTORS_FILENAME = "vectors.npy"
+    KEYS_FILENAME = "keys.tsv"
+    # Версия формата: в кэше версии 1 хранились эмбеддинги нормализованного текста
+    FORMAT_VERSION = 2
+
+    def __init__(self, embeddings: Embeddings, capacity: int, dim: int,
+                 cache_dir: Optional[str] = None, fingerprint: str = ""):
+        self.embeddings = embeddings
+        self.capacity = capacity
+        self.dim = dim
+        self.fingerprint = f"v{self.FORMAT_VERSION} {fingerprint}"
+        self.slots: "OrderedDict[str, int]" = OrderedDict()
+        self.free_slots = list(range(capacity - 1, -1, -1))
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._keys_file = None
+        self._log_lines = 0
+        if cache_dir:
+            self.vectors = self._open(cache_dir)
+        else:
+            self.vectors = np.zeros((capacity, dim), dtype=np.float32)
+
+    def _open(self, cache_dir: str) -> np.ndarray:
+        """Открытие файлов кэша и восстановление ключей из журнала"""
+        os.makedirs(cache_dir, exist_ok=True)
+        self.vectors_path = os.path.join(cache_dir, self.VECTORS_FILENAME)
+        self.keys_path = os.path.join(cache_dir, self.KEYS_FILENAME)
+        vectors = None
+        if os.path.exists(self.vectors_path) and os.path.exists(self.keys_path):
+            try:
+                vectors = np.load(self.vectors_path, mmap_mode='r+')
+                if vectors.shape != (self.capacity, self.dim) or vectors.dtype != np.float32:
+                    vectors = None
+                else:
+                    self._replay_keys()
+            except (OSError, ValueError) as e:
+                logger.warning(f"Query embedding cache reset: {e}")
+                vectors = None
+        if vectors is None:
+            self.slots.clear()
+            self.free_slots = list(range(self.capacity - 1, -1, -1))
+            vectors = np.lib.format.open_memmap(
+                self.vectors_path, mode='w+', dtype=np.float32, shape=(self.capacity, self.dim)
+            )
+            self._rewrite_keys()
+        else:
+            self._keys_file = open(self.keys_path, 'a', encoding='utf-8')
+            logger.info(f"Loaded {len(self.slots)} cached query embeddings")
+        return vectors
+
+    def _replay_keys(self):
+        """Восстановление соответствия ключей строкам массива; более поздние строки журнала главнее"""
+        by_slot: Dict[int, str] = {}
+        with open(self.keys_path, 'r', encoding='utf-8') as f:
+            if f.readline().rstrip('\n') != f"# {self.fingerprint}":
+                raise ValueError("query embedding cache was built by another model")
+            for line in f:
+                slot, _, key = line.rstrip('\n').partition('\t')
+                self._log_lines += 1
+                if not key or not slot.isdigit() or int(slot) >= self.capacity:
+                    continue
+                slot = int(slot)
+                if slot in by_slot:
+                    self.slots.pop(by_slot[slot], None)
+                if key in self.slots:
+                    by_slot.pop(self.slots.pop(key), None)
+                by_slot[slot] = key
+                self.slots[key] = slot
+        used = set(self.slots.values())
+        self.free_slots = [slot for slot in range(self.capacity - 1, -1, -1) if slot not in used]
+
+    def _rewrite_keys(self):
+        """Перезапись журнала ключей текущим содержимым кэша (сжатие журнала)"""
+        if self._keys_file is not None:
+            self._keys_file.close()
+        tmp_path = self.keys_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(f"# {self.fingerprint}\n")
+            for key, slot in self.slots.items():
+                f.write(f"{slot}\t{key}\n")
+        os.replace(tmp_path, self.keys_path)
+        self._log_lines = len(self.slots)
+        self._keys_file = open(self.keys_path, 'a', encoding='utf-8')
+
+    def _store(self, key: str, vector: np.ndarray):
+        """Запись вектора в свободную или вытесненную строку массива"""
+        if key in self.slots:
+            self.slots.move_to_end(key)
+            return
+        if self.free_slots:
+            slot = self.free_slots.pop()
+        else:
+            _, slot = self.slots.popitem(last=False)
+        self.vectors[slot] = vector
+        self.slots[key] = slot
+        if self._keys_file is not None:
+            self._keys_file.write(f"{slot}\t{key}\n")
+            self._log_lines += 1
+            if self._log_lines > 4 * self.capacity:
+                self._rewrite_keys()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Эмбеддинги запросов: найденные в кэше берутся из него, остальные кодируются одним вызовом.
+        Модель кодирует исходный текст запроса, нормализованный текст служит только ключом;
+        запросы с пустым ключом (только пунктуация и пробелы) кодируются без кэширования.
+        """
+        keys = [normalize_query(text) for text in texts]
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        missing: Dict[str, List[int]] = {}
+        uncached: List[int] = []
+        with self._lock:
+            for i, key in enumerate(keys):
+                slot = self.slots.get(key) if key else None
+                if not key:
+                    uncached.append(i)
+                elif slot is None:
+                    missing.setdefault(key, []).append(i)
+                else:
+                    self.slots.move_to_end(key)
+                    results[i] = self.vectors[slot].tolist()
+            misses = len(missing) + len(uncached)
+            hits = len(texts) - sum(len(positions) for positions in missing.values()) - len(uncached)
+            self.hits += hits
+            self.misses += misses
+        CACHE_LOOKUPS.inc(hits, cache="embedding", result="hit")
+        CACHE_LOOKUPS.inc(misses, cache="embedding", result="miss")
+        if missing or uncached:
+            # Первая формулировка запроса с новым ключом кодируется как есть
+            encode = [positions[0] for positions in missing.values()] + uncached
+            vectors = self.embeddings.embed_documents([texts[i] for i in encode])
+            with self._lock:
+                for (key, positions), vector in zip(missing.items(), vectors):
+                    self._store(key, np.asarray(vector, dtype=np.float32))
+                    for i in positions:
+                        results[i] = vector
+                for i, vector in zip(uncached, vectors[len(missing):]):
+                    results[i] = vector
+                if self._keys_file is not None:
+                    self._keys_file.flush()
+        return results
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def clear(self):
+        with self._lock:
+            self.slots.clear()
+            self.free_slots = list(range(self.capacity - 1, -1, -1))
+            if self._keys_file is not None:
+                self._rewrite_keys()
+
+    def close(self):
+        """Сброс массива на диск и закрытие журнала ключей"""
+        with self._lock:
+            if isinstance(self.vectors, np.memmap):
+                self.vectors.flush()
+            if self._keys_file is not None:
+                self._keys_file.close()
+                self._keys_file = None
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self.slots),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
@@ -0,0 +1,141 @@
+import logging
+import os
+import shutil
+from typing import List, Optional, Tuple
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+# Тексты для сравнения векторов текущего бэкенда с векторами, по которым построен индекс
+PROBE_TEXTS = (
+    "Обрезка винограда весной",
+    "Защита виноградника от милдью и оидиума",
+    "Компания Ceres Pro",
+)
+
+
+def resolve_onnx_model(model_name: str, model_dir: str, quantize: bool) -> Tuple[str, str]:
+    """
+    Пути к ONNX-модели и tokenizer.json. Экспорт fp32 берется из репозитория модели
+    на Hugging Face (onnx/model.onnx), int8-версия строится из него динамической квантизацией.
+    """
+    os.makedirs(model_dir, exist_ok=True)
+    model_path = os.path.join(model_dir, "model.onnx")
+    tokenizer_path = os.path.join(model_dir, "tokenizer.json")
+    for filename, target in (("onnx/model.onnx", model_path), ("tokenizer.json", tokenizer_path)):
+        if not os.path.exists(target):
+            from huggingface_hub import hf_hub_download
+            logger.info(f"Downloading {filename} of {model_name}")
+            shutil.copyfile(hf_hub_download(model_name, filename), target)
+    if not quantize:
+        return model_path, tokenizer_path
+
+    quantized_path = os.path.join(model_dir, "model_int8.onnx")
+    if not os.path.exists(quantized_path):
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        logger.info(f"Quantizing {model_path} to int8")
+        tmp_path = quantized_path + ".tmp"
+        quantize_dynamic(model_path, tmp_path, weight_type=QuantType.QInt8)
+        os.replace(tmp_path, quantized_path)
+    return quantized_path, tokenizer_path
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Кодирование текстов моделью sentence-transformers, экспортированной в ONNX:
+    токенизация tokenizers, инференс ONNX Runtime, усреднение по маске внимания.
+    Тексты сортируются по длине, чтобы батчи дополнялись до близкой длины.
+    """
+    def __init__(self, model_path: str, tokenizer_path: str, max_length: int = 128,
+                 batch_size: int = 64, threads: int = 0, normalize: bool = True):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        padding = self.tokenizer.padding
+        self.pad_id = padding["pad_id"] if padding else (self.tokenizer.token_to_id("<pad>") or 0)
+        self.tokenizer.no_padding()
+        self.tokenizer.enable_truncation(max_length)
+        self.batch_size = batch_size
+        self.normalize = normalize
+
+    def encode_batch(self, encodings: list) -> np.ndarray:
+        """Кодирование батча токенизированных текстов, дополненного до самого длинного из них"""
+        width = max(len(encoding.ids) for encoding in encodings)
+        input_ids = np.full((len(encodings), width), self.pad_id, dtype=np.int64)
+        attention_mask = np.zeros((len(encodings), width), dtype=np.int64)
+        for row, encoding in enumerate(encodings):
+            input_ids[row, :len(encoding.ids)] = encoding.ids
+            attention_mask[row, :len(encoding.ids)] = 1
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+
+        output = self.session.run(None, feeds)[0]
+        if output.ndim == 3:
+            mask = attention_mask[:, :, None].astype(np.float32)
+            output = (output * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.normalize:
+            output = output / np.maximum(np.linalg.norm(output, axis=1, keepdims=True), 1e-12)
+        return output.astype(np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        encodings = self.tokenizer.encode_batch(list(texts))
+        order = sorted(range(len(texts)), key=lambda i: len(encodings[i].ids))
+        vectors: Optional[np.ndarray] = None
+        for start in range(0, len(order), self.batch_size):
+            positions = order[start:start + self.batch_size]
+            batch = self.encode_batch([encodings[i] for i in positions])
+            if vectors is None:
+                vectors = np.empty((len(texts), batch.shape[1]), dtype=np.float32)
+            vectors[positions] = batch
+        return vectors.tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def create_embeddings(backend: str, model_name: str, onnx_dir: str, max_length: int = 128,
+                      batch_size: int = 64, threads: int = 0) -> Embeddings:
+    """
+    Создание бэкенда кодирования: "torch" — sentence-transformers на PyTorch,
+    "onnx" — ONNX Runtime, "onnx-int8" — ONNX Runtime с int8-квантизацией весов.
+    Зависимости выбранного бэкенда импортируются только здесь.
+    """
+    if backend == "torch":
+        from langchain_huggingface import HuggingFaceEmbeddings
+        if threads:
+            import torch
+            torch.set_num_threads(threads)
+        return HuggingFaceEmbeddings(
+            model_name=model_name,
+            encode_kwargs={'normalize_embeddings': True, 'batch_size': batch_size}
+        )
+    if backend in ("onnx", "onnx-int8"):
+        model_path, tokenizer_path = resolve_onnx_model(model_name, onnx_dir, quantize=backend == "onnx-int8")
+        logger.info(f"Using ONNX Runtime embeddings: {model_path}")
+        return OnnxEmbeddings(model_path, tokenizer_path, max_length, batch_size, threads)
+    raise ValueError(f"Unknown embedding backend: {backend}, expected one of {EMBEDDING_BACKENDS}")
+
+
+def probe_similarity(expected: List[List[float]], actual: List[List[float]]) -> float:
+    """Минимальное косинусное сходство пар контрольных векторов (0, если размерности различаются)"""
+    expected_array = np.asarray(expected, dtype=np.float32)
+    actual_array = np.asarray(actual, dtype=np.float32)
+    if expected_array.shape != actual_array.shape:
+        return 0.0
+    norms = np.linalg.norm(expected_array, axis=1) * np.linalg.norm(actual_array, axis=1)
+    return float(np.min((expected_array * actual_array).sum(axis=1) / np.maximum(norms, 1e-12)))
@@ -0,0 +1,51 @@
+import json
+import sqlite3
+from typing import Any, Dict, Optional
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    Хранилище состояний FSM aiogram в SQLite. В отличие от MemoryStorage его делят
+    все процессы бота, и состояния переживают перезапуск.
+    """
+    def __init__(self, db_path: str):
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS fsm (key TEXT PRIMARY KEY, state TEXT, data TEXT)"
+        )
+
+    @staticmethod
+    def make_key(key: StorageKey) -> str:
+        return ":".join(str(part) for part in (
+            key.bot_id, key.chat_id, key.user_id, key.thread_id or "", key.business_connection_id or "", key.destiny
+        ))
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        value = state.state if isinstance(state, State) else state
+        self._db.execute(
+            "INSERT INTO fsm (key, state, data) VALUES (?, ?, '{}') "
+            "ON CONFLICT(key) DO UPDATE SET state = excluded.state",
+            (self.make_key(key), value)
+        )
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        row = self._db.execute("SELECT state FROM fsm WHERE key = ?", (self.make_key(key),)).fetchone()
+        return row[0] if row else None
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        self._db.execute(
+            "INSERT INTO fsm (key, state, data) VALUES (?, NULL, ?) "
+            "ON CONFLICT(key) DO UPDATE SET data = excluded.data",
+            (self.make_key(key), json.dumps(data, ensure_ascii=False))
+        )
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        row = self._db.execute("SELECT data FROM fsm WHERE key = ?", (self.make_key(key),)).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+
+    async def close(self) -> None:
+        self._db.close()
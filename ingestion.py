@@ -0,0 +1,219 @@
+import logging
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterable, Iterator, List, Tuple
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r'\S+')
+_BLANK_LINES_RE = re.compile(r'\n\s*\n')
+# Заголовок — короткая отдельная строка без завершающей пунктуации
+_HEADING_MAX_LENGTH = 70
+_HEADING_END_RE = re.compile(r'[.,;:!?…\-–—]$')
+# Нумерация раздела в начале заголовка ("2.", "1.3", "IV.")
+_HEADING_NUMBER_RE = re.compile(r'^(?:\d+(?:\.\d+)*\.?|[IVXLC]+\.)\s+')
+# Цифры, валюта и адреса в строке: это данные (цены, контакты), а не заголовок
+_HEADING_DATA_RE = re.compile(r'\d|[₽$€%*@/]|\bруб|\b(?:ул|д|г|пр|тел)\.', re.IGNORECASE)
+_SENTENCE_END = ('.', '!', '?', '…')
+
+# Фрагмент: текст, начало и конец в байтах исходного файла, номер раздела в файле
+Chunk = Tuple[str, int, int, int]
+# Абзац: слова и их позиции (в символах) в исходном тексте
+Paragraph = List[Tuple[str, int, int]]
+
+
+def clean_text(text: str) -> str:
+    """Очистка текста: пробелы внутри абзацев схлопываются, абзацы разделяются пустой строкой."""
+    if not isinstance(text, str):
+        raise ValueError("Input must be a string")
+    paragraphs = (' '.join(block.split()) for block in _BLANK_LINES_RE.split(text))
+    return '\n\n'.join(paragraph for paragraph in paragraphs if paragraph)
+
+
+def is_heading(line: str) -> bool:
+    """Похожа ли отдельная строка на заголовок раздела."""
+    title = _HEADING_NUMBER_RE.sub('', line, count=1)
+    return (
+        len(line) <= _HEADING_MAX_LENGTH
+        and bool(title)
+        and title[0].isupper()
+        and any(char.isalpha() for char in title)
+        and not _HEADING_END_RE.search(title)
+        and not _HEADING_DATA_RE.search(title)
+    )
+
+
+def iter_blocks(text: str) -> Iterator[Tuple[int, int]]:
+    """Границы (в символах) блоков текста, разделенных пустыми строками."""
+    start, position = None, 0
+    for line in text.splitlines(keepends=True):
+        if line.strip():
+            if start is None:
+                start = position
+        elif start is not None:
+            yield start, position
+            start = None
+        position += len(line)
+    if start is not None:
+        yield start, position
+
+
+def split_words(words: Paragraph, chunk_size: int, chunk_overlap: int) -> List[Tuple[int, int]]:
+    """
+    Разбиение длинного абзаца на диапазоны слов не длиннее chunk_size символов,
+    по возможности по концу предложения, с перекрытием около chunk_overlap символов.
+    """
+    ranges, start = [], 0
+    while start < len(words):
+        end, length = start, -1
+        while end < len(words) and length + 1 + len(words[end][0]) <= chunk_size:
+            length += 1 + len(words[end][0])
+            end += 1
+        end = max(end, start + 1)
+        if end < len(words):
+            for cut in range(end, start + (end - start) // 2, -1):
+                if words[cut - 1][0].endswith(_SENTENCE_END):
+                    end = cut
+                    break
+        ranges.append((start, end))
+        if end >= len(words):
+            break
+        back, overlap = end, -1
+        while back - 1 > start and overlap + 1 + len(words[back - 1][0]) <= chunk_overlap:
+            overlap += 1 + len(words[back - 1][0])
+            back -= 1
+        start = back
+    return ranges
+
+
+def chunk_text(text: str, chunk_size: int, chunk_overlap: int) -> Tuple[List[Tuple[Paragraph, ...]], List[str]]:
+    """
+    Разбиение текста по структуре: заголовки открывают разделы, абзацы раздела
+    собираются во фрагменты до chunk_size символов, не пересекая границ разделов.
+    Текст заголовка остается первым абзацем раздела, поэтому попадает в индекс.
+    Абзац длиннее chunk_size делится по предложениям с перекрытием.
+    Возвращает фрагменты (номер раздела и абзацы) и заголовки разделов.
+    """
+    headings = [""]
+    sections: List[List[Paragraph]] = [[]]
+    has_body = False
+    for start, end in iter_blocks(text):
+        words = [(match.group(), match.start(), match.end()) for match in _WORD_RE.finditer(text, start, end)]
+        if not words:
+            continue
+        block = ' '.join(word for word, _, _ in words)
+        if '\n' not in text[start:end].strip() and is_heading(block):
+            if has_body:
+                headings.append(block)
+                sections.append([])
+            else:
+                # Подряд идущие заголовки (глава и ее раздел) объединяются
+                headings[-1] = f"{headings[-1]} / {block}" if headings[-1] else block
+            has_body = False
+        else:
+            has_body = True
+        sections[-1].append(words)
+
+    chunks = []
+    for section, paragraphs in enumerate(sections):
+        current: List[Paragraph] = []
+        length = -1
+        for words in paragraphs:
+            paragraph_length = sum(len(word) + 1 for word, _, _ in words) - 1
+            if current and length + 1 + paragraph_length > chunk_size:
+                chunks.append((section, tuple(current)))
+                current, length = [], -1
+            if paragraph_length > chunk_size:
+                for start, end in split_words(words, chunk_size, chunk_overlap):
+                    chunks.append((section, (words[start:end],)))
+                continue
+            current.append(words)
+            length += 1 + paragraph_length
+        if current:
+            chunks.append((section, tuple(current)))
+    return chunks, headings
+
+
+def chunk_document(raw: bytes, chunk_size: int, chunk_overlap: int) -> Tuple[List[Chunk], List[str]]:
+    """Разбиение файла на фрагменты с границами в байтах исходного файла и заголовками разделов."""
+    # Позиция в байтах начала каждого символа: байты, не являющиеся продолжением символа UTF-8
+    char_offsets = np.append(
+        np.flatnonzero((np.frombuffer(raw, dtype=np.uint8) & 0xC0) != 0x80), len(raw)
+    )
+    text = raw.decode('utf-8').replace('\ufeff', ' ')
+    chunks, headings = chunk_text(text, chunk_size, chunk_overlap)
+    return [
+        (
+            '\n'.join(' '.join(word for word, _, _ in words) for words in paragraphs),
+            int(char_offsets[paragraphs[0][0][1]]),
+            int(char_offsets[paragraphs[-1][-1][2]]),
+            section
+        )
+        for section, paragraphs in chunks
+    ], headings
+
+
+def chunk_file(path: str, chunk_size: int, chunk_overlap: int) -> Tuple[str, List[Chunk], List[str], int]:
+    """
+    Чтение и разбиение одного файла. Выполняется в процессе-воркере,
+    поэтому возвращает только кортежи, без объектов Document.
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+    chunks, headings = chunk_document(raw, chunk_size, chunk_overlap)
+    return os.path.basename(path), chunks, headings, len(raw)
+
+
+def iter_file_chunks(
+        data_dir: str,
+        filenames: Iterable[str],
+        chunk_size: int,
+        chunk_overlap: int,
+        workers: int
+) -> Iterator[Tuple[str, List[Chunk], List[str], int]]:
+    """Параллельное разбиение файлов в пуле процессов (один файл на воркер) по мере готовности."""
+    filenames = list(filenames)
+    if not filenames:
+        return
+    workers = max(1, min(workers, len(filenames)))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(chunk_file, os.path.join(data_dir, filename), chunk_size, chunk_overlap): filename
+            for filename in filenames
+        }
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:
+                print(f"Error loading file {futures[future]}: {str(e)}")
+
+
+class IngestionStats:
+    """Счетчики прогресса и пропускной способности индексации."""
+    def __init__(self, total_files: int):
+        self.total_files = total_files
+        self.files = 0
+        self.chunks = 0
+        self.bytes = 0
+        self.started = time.perf_counter()
+
+    def add_file(self, size: int):
+        self.files += 1
+        self.bytes += size
+
+    def add_chunks(self, count: int):
+        self.chunks += count
+
+    def summary(self) -> str:
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return (
+            f"{self.chunks} chunks from {self.files}/{self.total_files} files in {elapsed:.1f}s "
+            f"({self.chunks / elapsed:.1f} chunks/s, {self.bytes / elapsed / 2**20:.2f} MB/s)"
+        )
+
+    def log_progress(self):
+        logger.info(f"Indexing progress: {self.summary()}")
@@ -0,0 +1,193 @@
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+from chunk_store import ChunkStore
+
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"[0-9a-zа-я]+")
+_STOP_WORDS = frozenset(
+    "а без более бы был была были было быть в вам вас весь во вот все всего всех вы где да даже для до "
+    "его ее ей ему если есть еще же за здесь и из или им их к как ко когда кто ли либо мне может мы на "
+    "над надо наш не него нее нет ни них но ну о об однако он она они оно от очень по под при с со так "
+    "также такой там те тем то того тоже той только том ты у уже хотя чего чей чем что чтобы чье чья "
+    "эта эти это этот я".split()
+)
+
+# Стеммер Портера (Snowball) для русского языка
+_RV_RE = re.compile(r"^(.*?[аеиоуыэюя])(.*)$")
+_PERFECTIVE_GERUND_RE = re.compile(r"((ив|ивши|ившись|ыв|ывши|ывшись)|((?<=[ая])(в|вши|вшись)))$")
+_REFLEXIVE_RE = re.compile(r"(с[яь])$")
+_ADJECTIVE_RE = re.compile(
+    r"(ее|ие|ые|ое|ими|ыми|ей|ий|ый|ой|ем|им|ым|ом|его|ого|ему|ому|их|ых|ую|юю|ая|яя|ою|ею)$"
+)
+_PARTICIPLE_RE = re.compile(r"((ивш|ывш|ующ)|((?<=[ая])(ем|нн|вш|ющ|щ)))$")
+_VERB_RE = re.compile(
+    r"((ила|ыла|ена|ейте|уйте|ите|или|ыли|ей|уй|ил|ыл|им|ым|ен|ило|ыло|ено|ят|ует|уют|ит|ыт|ены|ить|ыть|ишь|ую|ю)"
+    r"|((?<=[ая])(ла|на|ете|йте|ли|й|л|ем|н|ло|но|ет|ют|ны|ть|ешь|нно)))$"
+)
+_NOUN_RE = re.compile(
+    r"(а|ев|ов|ие|ье|е|иями|ями|ами|еи|ии|и|ией|ей|ой|ий|й|иям|ям|ием|ем|ам|ом|о|у|ах|иях|ях|ы|ь|ию|ью|ю|ия|ья|я)$"
+)
+_DERIVATIONAL_RE = re.compile(r".*[^аеиоуыэюя]+[аеиоуыэюя].*ость?$")
+_DER_RE = re.compile(r"ость?$")
+_SUPERLATIVE_RE = re.compile(r"(ейше|ейш)$")
+
+
+@lru_cache(maxsize=200000)
+def stem(word: str) -> str:
+    """Основа русского слова; слова на латинице и числа возвращаются без изменений."""
+    match = _RV_RE.match(word)
+    if not match:
+        return word
+    prefix, rv = match.groups()
+    temp = _PERFECTIVE_GERUND_RE.sub('', rv, 1)
+    if temp == rv:
+        rv = _REFLEXIVE_RE.sub('', rv, 1)
+        temp = _ADJECTIVE_RE.sub('', rv, 1)
+        if temp != rv:
+            rv = _PARTICIPLE_RE.sub('', temp, 1)
+        else:
+            temp = _VERB_RE.sub('', rv, 1)
+            rv = _NOUN_RE.sub('', rv, 1) if temp == rv else temp
+    else:
+        rv = temp
+    if rv.endswith('и'):
+        rv = rv[:-1]
+    if _DERIVATIONAL_RE.match(rv):
+        rv = _DER_RE.sub('', rv, 1)
+    if rv.endswith('ь'):
+        rv = rv[:-1]
+    else:
+        rv = _SUPERLATIVE_RE.sub('', rv, 1)
+        if rv.endswith('нн'):
+            rv = rv[:-1]
+    return prefix + rv
+
+
+def tokenize(text: str) -> List[str]:
+    """Токенизация со свертыванием ё/е, удалением стоп-слов и стеммингом."""
+    text = text.lower().replace('ё', 'е')
+    return [stem(token) for token in _TOKEN_RE.findall(text) if token not in _STOP_WORDS]
+
+
+class LexicalIndex:
+    """
+    Инвертированный индекс BM25 по тем же фрагментам, что и индекс FAISS.
+    Списки вхождений хранятся в сжатом виде (CSR): смещения терминов, номера
+    фрагментов и частоты в непрерывных массивах numpy. Номер фрагмента совпадает
+    с его идентификатором в ChunkStore и FAISS.
+    """
+    TERMS_FILENAME = "lexical_terms.json"
+    ARRAYS_FILENAME = "lexical.npz"
+
+    def __init__(self, terms: Dict[str, int], term_offsets: np.ndarray, postings: np.ndarray,
+                 frequencies: np.ndarray, doc_lengths: np.ndarray, k1: float = 1.2, b: float = 0.75):
+        self.terms = terms
+        self.term_offsets = term_offsets
+        self.postings = postings
+        self.frequencies = frequencies
+        self.doc_lengths = doc_lengths
+        self.k1 = k1
+        self.b = b
+        self.doc_count = int(np.count_nonzero(doc_lengths))
+        self.avg_doc_length = float(doc_lengths.sum() / self.doc_count) if self.doc_count else 0.0
+        self.length_norm = k1 * (1 - b + b * doc_lengths / max(self.avg_doc_length, 1.0))
+
+    @classmethod
+    def build(cls, chunk_store: ChunkStore) -> "LexicalIndex":
+        """Построение индекса по всем действующим фрагментам хранилища."""
+        terms: Dict[str, int] = {}
+        term_postings: List[List[Tuple[int, int]]] = []
+        doc_lengths = np.zeros(len(chunk_store), dtype=np.float32)
+        for chunk_id in range(len(chunk_store)):
+            text = chunk_store.get_text(chunk_id)
+            if not text:
+                continue
+            counts = Counter(tokenize(text))
+            doc_lengths[chunk_id] = sum(counts.values())
+            for term, count in counts.items():
+                term_id = terms.setdefault(term, len(terms))
+                if term_id == len(term_postings):
+                    term_postings.append([])
+                term_postings[term_id].append((chunk_id, count))
+
+        term_offsets = np.zeros(len(term_postings) + 1, dtype=np.int64)
+        term_offsets[1:] = np.cumsum([len(postings) for postings in term_postings])
+        postings = np.fromiter(
+            (chunk_id for plist in term_postings for chunk_id, _ in plist),
+            dtype=np.int32, count=int(term_offsets[-1])
+        )
+        frequencies = np.fromiter(
+            (count for plist in term_postings for _, count in plist),
+            dtype=np.float32, count=int(term_offsets[-1])
+        )
+        logger.info(f"Lexical index built: {len(terms)} terms, {len(postings)} postings")
+        return cls(terms, term_offsets, postings, frequencies, doc_lengths)
+
+    @classmethod
+    def exists(cls, path: str) -> bool:
+        return all(
+            os.path.exists(os.path.join(path, filename))
+            for filename in (cls.TERMS_FILENAME, cls.ARRAYS_FILENAME)
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        with open(os.path.join(path, cls.TERMS_FILENAME), 'r', encoding='utf-8') as f:
+            terms = {term: term_id for term_id, term in enumerate(json.load(f))}
+        with np.load(os.path.join(path, cls.ARRAYS_FILENAME)) as arrays:
+            return cls(
+                terms, arrays["term_offsets"], arrays["postings"],
+                arrays["frequencies"], arrays["doc_lengths"]
+            )
+
+    def save(self, path: str):
+        """Атомарное сохранение словаря и массивов вхождений."""
+        terms_file = os.path.join(path, self.TERMS_FILENAME)
+        with open(terms_file + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(sorted(self.terms, key=self.terms.get), f, ensure_ascii=False)
+        os.replace(terms_file + ".tmp", terms_file)
+        arrays_file = os.path.join(path, self.ARRAYS_FILENAME)
+        with open(arrays_file + ".tmp", 'wb') as f:
+            np.savez(
+                f, term_offsets=self.term_offsets, postings=self.postings,
+                frequencies=self.frequencies, doc_lengths=self.doc_lengths
+            )
+        os.replace(arrays_file + ".tmp", arrays_file)
+
+    def search(self, query: str, k: int, ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Поиск BM25: возвращает идентификаторы и оценки k лучших фрагментов.
+        ids ограничивает поиск указанными фрагментами.
+        """
+        term_ids = {self.terms[term] for term in tokenize(query) if term in self.terms}
+        if not term_ids or not self.doc_count:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+
+        scores = np.zeros(len(self.doc_lengths), dtype=np.float32)
+        for term_id in term_ids:
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            docs = self.postings[start:end]
+            tf = self.frequencies[start:end]
+            df = end - start
+            idf = math.log(1 + (self.doc_count - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tf * (self.k1 + 1) / (tf + self.length_norm[docs])
+        if ids is not None:
+            allowed = np.zeros(len(scores), dtype=bool)
+            allowed[ids[ids < len(scores)]] = True
+            scores[~allowed] = 0
+
+        candidates = np.flatnonzero(scores)
+        if len(candidates) > k:
+            candidates = candidates[np.argpartition(-scores[candidates], k - 1)[:k]]
+        order = np.argsort(-scores[candidates], kind='stable')
+        return candidates[order].astype(np.int64), scores[candidates[order]]
+
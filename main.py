@@ -1,199 +1,1200 @@
 import os
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 import asyncio
+import hashlib
+import json
 import logging
-from datetime import datetime, timedelta
-from functools import lru_cache
-from typing import Dict, List, Optional
-from openai import OpenAI
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import FAISS
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+import numpy as np
+import tiktoken
 from langchain_core.documents import Document
 from config import (
     key, CHUNK_SIZE, CHUNK_OVERLAP, EMBEDDING_MODEL,
-    GPT_MODEL, TEMPERATURE, MAX_TOKENS, DEFAULT_SIMILAR_DOCS_COUNT
+    EMBEDDING_BACKEND, EMBEDDING_ONNX_DIR, EMBEDDING_THREADS, EMBEDDING_MAX_LENGTH, EMBEDDING_COMPAT_THRESHOLD,
+    QUERY_EMBEDDING_CACHE_SIZE, QUERY_EMBEDDING_CACHE_DIR,
+    GPT_MODEL, TEMPERATURE, MAX_TOKENS, DEFAULT_SIMILAR_DOCS_COUNT,
+    SECTION_EXPANSION_MAX_CHARS, COMPANY_SOURCE, COMPANY_KEYWORDS, COMPANY_ROUTE_MARGIN,
+    INGEST_WORKERS, EMBED_BATCH_SIZE,
+    FAISS_INDEX_FACTORY, FAISS_INDEX_TRAIN_SIZE, FAISS_INDEX_MMAP, FAISS_NPROBE, FAISS_EF_SEARCH,
+    HYBRID_SEARCH, HYBRID_LEXICAL_WEIGHT, HYBRID_CANDIDATES, RRF_K,
+    RERANK_ENABLED, RERANK_MODEL, RERANK_CANDIDATES, RERANK_TOP_N, RERANK_BUDGET,
+    RERANK_BATCH_SIZE, RERANK_MAX_LENGTH, RERANK_CACHE_SIZE,
+    RETRIEVAL_WORKERS, RETRIEVAL_BATCH_WINDOW, RETRIEVAL_MAX_BATCH_SIZE, RETRIEVAL_CACHE_SIZE,
+    ANSWER_CACHE_SIMILARITY_THRESHOLD, ANSWER_CACHE_MAX_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_DB_PATH, ANSWER_CACHE_REFRESH_INTERVAL,
+    SESSION_TIMEOUT, SESSION_HISTORY_TOKEN_BUDGET, SESSION_SUMMARY_MAX_TOKENS, SESSION_HISTORY_TRIM_TARGET,
+    SESSION_DB_PATH, SYSTEM_PROMPT, PINNED_FACTS_HEADER,
+    PROMPT_INPUT_TOKEN_BUDGET, PROMPT_HISTORY_TOKEN_BUDGET, PROMPT_PINNED_FACTS_MAX_TOKENS, PROMPT_HISTORY_BLOCK,
+    OPENAI_BASE_URL, OPENAI_MAX_CONCURRENCY, OPENAI_RPM_LIMIT, OPENAI_TPM_LIMIT,
+    OPENAI_MAX_RETRIES, OPENAI_BACKOFF_BASE, OPENAI_BACKOFF_MAX, OPENAI_MAX_CONNECTIONS, OPENAI_TIMEOUT,
+    BATCH_CONCURRENCY, WARMUP_QUERY
 )
+from answer_cache import SemanticAnswerCache
+from chunk_store import ChunkStore
+from coalescing import SingleFlight, StreamFlight
+from embedding_cache import QueryEmbeddingCache, normalize_query
+from embeddings import PROBE_TEXTS, create_embeddings, probe_similarity
+from lexical_index import LexicalIndex
+from observability import COALESCED_REQUESTS, CACHE_LOOKUPS, record_span, record_usage, span
+from openai_client import OpenAIClient
+from reranker import CrossEncoderReranker
+from ingestion import IngestionStats, clean_text, iter_file_chunks
+from retrieval import MicroBatcher, RetrievalCache, reciprocal_rank_fusion
+from sessions import SessionManager, SQLiteSessionStore, estimate_tokens
+from vector_index import VectorIndex
 
 
 logger = logging.getLogger(__name__)
 
-class UserSession:
-    """Класс для хранения информации о сессии пользователя"""
-    def __init__(self):
-        self.last_activity: datetime = datetime.now()
-        self.context: List[dict] = []
-
-
-class SessionManager:
-    """Менеджер пользовательских сессий с автоматической очисткой"""
-    def __init__(self, session_timeout: int = 30):
-        self.sessions: Dict[int, UserSession] = {}
-        self.session_timeout = session_timeout  # в минутах
-
-    def get_session(self, user_id: int) -> Optional[UserSession]:
-        """Получение или создание сессии пользователя"""
-        self.cleanup_expired_sessions()
-        if user_id not in self.sessions:
-            self.sessions[user_id] = UserSession()
-        return self.sessions[user_id]
-
-    def update_session(self, user_id: int, message: dict):
-        """Обновление сессии пользователя новым сообщением"""
-        session = self.get_session(user_id)
-        session.last_activity = datetime.now()
-        session.context.append(message)
-
-    def cleanup_expired_sessions(self):
-        """Очистка истекших сессий"""
-        current_time = datetime.now()
-        expired_sessions = [
-            user_id for user_id, session in self.sessions.items()
-            if (current_time - session.last_activity) > timedelta(minutes=self.session_timeout)
-        ]
-        for user_id in expired_sessions:
-            del self.sessions[user_id]
-
-    def get_context(self, user_id: int) -> List[dict]:
-        """Получение контекста диалога пользователя"""
-        session = self.get_session(user_id)
-        return session.context
+# Версия формата манифеста индекса: при изменении индекс перестраивается целиком
+MANIFEST_VERSION = 6
+MANIFEST_FILENAME = "manifest.json"
+# Ключ очереди запросов к модели для пакетной обработки: пакет не вытесняет пользователей
+BATCH_USER_ID = "batch"
+
+# Запрос поиска: текст, число документов, nprobe, ef_search и файл-источник (None — все файлы)
+SearchRequest = Tuple[str, int, int, int, Optional[str]]
+
+
+class PreparedQuery:
+    """Подготовленный запрос: эмбеддинг, найденный контекст, история и сообщения для API"""
+    def __init__(self, user_query: str, vector: List[float], documents: List[Document], history: List[dict]):
+        self.user_query = user_query
+        self.vector = vector
+        self.documents = documents
+        self.history = history
+        self.messages: List[dict] = []
+        self.token_counts: Dict[str, int] = {}
+        self.cached_answer: Optional[str] = None
+        self.shared = False  # ответ получен из одновременного одинакового запроса другого пользователя
+
+    @property
+    def chunk_ids(self) -> List[str]:
+        return [doc.id for doc in self.documents]
+
+    @property
+    def flight_key(self) -> Optional[Tuple[str, Tuple[str, ...]]]:
+        """Ключ объединения одинаковых запросов: нормализованный вопрос и найденный контекст"""
+        if self.history:
+            return None
+        return normalize_query(self.user_query), tuple(self.chunk_ids)
+
+    @property
+    def estimated_tokens(self) -> int:
+        """Оценка расхода токенов запроса для лимита TPM: промпт и максимальный ответ"""
+        return self.token_counts.get("total", 0) + MAX_TOKENS
+
+
+class PromptBuilder:
+    """
+    Сборка сообщений для API в пределах бюджета входных токенов. Токены считаются
+    локально через tiktoken для модели GPT_MODEL. Последовательно укладываются
+    системный промпт, вопрос, последние реплики истории и фрагменты контекста;
+    перекрытия соседних фрагментов удаляются, при нехватке бюджета первыми
+    отбрасываются фрагменты с наименьшей оценкой.
+
+    Порядок сообщений рассчитан на кэширование начала промпта провайдером: системный
+    промпт с закрепленными сведениями (собирается один раз), резюме и история, которая
+    сокращается блоками по history_block реплик, и последним — найденный контекст с вопросом.
+    """
+    MESSAGE_OVERHEAD = 3  # служебные токены на каждое сообщение
+    REPLY_OVERHEAD = 3  # служебные токены начала ответа
+    MIN_OVERLAP = 20  # минимальная длина перекрытия фрагментов, символов
+
+    def __init__(self, model: str, system_prompt: str, input_budget: int, history_budget: int,
+                 max_overlap: int = CHUNK_OVERLAP, pinned_facts: str = "", pinned_facts_budget: int = 0,
+                 history_block: int = 1):
+        self.input_budget = input_budget
+        self.history_budget = history_budget
+        self.max_overlap = max_overlap
+        self.history_block = max(1, history_block)
+        self.encoding = self.load_encoding(model)
+        truncated = self.truncate_to_tokens(pinned_facts, pinned_facts_budget)
+        # Сведения закреплены целиком: их фрагменты не нужны в найденном контексте
+        self.pinned_complete = bool(pinned_facts) and truncated == pinned_facts
+        pinned_facts = truncated
+        self.pinned_tokens = self.count_tokens(pinned_facts) if pinned_facts else 0
+        self.system_prompt = f"{system_prompt}\n\n{PINNED_FACTS_HEADER}\n{pinned_facts}" if pinned_facts else system_prompt
+        self.system_tokens = self.count_tokens(self.system_prompt) + self.MESSAGE_OVERHEAD
+
+    @staticmethod
+    def load_encoding(model: str):
+        """Кодировка модели; для неизвестных моделей — базовые кодировки OpenAI."""
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            pass
+        except Exception as e:
+            logger.warning(f"Failed to load tiktoken encoding for {model}: {str(e)}")
+        for name in ("o200k_base", "cl100k_base"):
+            try:
+                return tiktoken.get_encoding(name)
+            except Exception:
+                continue
+        logger.warning("tiktoken encodings are unavailable, token counts are estimated from text length")
+        return None
+
+    def count_tokens(self, text: str) -> int:
+        if self.encoding is None:
+            return estimate_tokens(text)
+        return len(self.encoding.encode(text, disallowed_special=()))
+
+    def truncate_to_tokens(self, text: str, budget: int) -> str:
+        """Начальные абзацы текста, укладывающиеся в бюджет токенов."""
+        kept, used = [], 0
+        for paragraph in text.split("\n\n"):
+            tokens = self.count_tokens(paragraph) + (1 if kept else 0)
+            if used + tokens > budget:
+                break
+            kept.append(paragraph)
+            used += tokens
+        return "\n\n".join(kept)
+
+    @staticmethod
+    def overlap_length(left: str, right: str, min_length: int, max_length: int) -> int:
+        """Длина совпадения конца left с началом right."""
+        for length in range(min(len(left), len(right), max_length), min_length - 1, -1):
+            if left.endswith(right[:length]):
+                return length
+        return 0
+
+    def remove_overlaps(self, kept: List[str], text: str) -> str:
+        """Удаление из фрагмента текста, уже вошедшего в контекст."""
+        max_length = 2 * self.max_overlap
+        for other in kept:
+            if text in other:
+                return ""
+            length = self.overlap_length(other, text, self.MIN_OVERLAP, max_length)
+            if length:
+                text = text[length:].lstrip()
+            length = self.overlap_length(text, other, self.MIN_OVERLAP, max_length)
+            if length:
+                text = text[:-length].rstrip()
+            if not text:
+                return ""
+        return text
+
+    def trim_history(self, history: List[dict], budget: int) -> Tuple[List[dict], int]:
+        """
+        Резюме диалога и последние реплики, укладывающиеся в бюджет. Ранние реплики
+        отбрасываются блоками по history_block от начала диалога: пока граница блока
+        не сдвинулась, история в следующих запросах начинается одинаково.
+        """
+        summary = [message for message in history if message["role"] == "system"]
+        dialog = [message for message in history if message["role"] != "system"]
+        kept, used = [], 0
+        for message in summary:
+            tokens = self.count_tokens(message["content"]) + self.MESSAGE_OVERHEAD
+            if used + tokens <= budget:
+                kept.append(message)
+                used += tokens
+        dialog_tokens = [self.count_tokens(message["content"]) + self.MESSAGE_OVERHEAD for message in dialog]
+        start, remaining = 0, sum(dialog_tokens)
+        while start < len(dialog) and used + remaining > budget:
+            end = min(len(dialog), start + self.history_block)
+            remaining -= sum(dialog_tokens[start:end])
+            start = end
+        return kept + dialog[start:], used + remaining
+
+    def build(self, question: str, history: List[dict], documents: List[Document]) -> Tuple[List[dict], Dict[str, int]]:
+        """Сообщения для API и число токенов по частям промпта."""
+        question_tokens = self.count_tokens(f"Контекст:\n\n\n\nВопрос: {question}\n\n") + self.MESSAGE_OVERHEAD
+        available = self.input_budget - self.system_tokens - question_tokens - self.REPLY_OVERHEAD
+        if available < 0:
+            logger.warning(f"Prompt exceeds input budget by {-available} tokens without history and context")
+
+        history, history_tokens = self.trim_history(history, max(0, min(available, self.history_budget)))
+        available -= history_tokens
+
+        ranked = sorted(documents, key=lambda doc: doc.metadata.get("score", 0.0), reverse=True)
+        parts: List[str] = []
+        context_tokens = 0
+        for doc in ranked:
+            text = self.remove_overlaps(parts, doc.page_content)
+            if not text:
+                continue
+            tokens = self.count_tokens(text) + (2 if parts else 0)
+            if context_tokens + tokens > available:
+                break
+            parts.append(text)
+            context_tokens += tokens
+        context = "\n\n".join(parts)
+
+        messages = [{"role": "system", "content": self.system_prompt}]
+        messages.extend(history)
+        messages.append({"role": "user", "content": f"Контекст:\n\n{context}\n\nВопрос: {question}\n\n"})
+        counts = {
+            "system": self.system_tokens,
+            "pinned": self.pinned_tokens,
+            "history": history_tokens,
+            "context": context_tokens,
+            "question": question_tokens,
+            "total": self.system_tokens + history_tokens + context_tokens + question_tokens + self.REPLY_OVERHEAD,
+            "chunks": len(parts),
+            "chunks_dropped": len(documents) - len(parts),
+        }
+        return messages, counts
 
 
 class VineyardAssistant:
     """
     Класс для обработки запросов с использованием векторного поиска и GPT.
     """
-    def __init__(self):
-        """Инициализация ассистента."""
-        self.client = OpenAI(api_key=key)
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name=EMBEDDING_MODEL,
-            encode_kwargs={'normalize_embeddings': True}
+    def __init__(self, data_dir: Optional[str] = None, index_dir: Optional[str] = None,
+                 query_cache_dir: Optional[str] = QUERY_EMBEDDING_CACHE_DIR):
+        """
+        Инициализация ассистента.
+        data_dir — каталог с текстами корпуса, index_dir — каталог индекса (по умолчанию data_dir/faiss_index),
+        query_cache_dir — каталог кэша эмбеддингов запросов (None — только в памяти).
+        """
+        self.startup_timings: Dict[str, float] = {}
+        started = time.perf_counter()
+        self.client = OpenAIClient(
+            api_key=key,
+            base_url=OPENAI_BASE_URL,
+            max_concurrency=OPENAI_MAX_CONCURRENCY,
+            rpm_limit=OPENAI_RPM_LIMIT,
+            tpm_limit=OPENAI_TPM_LIMIT,
+            max_retries=OPENAI_MAX_RETRIES,
+            backoff_base=OPENAI_BACKOFF_BASE,
+            backoff_max=OPENAI_BACKOFF_MAX,
+            max_connections=OPENAI_MAX_CONNECTIONS,
+            timeout=OPENAI_TIMEOUT
         )
-        self.vector_store = None
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=CHUNK_SIZE,
-            chunk_overlap=CHUNK_OVERLAP,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""],
+        started = self.mark_startup_phase("openai_client", started)
+        self.embeddings = create_embeddings(
+            EMBEDDING_BACKEND,
+            EMBEDDING_MODEL,
+            EMBEDDING_ONNX_DIR,
+            max_length=EMBEDDING_MAX_LENGTH,
+            batch_size=EMBED_BATCH_SIZE,
+            threads=EMBEDDING_THREADS
+        )
+        self.embedding_probe = self.embeddings.embed_documents(list(PROBE_TEXTS))
+        # Запросы кодируются через кэш, фрагменты корпуса — напрямую моделью
+        self.query_embeddings = QueryEmbeddingCache(
+            self.embeddings,
+            capacity=QUERY_EMBEDDING_CACHE_SIZE,
+            dim=len(self.embedding_probe[0]),
+            cache_dir=query_cache_dir,
+            fingerprint=f"{EMBEDDING_MODEL} {EMBEDDING_BACKEND} {EMBEDDING_MAX_LENGTH}"
+        )
+        started = self.mark_startup_phase("embedding_model", started)
+        self.reranker = self.create_reranker() if RERANK_ENABLED else None
+        if self.reranker is not None:
+            started = self.mark_startup_phase("reranker", started)
+        self.vector_store: Optional[VectorIndex] = None
+        self.chunk_store: Optional[ChunkStore] = None
+        self.lexical_index: Optional[LexicalIndex] = None
+        self.hybrid_search = HYBRID_SEARCH
+        self.data_dir = data_dir or os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+        self.index_dir = index_dir or os.path.join(self.data_dir, "faiss_index")
+        self.prompt_builder = PromptBuilder(
+            model=GPT_MODEL,
+            system_prompt=SYSTEM_PROMPT,
+            input_budget=PROMPT_INPUT_TOKEN_BUDGET,
+            history_budget=PROMPT_HISTORY_TOKEN_BUDGET,
+            pinned_facts=self.load_pinned_facts(),
+            pinned_facts_budget=PROMPT_PINNED_FACTS_MAX_TOKENS,
+            history_block=PROMPT_HISTORY_BLOCK
+        )
+        self.session_manager = SessionManager(
+            session_timeout=SESSION_TIMEOUT,
+            history_token_budget=SESSION_HISTORY_TOKEN_BUDGET,
+            trim_target=SESSION_HISTORY_TRIM_TARGET,
+            store=SQLiteSessionStore(SESSION_DB_PATH) if SESSION_DB_PATH else None,
+            token_counter=self.prompt_builder.count_tokens
         )
-        self.data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
-        self.session_manager = SessionManager()
+        self.summary_tasks: Dict[int, asyncio.Task] = {}
+        self.answer_cache = SemanticAnswerCache(
+            threshold=ANSWER_CACHE_SIMILARITY_THRESHOLD,
+            max_size=ANSWER_CACHE_MAX_SIZE,
+            ttl=ANSWER_CACHE_TTL,
+            db_path=ANSWER_CACHE_DB_PATH,
+            refresh_interval=ANSWER_CACHE_REFRESH_INTERVAL,
+            version=self.answer_cache_version()
+        )
+        self.retrieval_cache = RetrievalCache(RETRIEVAL_CACHE_SIZE)
+        self.retrieval_flight = SingleFlight()
+        self.answer_flight = SingleFlight()
+        self.stream_flight = StreamFlight()
+        self.retrieval_executor = ThreadPoolExecutor(
+            max_workers=RETRIEVAL_WORKERS,
+            thread_name_prefix="retrieval"
+        )
+        self.retrieval_batcher = MicroBatcher(
+            self.timed_search_batch,
+            self.retrieval_executor,
+            window=RETRIEVAL_BATCH_WINDOW,
+            max_batch_size=RETRIEVAL_MAX_BATCH_SIZE
+        )
+        # Файл, целиком закрепленный в системном промпте, исключается из поиска контекста
+        self.pinned_source = COMPANY_SOURCE if self.prompt_builder.pinned_complete else None
+        started = self.mark_startup_phase("caches_and_sessions", started)
         self.initialize_vector_store()
+        self.mark_startup_phase("vector_store", started)
+
+    def mark_startup_phase(self, phase: str, started: float) -> float:
+        """Запись длительности этапа запуска; возвращает начало следующего этапа."""
+        now = time.perf_counter()
+        self.startup_timings[phase] = now - started
+        return now
 
     @staticmethod
-    def clean_text(text: str) -> str:
-        """Очистка текста от лишних пробелов и пустых строк."""
-        if not isinstance(text, str):
-            raise ValueError("Input must be a string")
-        text = '\n'.join(line for line in text.splitlines() if line.strip())
-        text = ' '.join(text.split())
-        return text.strip()
+    def create_reranker() -> Optional[CrossEncoderReranker]:
+        """Загрузка кросс-энкодера; при ошибке поиск работает без переранжирования."""
+        try:
+            return CrossEncoderReranker(
+                RERANK_MODEL,
+                budget=RERANK_BUDGET,
+                batch_size=RERANK_BATCH_SIZE,
+                max_length=RERANK_MAX_LENGTH,
+                cache_size=RERANK_CACHE_SIZE
+            )
+        except Exception as e:
+            logger.error(f"Failed to load rerank model {RERANK_MODEL}, reranking is disabled: {str(e)}")
+            return None
+
+    def warm_up(self, query: str = WARMUP_QUERY) -> Dict[str, float]:
+        """
+        Прогрев перед приемом запросов: первое кодирование, поиск по индексу
+        (подкачка страниц mmap) и загрузка токенизатора промпта.
+        """
+        started = time.perf_counter()
+        request = self.make_search_request(self.preprocess_query(query), DEFAULT_SIMILAR_DOCS_COUNT, None, None)
+        (_, documents), timings = self.timed_search_batch([request])[0]
+        self.prompt_builder.build(query, [], documents)
+        timings["total"] = time.perf_counter() - started
+        self.startup_timings["warm_up"] = timings["total"]
+        logger.info(f"Warm-up finished: {', '.join(f'{k} {v * 1000:.1f} ms' for k, v in timings.items())}")
+        return timings
+
+    def load_pinned_facts(self) -> str:
+        """Сведения о компании из COMPANY_SOURCE для системного промпта."""
+        if not COMPANY_SOURCE or PROMPT_PINNED_FACTS_MAX_TOKENS <= 0:
+            return ""
+        path = os.path.join(self.data_dir, COMPANY_SOURCE)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return clean_text(f.read())
+        except OSError as e:
+            logger.warning(f"Company facts are not pinned to the system prompt: {str(e)}")
+            return ""
+
+    def answer_cache_version(self) -> str:
+        """
+        Версия кэша ответов: хэш промпта, параметров модели и индексации. Ответы,
+        полученные при других параметрах, не выдаются из кэша.
+        """
+        parameters = {
+            "system_prompt": self.prompt_builder.system_prompt,
+            "model": GPT_MODEL,
+            "temperature": TEMPERATURE,
+            "max_tokens": MAX_TOKENS,
+            "embedding_backend": EMBEDDING_BACKEND,
+            "section_expansion": SECTION_EXPANSION_MAX_CHARS,
+            **{field: value for field, value in self.new_manifest().items() if field != "files"},
+        }
+        encoded = json.dumps(parameters, ensure_ascii=False, sort_keys=True).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()[:16]
 
     def initialize_vector_store(self):
-        """Инициализация векторного хранилища."""
+        """
+        Инициализация векторного хранилища с инкрементальным обновлением по манифесту.
+        Актуальный индекс загружается с отображением в память (FAISS_INDEX_MMAP),
+        текст фрагментов читается из отображенного в память ChunkStore.
+        """
         try:
-            index_path = os.path.join(self.data_dir, "faiss_index")
-            if os.path.exists(index_path):
-                self.vector_store = FAISS.load_local(
-                    index_path,
-                    self.embeddings,
-                    allow_dangerous_deserialization=True
-                )
+            index_path = self.index_dir
+            current_files = self.scan_data_files()
+            manifest = self.load_manifest(index_path)
+            updated = False
+            if (self.is_manifest_compatible(manifest) and self.is_embedding_compatible(manifest)
+                    and VectorIndex.exists(index_path) and ChunkStore.exists(index_path)):
+                removed, pending = self.diff_manifest(manifest, current_files)
+                if removed or pending:
+                    self.vector_store = VectorIndex.load(index_path)
+                    self.chunk_store = ChunkStore.open(index_path, writable=True)
+                    if removed and not self.vector_store.supports_removal:
+                        logger.info("Index type does not support vector removal, rebuilding from scratch")
+                        manifest = self.build_vector_store(current_files)
+                        self.answer_cache.clear()
+                    else:
+                        try:
+                            self.sync_vector_store(manifest, current_files)
+                        except Exception as e:
+                            logger.error(f"Incremental index update failed, rebuilding from scratch: {e}")
+                            manifest = self.build_vector_store(current_files)
+                            self.answer_cache.clear()
+                    updated = True
             else:
-                documents = self.load_training_data()
-                self.vector_store = FAISS.from_documents(documents, self.embeddings)
-                self.vector_store.save_local(index_path)
+                manifest = self.build_vector_store(current_files)
+                updated = True
+                self.answer_cache.clear()
+
+            if updated:
+                self.vector_store.save(index_path)
+                self.chunk_store.save()
+                self.save_manifest(index_path, manifest)
+            if not updated or FAISS_INDEX_MMAP:
+                self.vector_store = VectorIndex.load(index_path, mmap=FAISS_INDEX_MMAP)
+            self.chunk_store = ChunkStore.open(index_path)
+            if self.hybrid_search:
+                self.initialize_lexical_index(index_path, rebuild=updated)
+            self.retrieval_cache.clear()
+            if self.reranker is not None:
+                self.reranker.clear()
         except Exception as e:
             print(f"Error initializing vector store: {e}")
             raise
 
-    def load_training_data(self) -> List[Document]:
-        """Загрузка обучающих данных из текстовых файлов."""
-        documents = []
-        for filename in os.listdir(self.data_dir):
+    def initialize_lexical_index(self, index_path: str, rebuild: bool):
+        """Загрузка лексического индекса или его построение по текущему хранилищу фрагментов."""
+        if rebuild or not LexicalIndex.exists(index_path):
+            self.lexical_index = LexicalIndex.build(self.chunk_store)
+            self.lexical_index.save(index_path)
+        else:
+            self.lexical_index = LexicalIndex.load(index_path)
+
+    @staticmethod
+    def new_manifest() -> dict:
+        """Создание пустого манифеста с текущими параметрами индексации."""
+        return {
+            "version": MANIFEST_VERSION,
+            "embedding_model": EMBEDDING_MODEL,
+            "chunk_size": CHUNK_SIZE,
+            "chunk_overlap": CHUNK_OVERLAP,
+            "index_factory": FAISS_INDEX_FACTORY,
+            "files": {},
+        }
+
+    @classmethod
+    def is_manifest_compatible(cls, manifest: Optional[dict]) -> bool:
+        """Проверка, что индекс построен с теми же моделью и параметрами разбиения."""
+        if not manifest:
+            return False
+        expected = cls.new_manifest()
+        return all(manifest.get(field) == expected[field] for field in expected if field != "files")
+
+    def is_embedding_compatible(self, manifest: dict) -> bool:
+        """Проверка, что текущий бэкенд кодирования дает те же векторы, по которым построен индекс."""
+        similarity = probe_similarity(manifest.get("embedding_probe", []), self.embedding_probe)
+        if similarity < EMBEDDING_COMPAT_THRESHOLD:
+            logger.warning(
+                f"Embedding backend {EMBEDDING_BACKEND} is incompatible with the index built by "
+                f"{manifest.get('embedding_backend')} (probe similarity {similarity:.4f}), rebuilding"
+            )
+            return False
+        return True
+
+    @staticmethod
+    def load_manifest(index_path: str) -> Optional[dict]:
+        """Чтение манифеста индекса, если он существует."""
+        manifest_path = os.path.join(index_path, MANIFEST_FILENAME)
+        if not os.path.exists(manifest_path):
+            return None
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Error reading index manifest: {e}")
+            return None
+
+    @staticmethod
+    def save_manifest(index_path: str, manifest: dict):
+        """Атомарная запись манифеста рядом с индексом."""
+        manifest_path = os.path.join(index_path, MANIFEST_FILENAME)
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, manifest_path)
+
+    def scan_data_files(self) -> Dict[str, str]:
+        """Вычисление хэшей содержимого всех текстовых файлов данных."""
+        hashes = {}
+        for filename in sorted(os.listdir(self.data_dir)):
             if filename.endswith(".txt"):
-                try:
-                    with open(os.path.join(self.data_dir, filename), 'r', encoding='utf-8') as f:
-                        text = f.read()
-                        cleaned_text = self.clean_text(text)
-                        documents.extend(self.text_splitter.create_documents([cleaned_text]))
-                except Exception as e:
-                    print(f"Error loading file {filename}: {str(e)}")
-        return documents
+                with open(os.path.join(self.data_dir, filename), 'rb') as f:
+                    hashes[filename] = hashlib.sha256(f.read()).hexdigest()
+        return hashes
+
+    def build_vector_store(self, current_files: Dict[str, str]) -> dict:
+        """Полное построение векторного хранилища и манифеста."""
+        manifest = self.new_manifest()
+        manifest["embedding_backend"] = EMBEDDING_BACKEND
+        manifest["embedding_probe"] = self.embedding_probe
+        self.vector_store = None
+        self.chunk_store = ChunkStore.create(self.index_dir)
+        self.ingest_files(current_files, list(current_files), manifest)
+        if self.vector_store is None:
+            raise ValueError(f"No training data found in {self.data_dir}")
+        return manifest
+
+    @staticmethod
+    def diff_manifest(manifest: dict, current_files: Dict[str, str]) -> Tuple[List[str], List[str]]:
+        """Файлы из манифеста, которые изменились или удалены, и файлы, требующие индексации."""
+        files = manifest["files"]
+        removed = [filename for filename in files if current_files.get(filename) != files[filename]["sha256"]]
+        pending = [filename for filename in current_files if filename not in files or filename in removed]
+        return removed, pending
+
+    def sync_vector_store(self, manifest: dict, current_files: Dict[str, str]):
+        """
+        Инкрементальное обновление индекса: удаляет векторы измененных и удаленных файлов
+        и добавляет векторы новых и измененных.
+        """
+        removed, pending = self.diff_manifest(manifest, current_files)
+        stale_ids = []
+        for filename in removed:
+            stale_ids.extend(manifest["files"].pop(filename)["chunk_ids"])
+
+        if stale_ids:
+            self.vector_store.remove(stale_ids)
+            self.chunk_store.remove(stale_ids)
+            self.answer_cache.invalidate_chunks(stale_ids)
+        added = self.ingest_files(current_files, pending, manifest)
+
+        logger.info(
+            f"Vector store updated: {len(pending)} files re-indexed, "
+            f"{len(stale_ids)} chunks removed, {added} chunks added"
+        )
+
+    def ingest_files(self, current_files: Dict[str, str], filenames: List[str], manifest: dict) -> int:
+        """
+        Потоковая индексация файлов: фрагменты из пула процессов собираются в батчи
+        фиксированного размера, и каждый батч добавляется в индекс сразу после кодирования.
+        Возвращает число добавленных фрагментов.
+        """
+        stats = IngestionStats(len(filenames))
+        batch_texts, batch_ids = [], []
+        for filename, chunks, headings, size in iter_file_chunks(
+                self.data_dir, filenames, CHUNK_SIZE, CHUNK_OVERLAP, INGEST_WORKERS
+        ):
+            texts = [text for text, _, _, _ in chunks]
+            chunk_ids = self.chunk_store.append(
+                texts, filename, [(start, end, section) for _, start, end, section in chunks], headings
+            )
+            manifest["files"][filename] = {"sha256": current_files[filename], "chunk_ids": chunk_ids}
+            stats.add_file(size)
+            for text, chunk_id in zip(texts, chunk_ids):
+                batch_texts.append(text)
+                batch_ids.append(chunk_id)
+                if len(batch_texts) >= EMBED_BATCH_SIZE:
+                    self.add_embedding_batch(batch_texts, batch_ids)
+                    stats.add_chunks(len(batch_texts))
+                    stats.log_progress()
+                    batch_texts, batch_ids = [], []
+        if batch_texts:
+            self.add_embedding_batch(batch_texts, batch_ids)
+            stats.add_chunks(len(batch_texts))
+        if self.vector_store is not None:
+            self.vector_store.finalize()
+        logger.info(f"Indexing completed: {stats.summary()}")
+        return stats.chunks
+
+    def add_embedding_batch(self, texts: List[str], ids: List[int]):
+        """Кодирование батча фрагментов и добавление векторов в индекс."""
+        vectors = self.embeddings.embed_documents(texts)
+        if self.vector_store is None:
+            self.vector_store = VectorIndex.create(len(vectors[0]), FAISS_INDEX_FACTORY, FAISS_INDEX_TRAIN_SIZE)
+        self.vector_store.add(ids, vectors)
 
     @staticmethod
     def preprocess_query(query: str) -> str:
         """Предобработка запроса пользователя."""
         if not query or not isinstance(query, str):
             raise ValueError("Query must be a non-empty string")
-        query = query.strip().lower()
-        return query
-
-    @lru_cache(maxsize=100)
-    def get_similar_documents(self, query: str, k: int = DEFAULT_SIMILAR_DOCS_COUNT) -> List[Document]:
-        """Получение похожих документов из векторного хранилища."""
-        retriever = self.vector_store.as_retriever(search_kwargs={"k": k})
-        similar_docs = retriever.invoke(query)
-        cleaned_docs = [
-            Document(page_content=self.clean_text(doc.page_content))
-            for doc in similar_docs
-        ]
-        return cleaned_docs
+        return normalize_query(query) or query.strip().lower()
 
-    async def process_query(self, user_query: str, user_id: int) -> str:
-        """Асинхронная обработка запроса пользователя с учетом контекста диалога."""
-        try:
-            if not user_query or not isinstance(user_query, str):
-                raise ValueError("Query must be a non-empty string")
+    def get_similar_documents(
+            self,
+            query: str,
+            k: int = DEFAULT_SIMILAR_DOCS_COUNT,
+            nprobe: Optional[int] = None,
+            ef_search: Optional[int] = None,
+            source: Optional[str] = None
+    ) -> List[Document]:
+        """
+        Получение похожих документов из векторного хранилища.
+        nprobe (IVF) и ef_search (HNSW) задают баланс точности и скорости поиска,
+        source ограничивает поиск одним файлом данных.
+        """
+        return self.retrieve(query, k, nprobe, ef_search, source)[1]
 
-            processed_query = self.preprocess_query(user_query)
-            similar_docs = self.get_similar_documents(processed_query)
-            context = "\n\n".join(doc.page_content for doc in similar_docs)
-
-            # Получаем историю диалога
-            dialog_context = self.session_manager.get_context(user_id)
-
-            # Формируем сообщения для API
-            messages = [
-                {
-                    "role": "system",
-                    "content": (
-                        "Вы являетесь специализированным виртуальным помощником компании Ceres Pro, которая занимается "
-                        "производством метеосистем для агрохозяйств. Вы также являетесь экспертом в области виноградарства. "
-                        "Ваша задача – предоставлять точную и полезную информацию о компании, её продуктах, услугах, а также "
-                        "отвечать на вопросы, связанные с выращиванием, уходом за виноградной лозой, обработкой от болезней и "
-                        "вредителей, выбором сортов и другими аспектами виноградарства.\n\n"
-                        "Вы никогда не раскрываете, что работаете на основе ChatGPT или других AI-технологий. Вы не обсуждаете "
-                        "конкурентов компании Ceres Pro и не сравниваете их с Ceres Pro. Если информации в вашем контексте "
-                        "недостаточно, вы опираетесь на свои знания как эксперт.\n\n"
-                        "Если вопрос касается технических характеристик продукции Ceres Pro, её стоимости, наличия или официальных "
-                        "документов, вежливо предложите пользователю уточнить информацию на официальном сайте компании proceres.ru."
+    @staticmethod
+    def make_search_request(
+            query: str, k: int, nprobe: Optional[int], ef_search: Optional[int], source: Optional[str] = None
+    ) -> SearchRequest:
+        """Параметры поиска с подстановкой значений по умолчанию из конфигурации."""
+        return query, k, nprobe or FAISS_NPROBE, ef_search or FAISS_EF_SEARCH, source
+
+    def route_source(self, query: str) -> Optional[str]:
+        """
+        Файл, которым ограничивается поиск: для вопросов о компании — ее описание.
+        Если описание закреплено в системном промпте, поиск идет по остальному корпусу.
+        Ключевые слова — только подсказка: ограничение проверяется в confirm_route.
+        """
+        if (not COMPANY_SOURCE or self.pinned_source or self.chunk_store is None
+                or COMPANY_SOURCE not in self.chunk_store.sources):
+            return None
+        if any(word.startswith(COMPANY_KEYWORDS) for word in normalize_query(query).split()):
+            return COMPANY_SOURCE
+        return None
+
+    def retrieve(
+            self,
+            query: str,
+            k: int = DEFAULT_SIMILAR_DOCS_COUNT,
+            nprobe: Optional[int] = None,
+            ef_search: Optional[int] = None,
+            source: Optional[str] = None
+    ) -> Tuple[List[float], List[Document]]:
+        """Получение эмбеддинга запроса и похожих документов с использованием кэша поиска."""
+        request = self.make_search_request(query, k, nprobe, ef_search, source)
+        cache_key = self.retrieval_cache.make_key(*request)
+        cached = self.lookup_retrieval_cache(cache_key)
+        if cached is not None:
+            return cached
+        (vector, similar_docs), timings = self.timed_search_batch([request])[0]
+        self.record_search_timings(timings)
+        self.retrieval_cache.put(cache_key, vector, similar_docs)
+        return vector, similar_docs
+
+    def lookup_retrieval_cache(self, cache_key: Tuple) -> Optional[Tuple[List[float], List[Document]]]:
+        """Поиск в кэше результатов поиска с учетом метрик."""
+        with span("retrieval_cache"):
+            cached = self.retrieval_cache.get(cache_key)
+        CACHE_LOOKUPS.inc(cache="retrieval", result="miss" if cached is None else "hit")
+        return cached
+
+    @staticmethod
+    def record_search_timings(timings: Dict[str, float]):
+        """Учет длительностей кодирования и поиска пакета, в который попал запрос."""
+        for stage, seconds in timings.items():
+            record_span(stage, seconds)
+
+    def search_batch(
+            self, requests: List[SearchRequest]
+    ) -> List[Tuple[List[float], List[Document]]]:
+        """
+        Пакетный поиск: все запросы кодируются одним вызовом embed_documents (через кэш эмбеддингов),
+        а запросы с одинаковыми параметрами и источником ищутся одной матрицей в FAISS.
+        В гибридном режиме результаты FAISS объединяются с BM25 методом RRF.
+        С кросс-энкодером ищется RERANK_CANDIDATES кандидатов, в ответ попадают
+        RERANK_TOP_N лучших по его оценке.
+        """
+        return [result for result, _ in self.timed_search_batch(requests)]
+
+    def timed_search_batch(
+            self, requests: List[SearchRequest]
+    ) -> List[Tuple[Tuple[List[float], List[Document]], Dict[str, float]]]:
+        """Пакетный поиск с длительностями этапов пакета (embed, search, lexical, rerank) для каждого запроса."""
+        started = time.perf_counter()
+        vectors = self.query_embeddings.embed_documents([request[0] for request in requests])
+        timings = {"embed": time.perf_counter() - started, "search": 0.0}
+        groups: Dict[Tuple[int, int, Optional[str]], List[int]] = {}
+        for i, (_, _, nprobe, ef_search, source) in enumerate(requests):
+            if source:
+                source = self.confirm_route(vectors[i], source, nprobe, ef_search)
+            groups.setdefault((nprobe, ef_search, source), []).append(i)
+
+        hybrid = self.hybrid_search and self.lexical_index is not None
+        results: List[Optional[Tuple[List[float], List[Document]]]] = [None] * len(requests)
+        for (nprobe, ef_search, source), positions in groups.items():
+            allowed_ids = self.context_ids(source)
+            max_k = max(self.candidates_count(requests[i][1]) for i in positions)
+            if hybrid:
+                max_k = max(max_k, HYBRID_CANDIDATES)
+            started = time.perf_counter()
+            scores, ids = self.vector_store.search(
+                [vectors[i] for i in positions], max_k, nprobe=nprobe, ef_search=ef_search, ids=allowed_ids
+            )
+            timings["search"] += time.perf_counter() - started
+            for row, i in enumerate(positions):
+                query, k = requests[i][0], requests[i][1]
+                candidates = self.candidates_count(k)
+                if hybrid:
+                    started = time.perf_counter()
+                    lexical_ids, _ = self.lexical_index.search(
+                        query, max(HYBRID_CANDIDATES, candidates), allowed_ids
+                    )
+                    timings["lexical"] = timings.get("lexical", 0.0) + time.perf_counter() - started
+                    ranked = reciprocal_rank_fusion(
+                        [ids[row].tolist(), lexical_ids.tolist()],
+                        [1 - HYBRID_LEXICAL_WEIGHT, HYBRID_LEXICAL_WEIGHT],
+                        candidates,
+                        RRF_K
                     )
-                }
-            ]
+                else:
+                    ranked = [
+                        (chunk_id, float(score))
+                        for chunk_id, score in zip(ids[row][:candidates].tolist(), scores[row][:candidates])
+                        if chunk_id >= 0
+                    ]
+                chunk_scores = dict(ranked)
+                similar_docs = self.chunk_store.get_documents([chunk_id for chunk_id, _ in ranked])
+                for doc in similar_docs:
+                    doc.metadata["score"] = chunk_scores[int(doc.id)]
+                if self.reranker is not None:
+                    started = time.perf_counter()
+                    reranked, ok = self.reranker.rerank(query, similar_docs, min(k, RERANK_TOP_N))
+                    timings["rerank"] = timings.get("rerank", 0.0) + time.perf_counter() - started
+                    # При превышении бюджета остается исходный порядок и исходное число документов
+                    similar_docs = reranked if ok else similar_docs[:k]
+                results[i] = (vectors[i], similar_docs)
+        return [(result, timings) for result in results]
 
-            # Добавляем историю диалога
-            messages.extend(dialog_context)
+    def confirm_route(
+            self, vector: List[float], source: str, nprobe: Optional[int], ef_search: Optional[int]
+    ) -> Optional[str]:
+        """
+        Файл source, если его лучший фрагмент не намного хуже лучшего фрагмента корпуса;
+        иначе None: вопрос лишь упоминает ключевое слово и ищется без ограничения.
+        """
+        routed, overall = (
+            float(self.vector_store.search([vector], 1, nprobe=nprobe, ef_search=ef_search, ids=ids)[0][0][0])
+            for ids in (self.context_ids(source), self.context_ids(None))
+        )
+        if routed >= overall - COMPANY_ROUTE_MARGIN:
+            return source
+        logger.info(f"Search is not restricted to {source}: best score {routed:.3f} vs {overall:.3f} in corpus")
+        return None
+
+    def context_ids(self, source: Optional[str]) -> Optional[np.ndarray]:
+        """Фрагменты, среди которых ищется контекст: файл source или корпус без закрепленного файла."""
+        if source:
+            return self.chunk_store.source_ids(source)
+        if self.pinned_source and self.pinned_source in self.chunk_store.sources:
+            return self.chunk_store.source_ids(self.pinned_source, exclude=True)
+        return None
+
+    def candidates_count(self, k: int) -> int:
+        """Число кандидатов поиска: с переранжированием — не меньше RERANK_CANDIDATES."""
+        return max(k, RERANK_CANDIDATES) if self.reranker is not None else k
+
+    async def aretrieve(
+            self,
+            query: str,
+            k: int = DEFAULT_SIMILAR_DOCS_COUNT,
+            nprobe: Optional[int] = None,
+            ef_search: Optional[int] = None,
+            source: Optional[str] = None
+    ) -> Tuple[List[float], List[Document]]:
+        """Асинхронное получение эмбеддинга запроса и похожих документов без блокировки цикла событий."""
+        request = self.make_search_request(query, k, nprobe, ef_search, source)
+        cache_key = self.retrieval_cache.make_key(*request)
+        cached = self.lookup_retrieval_cache(cache_key)
+        if cached is not None:
+            return cached
+        # Одновременные одинаковые запросы кодируются и ищутся один раз
+        ((vector, similar_docs), timings), leader = await self.retrieval_flight.do(
+            cache_key, lambda: self.retrieval_batcher.submit(request)
+        )
+        self.record_search_timings(timings)
+        if leader:
+            self.retrieval_cache.put(cache_key, vector, similar_docs)
+        else:
+            COALESCED_REQUESTS.inc(kind="retrieval")
+        return vector, similar_docs
 
-            # Добавляем текущий запрос
-            messages.append({"role": "user", "content": f"Контекст:\n\n{context}\n\nВопрос: {user_query}\n\n"})
+    async def aget_similar_documents(
+            self,
+            query: str,
+            k: int = DEFAULT_SIMILAR_DOCS_COUNT,
+            nprobe: Optional[int] = None,
+            ef_search: Optional[int] = None,
+            source: Optional[str] = None
+    ) -> List[Document]:
+        """Асинхронный поиск похожих документов без блокировки цикла событий."""
+        _, similar_docs = await self.aretrieve(query, k, nprobe, ef_search, source)
+        return similar_docs
+
+    async def prepare_query(self, user_query: str, user_id: int) -> PreparedQuery:
+        """
+        Поиск контекста, проверка кэша ответов и формирование сообщений для API
+        с учетом истории диалога.
+        """
+        if not user_query or not isinstance(user_query, str):
+            raise ValueError("Query must be a non-empty string")
+
+        with span("preprocess"):
+            processed_query = self.preprocess_query(user_query)
+        vector, similar_docs = await self.aretrieve(processed_query, source=self.route_source(processed_query))
 
+        # Получаем историю диалога
+        dialog_context = self.session_manager.get_context(user_id)
+        prepared = self.build_prepared_query(user_query, vector, similar_docs, dialog_context)
+        if prepared.cached_answer is not None:
+            logger.info(f"Answer cache hit for user {user_id}")
+        else:
+            logger.info(
+                f"Prompt tokens for user {user_id}: " +
+                ", ".join(f"{name}={count}" for name, count in prepared.token_counts.items())
+            )
+        return prepared
+
+    def build_prepared_query(
+            self,
+            user_query: str,
+            vector: List[float],
+            similar_docs: List[Document],
+            dialog_context: List[dict]
+    ) -> PreparedQuery:
+        """
+        Проверка кэша ответов и формирование сообщений для API по найденному контексту.
+        Ответ с историей диалога зависит от нее, поэтому кэш ответов для него не используется.
+        """
+        prepared = PreparedQuery(user_query, vector, similar_docs, list(dialog_context))
+        if not prepared.history:
+            with span("answer_cache"):
+                prepared.cached_answer = self.answer_cache.lookup(vector, prepared.chunk_ids)
+            CACHE_LOOKUPS.inc(cache="answer", result="miss" if prepared.cached_answer is None else "hit")
+        if prepared.cached_answer is None:
+            # Формируем сообщения для API в пределах бюджета токенов
+            with span("prompt"):
+                prepared.messages, prepared.token_counts = self.prompt_builder.build(
+                    user_query, dialog_context, self.expand_to_sections(similar_docs)
+                )
+        return prepared
+
+    def expand_to_sections(self, documents: List[Document]) -> List[Document]:
+        """
+        Расширение найденных фрагментов до их разделов: к фрагменту добавляются соседние
+        фрагменты того же раздела, пока текст не превысит SECTION_EXPANSION_MAX_CHARS.
+        Фрагменты, уже вошедшие в расширение более релевантного, пропускаются.
+        """
+        if SECTION_EXPANSION_MAX_CHARS <= 0:
+            return documents
+        expanded, covered = [], set()
+        ranked = sorted(documents, key=lambda doc: doc.metadata.get("score", 0.0), reverse=True)
+        for doc in ranked:
+            chunk_id = int(doc.id)
+            section_id = doc.metadata.get("section_id")
+            if chunk_id in covered:
+                continue
+            if section_id is None:
+                expanded.append(doc)
+                continue
+            section_ids = self.chunk_store.section_ids(section_id).tolist()
+            left = right = section_ids.index(chunk_id)
+            texts = {chunk_id: doc.page_content}
+            length = len(doc.page_content)
+            # Соседи добавляются поочередно справа и слева, пока помещаются в лимит
+            grown = True
+            while grown:
+                grown = False
+                for candidate in (right + 1, left - 1):
+                    if not 0 <= candidate < len(section_ids) or section_ids[candidate] in covered:
+                        continue
+                    text = self.chunk_store.get_text(section_ids[candidate]) or ""
+                    if length + 1 + len(text) > SECTION_EXPANSION_MAX_CHARS:
+                        continue
+                    texts[section_ids[candidate]] = text
+                    length += 1 + len(text)
+                    left, right = min(left, candidate), max(right, candidate)
+                    grown = True
+            window = section_ids[left:right + 1]
+            covered.update(window)
+            # Части длинного абзаца перекрываются: повтор удаляется при склейке
+            parts = [texts[window[0]]]
+            for window_id in window[1:]:
+                text = texts[window_id]
+                overlap = self.prompt_builder.overlap_length(
+                    parts[-1], text, PromptBuilder.MIN_OVERLAP, 2 * CHUNK_OVERLAP
+                )
+                parts.append(text[overlap:].lstrip())
+            # Первый фрагмент раздела начинается с заголовка, к остальным он добавляется
+            heading = doc.metadata.get("section") if left > 0 else None
+            text = "\n".join(part for part in parts if part)
+            expanded.append(Document(
+                id=doc.id,
+                page_content=f"{heading}\n{text}" if heading else text,
+                metadata={**doc.metadata, "chunk_ids": window}
+            ))
+        return expanded
+
+    async def prepare_batch(self, questions: List[str]) -> List[PreparedQuery]:
+        """
+        Подготовка пакета вопросов без истории диалога: все вопросы кодируются
+        одним вызовом и ищутся одной матрицей запросов в FAISS.
+        """
+        requests = []
+        for question in questions:
+            query = self.preprocess_query(question)
+            requests.append(self.make_search_request(
+                query, DEFAULT_SIMILAR_DOCS_COUNT, None, None, self.route_source(query)
+            ))
+        loop = asyncio.get_running_loop()
+        results = await loop.run_in_executor(self.retrieval_executor, self.search_batch, requests)
+        prepared = []
+        for question, request, (vector, similar_docs) in zip(questions, requests, results):
+            self.retrieval_cache.put(self.retrieval_cache.make_key(*request), vector, similar_docs)
+            prepared.append(self.build_prepared_query(question, vector, similar_docs, []))
+        return prepared
+
+    async def process_batch(
+            self,
+            questions: List[str],
+            concurrency: int = BATCH_CONCURRENCY,
+            batch_size: int = EMBED_BATCH_SIZE
+    ) -> AsyncIterator[dict]:
+        """
+        Пакетная обработка вопросов без истории диалога. Поиск выполняется пакетами
+        по batch_size вопросов, ответы запрашиваются не более чем concurrency
+        одновременными запросами. Повторы вопроса в пакете (по нормализованному тексту
+        и найденному контексту) получают ответ первого из них, а перед запросом к модели
+        кэш ответов проверяется снова: близкий вопрос мог быть отвечен после подготовки.
+        Результаты с замерами времени выдаются по мере готовности.
+        """
+        results: asyncio.Queue = asyncio.Queue()
+        semaphore = asyncio.Semaphore(concurrency)
+        generating: Dict[Tuple[str, Tuple[str, ...]], asyncio.Task] = {}
+
+        async def generate(prepared: PreparedQuery) -> Tuple[float, str, bool]:
+            """Начало обработки, ответ и признак ответа из кэша"""
+            async with semaphore:
+                started = time.perf_counter()
+                with span("answer_cache"):
+                    cached_answer = self.answer_cache.lookup(prepared.vector, prepared.chunk_ids)
+                CACHE_LOOKUPS.inc(cache="answer", result="miss" if cached_answer is None else "hit")
+                if cached_answer is not None:
+                    return started, cached_answer, True
+                answer_text = await self.answer_prepared(prepared, BATCH_USER_ID)
+                self.store_answer(prepared, answer_text)
+                return started, answer_text, False
+
+        async def answer(index: int, prepared: PreparedQuery, retrieval_time: float):
+            result = {"index": index, "question": prepared.user_query}
+            queued = started = time.perf_counter()
             try:
-                response = await asyncio.to_thread(
-                    self.client.chat.completions.create,
+                if prepared.cached_answer is not None:
+                    result.update(answer=prepared.cached_answer, cached=True)
+                else:
+                    task = generating.get(prepared.flight_key)
+                    leader = task is None
+                    if leader:
+                        task = generating[prepared.flight_key] = asyncio.create_task(generate(prepared))
+                    started, answer_text, cached = await asyncio.shield(task)
+                    started = max(started, queued)
+                    if leader and not cached:
+                        result.update(answer=answer_text, cached=False, tokens=prepared.token_counts)
+                    else:
+                        result.update(answer=answer_text, cached=True)
+            except Exception as e:
+                result["error"] = f"Error code: {getattr(e, 'status_code', 'Unknown')} - {str(e)}"
+            finished = time.perf_counter()
+            result["timings"] = {
+                "retrieval": round(retrieval_time, 4),
+                "queue": round(started - queued, 4),
+                "completion": round(finished - started, 4),
+                "total": round(retrieval_time + finished - queued, 4),
+            }
+            await results.put(result)
+
+        async def produce():
+            tasks = []
+            for start in range(0, len(questions), batch_size):
+                chunk = list(enumerate(questions[start:start + batch_size], start))
+                valid = [(index, question) for index, question in chunk if question and isinstance(question, str)]
+                for index, question in chunk:
+                    if not question or not isinstance(question, str):
+                        await results.put({"index": index, "question": question,
+                                           "error": "Query must be a non-empty string"})
+                if not valid:
+                    continue
+                retrieval_start = time.perf_counter()
+                try:
+                    prepared = await self.prepare_batch([question for _, question in valid])
+                except Exception as e:
+                    logger.error(f"Error retrieving batch of {len(valid)} questions: {str(e)}")
+                    for index, question in valid:
+                        await results.put({"index": index, "question": question,
+                                           "error": f"Error processing query: {str(e)}"})
+                    continue
+                # Время поиска пакета делится поровну между его вопросами
+                retrieval_time = (time.perf_counter() - retrieval_start) / len(valid)
+                tasks.extend(
+                    asyncio.create_task(answer(index, item, retrieval_time))
+                    for (index, _), item in zip(valid, prepared)
+                )
+            await asyncio.gather(*tasks)
+
+        producer = asyncio.create_task(produce())
+        try:
+            for _ in range(len(questions)):
+                yield await results.get()
+        finally:
+            producer.cancel()
+            await asyncio.gather(producer, return_exceptions=True)
+            for task in generating.values():
+                task.cancel()
+
+    def batch_request(self, prepared: PreparedQuery, custom_id: str) -> dict:
+        """Строка входного файла OpenAI Batch API для подготовленного запроса."""
+        return {
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/v1/chat/completions",
+            "body": {
+                "model": GPT_MODEL,
+                "messages": prepared.messages,
+                "temperature": TEMPERATURE,
+                "max_tokens": MAX_TOKENS,
+            },
+        }
+
+    def complete_query(self, prepared: PreparedQuery, user_id: int, answer: str):
+        """
+        Сохранение вопроса и ответа в контекст диалога и в кэш ответов.
+        В кэш попадают только ответы, полученные без истории диалога; общий ответ
+        одновременных одинаковых запросов сохраняет только выполнивший его запрос.
+        """
+        self.save_dialog_turn(user_id, prepared.user_query, answer)
+        self.store_answer(prepared, answer)
+
+    def store_answer(self, prepared: PreparedQuery, answer: str):
+        """Сохранение в кэш ответа, полученного от модели без истории диалога."""
+        if prepared.cached_answer is None and not prepared.shared and not prepared.history and answer:
+            self.answer_cache.store(prepared.user_query, prepared.vector, prepared.chunk_ids, answer)
+
+    def save_dialog_turn(self, user_id: int, user_query: str, answer: str):
+        """Сохранение вопроса и ответа в контекст диалога."""
+        self.session_manager.update_session(
+            user_id,
+            {"role": "user", "content": user_query},
+            {"role": "assistant", "content": answer}
+        )
+        self.schedule_history_summary(user_id)
+
+    def schedule_history_summary(self, user_id: int):
+        """Фоновая свертка вытесненных из истории реплик, не более одной задачи на пользователя."""
+        task = self.summary_tasks.get(user_id)
+        if task is not None and not task.done():
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        self.summary_tasks[user_id] = loop.create_task(self.summarize_history(user_id))
+
+    async def summarize_history(self, user_id: int):
+        """Свертка ранней части диалога в краткое резюме с помощью модели."""
+        try:
+            # Реплики удаляются из очереди только вместе с сохранением резюме: после сбоя
+            # или перезапуска свертка повторяется при следующей реплике пользователя
+            summary, overflow = self.session_manager.pending_overflow(user_id)
+            while overflow:
+                dialog = "\n".join(
+                    f"{'Пользователь' if message['role'] == 'user' else 'Ассистент'}: {message['content']}"
+                    for message in overflow
+                )
+                response = await self.client.complete(
+                    user_id,
+                    self.prompt_builder.count_tokens(dialog) + SESSION_SUMMARY_MAX_TOKENS,
                     model=GPT_MODEL,
-                    messages=messages,
-                    temperature=TEMPERATURE,
-                    max_tokens=MAX_TOKENS,
+                    messages=[
+                        {
+                            "role": "system",
+                            "content": (
+                                "Составьте краткое резюме диалога пользователя с помощником: темы вопросов, "
+                                "важные факты и договоренности. Отвечайте только текстом резюме."
+                            )
+                        },
+                        {"role": "user", "content": f"Предыдущее резюме: {summary or 'нет'}\n\nНовые реплики:\n{dialog}"}
+                    ],
+                    temperature=0,
+                    max_tokens=SESSION_SUMMARY_MAX_TOKENS,
                 )
+                summary = response.choices[0].message.content or summary
+                if not self.session_manager.set_summary(user_id, summary, overflow):
+                    # Сессия очищена за время свертки
+                    break
+                summary, overflow = self.session_manager.pending_overflow(user_id)
+        except Exception as e:
+            logger.error(f"Error summarizing dialog history for user {user_id}: {str(e)}")
+        finally:
+            self.summary_tasks.pop(user_id, None)
+
+    async def close(self):
+        """Закрытие соединений с OpenAI и пула потоков поиска."""
+        await self.client.close()
+        self.retrieval_executor.shutdown(wait=False)
+        self.query_embeddings.close()
+
+    async def generate_answer(self, prepared: PreparedQuery, user_id: int) -> str:
+        """Запрос ответа модели по подготовленным сообщениям."""
+        with span("llm_total"):
+            response = await self.client.complete(
+                user_id,
+                prepared.estimated_tokens,
+                model=GPT_MODEL,
+                messages=prepared.messages,
+                temperature=TEMPERATURE,
+                max_tokens=MAX_TOKENS,
+            )
+        record_usage(response.usage)
+        return response.choices[0].message.content
+
+    async def answer_prepared(self, prepared: PreparedQuery, user_id: int) -> str:
+        """Ответ модели; одновременные одинаковые запросы без истории получают один общий ответ."""
+        if prepared.flight_key is None:
+            return await self.generate_answer(prepared, user_id)
+        answer, leader = await self.answer_flight.do(
+            prepared.flight_key, lambda: self.generate_answer(prepared, user_id)
+        )
+        prepared.shared = not leader
+        if prepared.shared:
+            COALESCED_REQUESTS.inc(kind="answer")
+        return answer
+
+    async def generate_stream(self, prepared: PreparedQuery, user_id: int) -> AsyncIterator[str]:
+        """Потоковый запрос ответа модели: фрагменты текста по мере генерации."""
+        started = time.perf_counter()
+        first_token = True
+        try:
+            async with self.client.stream(
+                user_id,
+                prepared.estimated_tokens,
+                model=GPT_MODEL,
+                messages=prepared.messages,
+                temperature=TEMPERATURE,
+                max_tokens=MAX_TOKENS,
+                # Последний фрагмент потока содержит usage, в том числе cached_tokens
+                stream_options={"include_usage": True},
+            ) as stream:
+                async for chunk in stream:
+                    if chunk.usage is not None:
+                        record_usage(chunk.usage)
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        if first_token:
+                            record_span("llm_ttft", time.perf_counter() - started)
+                            first_token = False
+                        yield chunk.choices[0].delta.content
+        finally:
+            record_span("llm_total", time.perf_counter() - started)
+
+    def coalescing_stats(self) -> Dict[str, int]:
+        """Число объединенных одновременных одинаковых запросов."""
+        return {
+            "retrieval": self.retrieval_flight.coalesced,
+            "answers": self.answer_flight.coalesced,
+            "streams": self.stream_flight.coalesced,
+        }
+
+    async def process_query(self, user_query: str, user_id: int) -> str:
+        """Асинхронная обработка запроса пользователя с учетом контекста диалога."""
+        try:
+            prepared = await self.prepare_query(user_query, user_id)
+            if prepared.cached_answer is not None:
+                self.complete_query(prepared, user_id, prepared.cached_answer)
+                return prepared.cached_answer
 
-                answer = response.choices[0].message.content
+            try:
+                answer = await self.answer_prepared(prepared, user_id)
 
-                # Сохраняем сообщения в контекст
-                self.session_manager.update_session(user_id, {"role": "user", "content": user_query})
-                self.session_manager.update_session(user_id, {"role": "assistant", "content": answer})
+                # Сохраняем сообщения в контекст и кэш
+                self.complete_query(prepared, user_id, answer)
 
                 return answer
 
@@ -206,3 +1207,46 @@ class VineyardAssistant:
             error_msg = f"Error processing query: {str(e)}"
             logger.error(error_msg)
             raise Exception(error_msg) from e
+
+    async def stream_query(self, user_query: str, user_id: int) -> AsyncIterator[str]:
+        """
+        Потоковая обработка запроса: асинхронный генератор фрагментов ответа по мере их генерации.
+        """
+        try:
+            prepared = await self.prepare_query(user_query, user_id)
+        except Exception as e:
+            error_msg = f"Error processing query: {str(e)}"
+            logger.error(error_msg)
+            raise Exception(error_msg) from e
+
+        if prepared.cached_answer is not None:
+            self.complete_query(prepared, user_id, prepared.cached_answer)
+            yield prepared.cached_answer
+            return
+
+        if prepared.flight_key is None:
+            source = self.generate_stream(prepared, user_id)
+        else:
+            # Одновременные одинаковые запросы без истории читают один общий поток ответа
+            shared_stream, leader = self.stream_flight.join(
+                prepared.flight_key, lambda: self.generate_stream(prepared, user_id)
+            )
+            prepared.shared = not leader
+            if prepared.shared:
+                COALESCED_REQUESTS.inc(kind="stream")
+            source = shared_stream.subscribe()
+
+        parts = []
+        try:
+            async for part in source:
+                parts.append(part)
+                yield part
+        except Exception as e:
+            error_msg = f"Error code: {getattr(e, 'status_code', 'Unknown')} - {str(e)}"
+            logger.error(error_msg)
+            raise Exception(f"Error processing query: {error_msg}") from e
+        finally:
+            await source.aclose()
+
+        # Сохраняем сообщения в контекст и кэш только после полного ответа
+        self.complete_query(prepared, user_id, "".join(parts))
@@ -0,0 +1,273 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+from aiohttp import web
+
+
+logger = logging.getLogger(__name__)
+
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Границы корзин гистограмм задержек, секунд
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def setup_logging(log_file: str, level: int = logging.INFO) -> logging.handlers.QueueListener:
+    """
+    Логирование через очередь: обработчики цикла событий только кладут записи в очередь,
+    запись в файл и консоль выполняет отдельный поток QueueListener.
+    """
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.FileHandler(log_file), logging.StreamHandler()]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    log_queue: queue.Queue = queue.Queue(-1)
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    root = logging.getLogger()
+    root.handlers = [logging.handlers.QueueHandler(log_queue)]
+    root.setLevel(level)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{str(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """Счетчик с метками в формате Prometheus"""
+    TYPE = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(tuple(str(labels.get(name, "")) for name in self.labelnames), 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    """Текущее значение с метками в формате Prometheus (размер очереди, число задач)"""
+    TYPE = "gauge"
+
+    def set(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram:
+    """Гистограмма с метками в формате Prometheus"""
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._counts: Dict[Tuple[str, ...], List[int]] = {}
+        self._sums: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            counts = self._counts.setdefault(key, [0] * (len(self.buckets) + 1))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, counts in sorted(self._counts.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float("inf"),), counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    labels = _format_labels(self.labelnames + ("le",), key + (le,))
+                    lines.append(f"{self.name}_bucket{labels} {cumulative}")
+                labels = _format_labels(self.labelnames, key)
+                lines.append(f"{self.name}_sum{labels} {self._sums[key]}")
+                lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "vineyard_stage_seconds", "Duration of request processing stages", ("stage",)
+)
+REQUEST_SECONDS = Histogram(
+    "vineyard_request_seconds", "End-to-end request duration", ("interface", "status")
+)
+CACHE_LOOKUPS = Counter(
+    "vineyard_cache_lookups_total", "Cache lookups by cache and result", ("cache", "result")
+)
+COALESCED_REQUESTS = Counter(
+    "vineyard_coalesced_requests_total", "Requests served by an identical in-flight request", ("kind",)
+)
+RERANK_RESULTS = Counter(
+    "vineyard_rerank_total", "Rerank outcomes: reranked or kept retrieval order on budget overrun", ("result",)
+)
+ANSWER_WARMUP = Counter(
+    "vineyard_answer_warmup_total", "Warm-up questions by outcome: generated, cached or error", ("result",)
+)
+UPDATE_QUEUE = Gauge(
+    "vineyard_update_queue", "Telegram updates waiting in chat queues or being processed", ("state",)
+)
+UPDATES_REJECTED = Counter(
+    "vineyard_updates_rejected_total", "Telegram updates answered with a busy reply", ("reason",)
+)
+TELEGRAM_RETRY_AFTER = Counter(
+    "vineyard_telegram_retry_after_total", "Telegram 429 responses (flood control)"
+)
+OPENAI_REQUESTS = Counter(
+    "vineyard_openai_requests_total", "OpenAI requests by outcome", ("outcome",)
+)
+OPENAI_ERRORS = Counter(
+    "vineyard_openai_errors_total", "OpenAI request errors by status code", ("status",)
+)
+OPENAI_RATE_LIMITS = Counter(
+    "vineyard_openai_rate_limits_total", "OpenAI 429 responses"
+)
+OPENAI_TOKENS = Counter(
+    "vineyard_openai_tokens_total", "OpenAI tokens by kind", ("kind",)
+)
+
+METRICS = [
+    STAGE_SECONDS, REQUEST_SECONDS, CACHE_LOOKUPS, COALESCED_REQUESTS, RERANK_RESULTS, ANSWER_WARMUP,
+    UPDATE_QUEUE, UPDATES_REJECTED, TELEGRAM_RETRY_AFTER,
+    OPENAI_REQUESTS, OPENAI_ERRORS, OPENAI_RATE_LIMITS, OPENAI_TOKENS,
+]
+
+
+def render_metrics() -> str:
+    """Все метрики в текстовом формате Prometheus"""
+    lines: List[str] = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class Trace:
+    """Трассировка одного запроса: длительности этапов и атрибуты"""
+    def __init__(self, name: str, **attributes):
+        self.name = name
+        self.attributes = attributes
+        self.spans: Dict[str, float] = {}
+        self.started = time.perf_counter()
+
+    def add(self, stage: str, seconds: float):
+        self.spans[stage] = self.spans.get(stage, 0.0) + seconds
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("vineyard_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+def record_span(stage: str, seconds: float, trace_: Optional[Trace] = None):
+    """Учет длительности этапа в гистограмме и в трассировке текущего запроса"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    trace_ = trace_ or _current_trace.get()
+    if trace_ is not None:
+        trace_.add(stage, seconds)
+
+
+def record_usage(usage):
+    """Учет токенов из поля usage ответа OpenAI"""
+    if usage is None:
+        return
+    OPENAI_TOKENS.inc(usage.prompt_tokens or 0, kind="prompt")
+    OPENAI_TOKENS.inc(usage.completion_tokens or 0, kind="completion")
+    # Входные токены, взятые из кэша начала промпта на стороне OpenAI
+    details = getattr(usage, "prompt_tokens_details", None)
+    OPENAI_TOKENS.inc(getattr(details, "cached_tokens", None) or 0, kind="cached_prompt")
+
+
+@contextmanager
+def span(stage: str) -> Iterator[None]:
+    """Замер этапа обработки запроса"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_span(stage, time.perf_counter() - started)
+
+
+@contextmanager
+def trace(name: str, **attributes) -> Iterator[Trace]:
+    """
+    Трассировка запроса: этапы, выполненные внутри (в том числе в дочерних задачах),
+    собираются в одну запись, которая пишется в лог одной строкой JSON.
+    """
+    current = Trace(name, **attributes)
+    token = _current_trace.set(current)
+    status = "ok"
+    try:
+        yield current
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        _current_trace.reset(token)
+        total = time.perf_counter() - current.started
+        REQUEST_SECONDS.observe(total, interface=name, status=status)
+        logger.info("trace " + json.dumps({
+            "trace": name,
+            **current.attributes,
+            "status": status,
+            "total_ms": round(total * 1000, 2),
+            "spans_ms": {stage: round(seconds * 1000, 2) for stage, seconds in current.spans.items()},
+        }, ensure_ascii=False))
+
+
+async def start_metrics_server(host: str, port: int) -> web.AppRunner:
+    """Запуск HTTP-эндпоинта /metrics в текущем цикле событий"""
+    async def metrics(_: web.Request) -> web.Response:
+        return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError:
+        await runner.cleanup()
+        raise
+    logger.info(f"Metrics endpoint listening on http://{host}:{port}/metrics")
+    return runner
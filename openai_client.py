@@ -0,0 +1,266 @@
+import asyncio
+import logging
+import random
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Deque, Hashable, Optional, Type, TypeVar
+import httpx
+from openai import (
+    APIConnectionError, APIStatusError, APITimeoutError, AsyncOpenAI, AsyncStream,
+    InternalServerError, RateLimitError
+)
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+from observability import OPENAI_ERRORS, OPENAI_RATE_LIMITS, OPENAI_REQUESTS
+
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_ERRORS = (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError)
+
+ErrorType = TypeVar("ErrorType", bound=BaseException)
+
+
+def find_error(error: Optional[BaseException], error_type: Type[ErrorType]) -> Optional[ErrorType]:
+    """Исключение error_type в цепочке причин: ассистент оборачивает ошибки API (raise ... from e)"""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        if isinstance(error, error_type):
+            return error
+        seen.add(id(error))
+        error = error.__cause__ or error.__context__
+    return None
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """Пауза из заголовков retry-after-ms или retry-after ответа API, секунд; None, если ее нет"""
+    if isinstance(error, APIStatusError):
+        headers = error.response.headers
+        try:
+            if "retry-after-ms" in headers:
+                return float(headers["retry-after-ms"]) / 1000
+            if "retry-after" in headers:
+                return float(headers["retry-after"])
+        except ValueError:
+            pass
+    return None
+
+
+class TokenBucket:
+    """Асинхронное ведро токенов: лимит расходуется единицами и восполняется равномерно за минуту"""
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float):
+        """Ожидание, пока в ведре наберется amount единиц; ожидающие обслуживаются по очереди"""
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def refund(self, amount: float):
+        """Возврат неизрасходованных единиц, если фактический расход меньше оценки"""
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class FairLimiter:
+    """
+    Ограничение числа одновременных запросов. Ожидающие запросы стоят в очередях
+    по пользователям, освободившийся слот отдается очередям по кругу, поэтому один
+    пользователь с пачкой запросов не задерживает остальных.
+    """
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        self.active = 0
+        self._queues: "OrderedDict[Hashable, Deque[asyncio.Future]]" = OrderedDict()
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def acquire(self, key: Hashable):
+        if self.active < self.max_concurrency and not self._queues:
+            self.active += 1
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._queues.setdefault(key, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Слот мог быть выдан непосредственно перед отменой
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self):
+        self.active -= 1
+        while self.active < self.max_concurrency and self._queues:
+            key, queue = next(iter(self._queues.items()))
+            future = queue.popleft()
+            if queue:
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+            if future.cancelled():
+                continue
+            self.active += 1
+            future.set_result(None)
+
+    @asynccontextmanager
+    async def slot(self, key: Hashable):
+        await self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class UsageStream:
+    """Поток фрагментов ответа, запоминающий usage последнего фрагмента (stream_options.include_usage)"""
+    def __init__(self, stream: AsyncStream[ChatCompletionChunk]):
+        self.stream = stream
+        self.usage = None
+
+    async def __aiter__(self) -> AsyncIterator[ChatCompletionChunk]:
+        async for chunk in self.stream:
+            if chunk.usage is not None:
+                self.usage = chunk.usage
+            yield chunk
+
+
+class OpenAIClient:
+    """
+    Асинхронный клиент Chat Completions поверх AsyncOpenAI с общим пулом HTTP-соединений.
+    Запросы проходят через справедливую очередь по пользователям с ограничением
+    параллельности и через лимиты RPM/TPM; ответы 429 и временные ошибки повторяются
+    с учетом заголовков retry-after или с экспоненциальной задержкой со случайным разбросом.
+    """
+    def __init__(
+            self,
+            api_key: Optional[str],
+            base_url: Optional[str] = None,
+            max_concurrency: int = 16,
+            rpm_limit: int = 0,
+            tpm_limit: int = 0,
+            max_retries: int = 5,
+            backoff_base: float = 0.5,
+            backoff_max: float = 30.0,
+            max_connections: int = 100,
+            timeout: float = 60.0
+    ):
+        self.http_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+                keepalive_expiry=60.0
+            ),
+            timeout=httpx.Timeout(timeout, connect=10.0)
+        )
+        # Повторы выполняются здесь, с учетом общих лимитов, а не внутри SDK
+        self.client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=self.http_client, max_retries=0)
+        self.limiter = FairLimiter(max_concurrency)
+        self.request_bucket = TokenBucket(rpm_limit) if rpm_limit else None
+        self.token_bucket = TokenBucket(tpm_limit) if tpm_limit else None
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.blocked_until = 0.0
+        self.retries = 0
+
+    async def _wait_for_capacity(self, estimated_tokens: int):
+        """Ожидание окончания паузы после 429 и свободного лимита RPM/TPM"""
+        delay = self.blocked_until - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if self.request_bucket is not None:
+            await self.request_bucket.acquire(1)
+        if self.token_bucket is not None:
+            await self.token_bucket.acquire(estimated_tokens)
+
+    def _settle_tokens(self, estimated_tokens: int, usage):
+        if self.token_bucket is not None and usage is not None and usage.total_tokens < estimated_tokens:
+            self.token_bucket.refund(estimated_tokens - usage.total_tokens)
+
+    def retry_delay(self, error: Exception, attempt: int) -> float:
+        """Задержка перед повтором: retry-after из ответа или экспонента с полным разбросом"""
+        delay = retry_after(error)
+        if delay is not None:
+            return min(delay, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def _request(self, send: Callable[[], Awaitable], estimated_tokens: int):
+        for attempt in range(self.max_retries + 1):
+            await self._wait_for_capacity(estimated_tokens)
+            try:
+                response = await send()
+            except RETRYABLE_ERRORS as e:
+                OPENAI_ERRORS.inc(status=getattr(e, 'status_code', None) or type(e).__name__)
+                if isinstance(e, RateLimitError):
+                    OPENAI_RATE_LIMITS.inc()
+                if attempt >= self.max_retries:
+                    OPENAI_REQUESTS.inc(outcome="error")
+                    raise
+                OPENAI_REQUESTS.inc(outcome="retry")
+                delay = self.retry_delay(e, attempt)
+                if isinstance(e, RateLimitError):
+                    # Лимит аккаунта общий: приостанавливаем все запросы, а не только этот
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+                self.retries += 1
+                logger.warning(
+                    f"OpenAI request failed (Error code: {getattr(e, 'status_code', 'Unknown')}), "
+                    f"retry {attempt + 1}/{self.max_retries} in {delay:.2f}s"
+                )
+                await asyncio.sleep(delay)
+            except APIStatusError as e:
+                OPENAI_ERRORS.inc(status=e.status_code)
+                OPENAI_REQUESTS.inc(outcome="error")
+                raise
+            else:
+                OPENAI_REQUESTS.inc(outcome="ok")
+                return response
+
+    async def complete(self, user_id: Hashable, estimated_tokens: int, **kwargs) -> ChatCompletion:
+        """Запрос Chat Completions в очереди пользователя с учетом лимитов и повторов"""
+        async with self.limiter.slot(user_id):
+            response = await self._request(
+                lambda: self.client.chat.completions.create(**kwargs), estimated_tokens
+            )
+        self._settle_tokens(estimated_tokens, response.usage)
+        return response
+
+    @asynccontextmanager
+    async def stream(self, user_id: Hashable, estimated_tokens: int, **kwargs) -> AsyncIterator["UsageStream"]:
+        """
+        Потоковый запрос Chat Completions. Слот очереди занят до закрытия потока;
+        повторяется только установка соединения, до получения первых данных.
+        Резерв TPM уточняется по usage из последнего фрагмента потока.
+        """
+        kwargs.setdefault("stream_options", {"include_usage": True})
+        async with self.limiter.slot(user_id):
+            stream = await self._request(
+                lambda: self.client.chat.completions.create(stream=True, **kwargs), estimated_tokens
+            )
+            tracked = UsageStream(stream)
+            try:
+                async with stream:
+                    yield tracked
+            finally:
+                self._settle_tokens(estimated_tokens, tracked.usage)
+
+    async def close(self):
+        await self.client.close()
+        await self.http_client.aclose()
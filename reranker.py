@@ -0,0 +1,109 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+from observability import CACHE_LOOKUPS, RERANK_RESULTS
+
+
+logger = logging.getLogger(__name__)
+
+
+class CrossEncoderReranker:
+    """
+    Переранжирование кандидатов поиска кросс-энкодером: пары (запрос, фрагмент)
+    оцениваются батчами на CPU, оценки кэшируются по (запрос, идентификатор фрагмента).
+    Оценка укладывается в бюджет времени на запрос: если следующий батч не успевает,
+    сохраняется исходный порядок кандидатов.
+    """
+    def __init__(self, model_name: str, budget: float, batch_size: int = 16,
+                 max_length: int = 256, cache_size: int = 50000, model: Any = None):
+        if model is None:
+            from sentence_transformers import CrossEncoder
+            model = CrossEncoder(model_name, max_length=max_length, device="cpu")
+        self.model = model
+        self.budget = budget
+        self.batch_size = batch_size
+        self.cache_size = cache_size
+        self.scores: "OrderedDict[Tuple[str, str], float]" = OrderedDict()
+        self.reranked = 0
+        self.fallbacks = 0
+        self._lock = threading.Lock()
+
+    def score(self, query: str, documents: List[Document]) -> Optional[List[float]]:
+        """Оценки документов для запроса или None, если бюджет времени исчерпан."""
+        started = time.perf_counter()
+        keys = [(query, doc.id) for doc in documents]
+        with self._lock:
+            scores: List[Optional[float]] = []
+            for cache_key in keys:
+                score = self.scores.get(cache_key)
+                if score is not None:
+                    self.scores.move_to_end(cache_key)
+                scores.append(score)
+        missing = [i for i, score in enumerate(scores) if score is None]
+        CACHE_LOOKUPS.inc(len(documents) - len(missing), cache="rerank", result="hit")
+        CACHE_LOOKUPS.inc(len(missing), cache="rerank", result="miss")
+
+        batch_time = 0.0
+        for start in range(0, len(missing), self.batch_size):
+            # Длительность следующего батча оценивается по предыдущему
+            if time.perf_counter() - started + batch_time > self.budget:
+                return None
+            batch_started = time.perf_counter()
+            positions = missing[start:start + self.batch_size]
+            values = self.model.predict(
+                [(query, documents[i].page_content) for i in positions],
+                batch_size=len(positions),
+                show_progress_bar=False
+            )
+            batch_time = time.perf_counter() - batch_started
+            with self._lock:
+                for i, value in zip(positions, values):
+                    scores[i] = float(value)
+                    self.scores[keys[i]] = scores[i]
+                while len(self.scores) > self.cache_size:
+                    self.scores.popitem(last=False)
+        return scores
+
+    def rerank(self, query: str, documents: List[Document], top_n: int) -> Tuple[List[Document], bool]:
+        """
+        top_n лучших документов по оценке кросс-энкодера. Вторым значением возвращается,
+        удалось ли переранжировать: при превышении бюджета документы возвращаются как есть.
+        """
+        if not documents:
+            return documents, True
+        scores = self.score(query, documents)
+        if scores is None:
+            with self._lock:
+                self.fallbacks += 1
+            RERANK_RESULTS.inc(result="fallback")
+            logger.warning(f"Rerank budget of {self.budget * 1000:.0f} ms exceeded, keeping retrieval order")
+            return documents, False
+        order = sorted(range(len(documents)), key=lambda i: -scores[i])[:top_n]
+        reranked = []
+        for i in order:
+            doc = documents[i]
+            doc.metadata["retrieval_score"] = doc.metadata.get("score")
+            doc.metadata["score"] = scores[i]
+            reranked.append(doc)
+        with self._lock:
+            self.reranked += 1
+        RERANK_RESULTS.inc(result="reranked")
+        return reranked, True
+
+    def clear(self):
+        """Сброс кэша оценок, например после перестройки индекса (идентификаторы меняются)"""
+        with self._lock:
+            self.scores.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.reranked + self.fallbacks
+            return {
+                "cached_scores": len(self.scores),
+                "reranked": self.reranked,
+                "fallbacks": self.fallbacks,
+                "fallback_rate": self.fallbacks / total if total else 0.0,
+            }
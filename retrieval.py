@@ -0,0 +1,141 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor
+from typing import Any, Callable, Dict, Hashable, List, Optional, Sequence, Tuple
+from langchain_core.documents import Document
+
+
+class MicroBatcher:
+    """
+    Микробатчинг вызовов: элементы, поступившие в течение короткого окна,
+    обрабатываются одним вызовом batch_fn в отдельном пуле потоков,
+    чтобы кодирование и поиск не блокировали цикл событий.
+    """
+    def __init__(
+            self,
+            batch_fn: Callable[[List[Any]], Sequence[Any]],
+            executor: Executor,
+            window: float,
+            max_batch_size: int
+    ):
+        self.batch_fn = batch_fn
+        self.executor = executor
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._pending: List[tuple] = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+    async def submit(self, item: Any) -> Any:
+        """Постановка элемента в текущий батч и ожидание результата."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        """Отправка накопленного батча в пул потоков."""
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        items = [item for item, _ in batch]
+        futures = [future for _, future in batch]
+        loop = asyncio.get_running_loop()
+        task = loop.run_in_executor(self.executor, self.batch_fn, items)
+        task.add_done_callback(lambda done: self._resolve(done, futures))
+
+    @staticmethod
+    def _resolve(done: asyncio.Future, futures: List[asyncio.Future]):
+        """Раздача результатов батча ожидающим вызовам."""
+        error = done.exception()
+        results = None if error else done.result()
+        for i, future in enumerate(futures):
+            if future.done():
+                continue
+            if error:
+                future.set_exception(error)
+            else:
+                future.set_result(results[i])
+
+
+class RetrievalCache:
+    """
+    Потокобезопасный LRU-кэш результатов поиска для одного экземпляра ассистента.
+    Ключ — нормализованный текст запроса и параметры поиска. Каждый вызов получает
+    собственные копии документов, поэтому изменения результата не портят кэш.
+    """
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.entries: "OrderedDict[Hashable, Tuple[Any, List[Document]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(query: str, *params: Any) -> Hashable:
+        """Ключ кэша: запрос без учета регистра и лишних пробелов плюс параметры поиска"""
+        return (' '.join(query.lower().split()),) + params
+
+    def get(self, key: Hashable) -> Optional[Tuple[Any, List[Document]]]:
+        """Получение эмбеддинга запроса и копий найденных документов"""
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+        vector, documents = entry
+        return vector, [doc.model_copy(deep=True) for doc in documents]
+
+    def put(self, key: Hashable, vector: Any, documents: List[Document]):
+        """Сохранение результата поиска с вытеснением самых старых записей"""
+        documents = [doc.model_copy(deep=True) for doc in documents]
+        with self._lock:
+            self.entries[key] = (vector, documents)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.capacity:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        """Сброс кэша, например после перезагрузки векторного хранилища"""
+        with self._lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Счетчики попаданий, промахов и вытеснений"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+def reciprocal_rank_fusion(
+        rankings: Sequence[Sequence[int]],
+        weights: Sequence[float],
+        k: int,
+        rrf_k: int = 60
+) -> List[Tuple[int, float]]:
+    """Объединение ранжированных списков методом RRF с весами источников: пары (идентификатор, оценка)."""
+    fused: Dict[int, float] = {}
+    for ranking, weight in zip(rankings, weights):
+        for rank, chunk_id in enumerate(ranking):
+            if chunk_id < 0:
+                continue
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + weight / (rrf_k + rank + 1)
+    return sorted(fused.items(), key=lambda item: -item[1])[:k]
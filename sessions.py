@@ -0,0 +1,216 @@
+import heapq
+import json
+import logging
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+def estimate_tokens(text: str) -> int:
+    """Грубая оценка числа токенов по длине текста"""
+    return max(1, len(text) // 4)
+
+
+class UserSession:
+    """Класс для хранения информации о сессии пользователя"""
+    def __init__(self, user_id: int, last_activity: Optional[float] = None,
+                 context: Optional[List[dict]] = None, summary: str = "", overflow: Optional[List[dict]] = None):
+        self.user_id = user_id
+        self.last_activity: float = last_activity or time.time()
+        self.context: List[dict] = context or []
+        self.summary = summary
+        # Вытесненные из истории реплики, еще не свернутые в резюме
+        self.overflow: List[dict] = overflow or []
+
+
+class SQLiteSessionStore:
+    """
+    Хранение сессий в SQLite, чтобы контекст диалога переживал перезапуск.
+    Вместе с сессией хранятся вытесненные реплики, ожидающие свертки в резюме.
+    """
+    def __init__(self, db_path: str):
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "user_id INTEGER PRIMARY KEY, last_activity REAL, summary TEXT, context TEXT, overflow TEXT)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(sessions)")}
+        if "overflow" not in columns:
+            self._db.execute("ALTER TABLE sessions ADD COLUMN overflow TEXT")
+
+    def load(self, user_id: int) -> Optional[UserSession]:
+        row = self._db.execute(
+            "SELECT last_activity, summary, context, overflow FROM sessions WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        last_activity, summary, context, overflow = row
+        return UserSession(user_id, last_activity, json.loads(context), summary, json.loads(overflow or "[]"))
+
+    def save(self, session: UserSession):
+        self._db.execute(
+            "INSERT OR REPLACE INTO sessions (user_id, last_activity, summary, context, overflow) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (session.user_id, session.last_activity, session.summary,
+             json.dumps(session.context, ensure_ascii=False), json.dumps(session.overflow, ensure_ascii=False))
+        )
+
+    def delete(self, user_id: int):
+        self._db.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,))
+
+    def delete_expired(self, before: float):
+        self._db.execute("DELETE FROM sessions WHERE last_activity < ?", (before,))
+
+
+class SessionManager:
+    """
+    Менеджер пользовательских сессий. Истечение сессий отслеживается кучей сроков,
+    поэтому обращение к сессии не перебирает все сессии. История ограничена бюджетом
+    токенов: старые реплики вытесняются в очередь на свертку в краткое резюме —
+    сразу до доли trim_target бюджета, поэтому начало истории и резюме меняются
+    не с каждой репликой. Реплики остаются в очереди, пока резюме с ними не сохранено.
+    При указании store сессии вместе с очередью сохраняются и переживают перезапуск.
+    """
+    def __init__(
+            self,
+            session_timeout: int = 30,
+            history_token_budget: int = 2000,
+            store: Optional[SQLiteSessionStore] = None,
+            token_counter: Callable[[str], int] = estimate_tokens,
+            trim_target: float = 1.0
+    ):
+        self.sessions: Dict[int, UserSession] = {}
+        self.session_timeout = session_timeout  # в минутах
+        self.history_token_budget = history_token_budget
+        self.store = store
+        self.token_counter = token_counter
+        self.trim_target = trim_target
+        self._expiry_heap: List[Tuple[float, int]] = []
+        self._lock = threading.RLock()
+        if self.store is not None:
+            self.store.delete_expired(time.time() - self.timeout_seconds)
+
+    @property
+    def timeout_seconds(self) -> float:
+        return self.session_timeout * 60
+
+    def _schedule_expiry(self, session: UserSession):
+        heapq.heappush(self._expiry_heap, (session.last_activity + self.timeout_seconds, session.user_id))
+        # Устаревшие записи кучи удаляются лениво; при разрастании куча перестраивается
+        if len(self._expiry_heap) > 2 * len(self.sessions) + 64:
+            self._expiry_heap = [
+                (s.last_activity + self.timeout_seconds, s.user_id) for s in self.sessions.values()
+            ]
+            heapq.heapify(self._expiry_heap)
+
+    def cleanup_expired_sessions(self):
+        """Очистка истекших сессий: просматриваются только записи с наступившим сроком"""
+        now = time.time()
+        with self._lock:
+            while self._expiry_heap and self._expiry_heap[0][0] <= now:
+                _, user_id = heapq.heappop(self._expiry_heap)
+                session = self.sessions.get(user_id)
+                if session is not None and session.last_activity + self.timeout_seconds <= now:
+                    del self.sessions[user_id]
+                    if self.store is not None:
+                        self.store.delete(user_id)
+
+    def get_session(self, user_id: int) -> UserSession:
+        """Получение или создание сессии пользователя"""
+        self.cleanup_expired_sessions()
+        with self._lock:
+            session = self.sessions.get(user_id)
+            if session is None:
+                if self.store is not None:
+                    session = self.store.load(user_id)
+                    if session is not None and session.last_activity + self.timeout_seconds <= time.time():
+                        self.store.delete(user_id)
+                        session = None
+                if session is None:
+                    session = UserSession(user_id)
+                self.sessions[user_id] = session
+                self._schedule_expiry(session)
+            return session
+
+    def has_session(self, user_id: int) -> bool:
+        """Проверка наличия активной сессии с историей"""
+        self.cleanup_expired_sessions()
+        with self._lock:
+            session = self.sessions.get(user_id)
+            return session is not None and bool(session.context or session.summary)
+
+    def update_session(self, user_id: int, *messages: dict):
+        """Обновление сессии пользователя новыми сообщениями"""
+        with self._lock:
+            session = self.get_session(user_id)
+            session.last_activity = time.time()
+            session.context.extend(messages)
+            self._trim_history(session)
+            self._schedule_expiry(session)
+            if self.store is not None:
+                self.store.save(session)
+
+    def _trim_history(self, session: UserSession):
+        """Вытеснение старых реплик сверх бюджета токенов в очередь на свертку"""
+        total = sum(self.token_counter(message["content"]) for message in session.context)
+        if total <= self.history_token_budget:
+            return
+        target = self.history_token_budget * self.trim_target
+        # История после сокращения начинается с вопроса пользователя
+        while (total > target or session.context[0]["role"] != "user") and len(session.context) > 2:
+            message = session.context.pop(0)
+            total -= self.token_counter(message["content"])
+            session.overflow.append(message)
+
+    def clear_session(self, user_id: int):
+        """Удаление сессии и ее истории"""
+        with self._lock:
+            self.sessions.pop(user_id, None)
+            if self.store is not None:
+                self.store.delete(user_id)
+
+    def pending_overflow(self, user_id: int) -> Tuple[str, List[dict]]:
+        """
+        Текущее резюме и вытесненные реплики, ожидающие свертки. Реплики остаются
+        в очереди (и в хранилище) до set_summary, поэтому сбой свертки их не теряет.
+        """
+        with self._lock:
+            session = self.sessions.get(user_id)
+            if session is None:
+                return "", []
+            return session.summary, list(session.overflow)
+
+    def set_summary(self, user_id: int, summary: str, summarized: List[dict]) -> bool:
+        """
+        Сохранение нового резюме ранней части диалога и удаление свернутых в него
+        реплик summarized из очереди. Если сессия за время свертки очищена
+        или заменена, резюме к ней не относится и отбрасывается (False).
+        """
+        with self._lock:
+            session = self.sessions.get(user_id)
+            if session is None or session.overflow[:len(summarized)] != summarized:
+                return False
+            session.summary = summary
+            del session.overflow[:len(summarized)]
+            if self.store is not None:
+                self.store.save(session)
+            return True
+
+    def get_context(self, user_id: int) -> List[dict]:
+        """Получение контекста диалога пользователя: резюме ранней части и последние реплики"""
+        session = self.get_session(user_id)
+        with self._lock:
+            context = []
+            if session.summary:
+                context.append({
+                    "role": "system",
+                    "content": f"Краткое содержание предыдущей части диалога: {session.summary}"
+                })
+            context.extend(session.context)
+            return context
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional, Union
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendChatAction, TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+from observability import TELEGRAM_RETRY_AFTER, record_span
+
+
+logger = logging.getLogger(__name__)
+
+ChatId = Union[int, str]
+
+
+class TelegramRateLimiter(BaseRequestMiddleware):
+    """
+    Middleware сессии aiogram, соблюдающий лимиты Telegram для исходящих сообщений:
+    не чаще одного сообщения в chat_interval секунд в личный чат (group_interval — в группу)
+    и не более global_rate сообщений в секунду на бота. Очередь на отправку резервируется
+    в порядке вызовов, поэтому части одного ответа не перемешиваются. Ответ 429
+    (TelegramRetryAfter) откладывает отправку в чат на указанное время, запрос повторяется.
+
+    Общий лимит бота действует на все процессы: в многопроцессном режиме shared_clock —
+    разделяемое значение multiprocessing.Value("d") со временем следующего свободного
+    слота (time.monotonic общее для процессов одной машины). Лимиты чатов остаются
+    локальными: сообщения одного пользователя отправляет один процесс.
+    """
+    MAX_TRACKED_CHATS = 10000
+
+    def __init__(self, global_rate: float, chat_interval: float, group_interval: float, max_retries: int,
+                 shared_clock: Optional[Any] = None):
+        self.global_interval = 1.0 / global_rate if global_rate else 0.0
+        self.shared_clock = shared_clock
+        self.chat_interval = chat_interval
+        self.group_interval = group_interval
+        self.max_retries = max_retries
+        self.next_global = 0.0
+        self.next_chat: Dict[ChatId, float] = {}
+
+    def chat_delay(self, chat_id: ChatId) -> float:
+        """Резервирование очередного слота отправки в чат: секунд до него"""
+        now = time.monotonic()
+        is_group = isinstance(chat_id, str) or chat_id < 0
+        at = max(now, self.next_chat.get(chat_id, 0.0))
+        self.next_chat[chat_id] = at + (self.group_interval if is_group else self.chat_interval)
+        if len(self.next_chat) > self.MAX_TRACKED_CHATS:
+            self.next_chat = {chat: moment for chat, moment in self.next_chat.items() if moment > now}
+        return at - now
+
+    def global_delay(self) -> float:
+        """Резервирование слота в общем лимите бота: секунд до него"""
+        if self.shared_clock is not None:
+            with self.shared_clock.get_lock():
+                now = time.monotonic()
+                at = max(now, self.shared_clock.value)
+                self.shared_clock.value = at + self.global_interval
+            return at - now
+        now = time.monotonic()
+        at = max(now, self.next_global)
+        self.next_global = at + self.global_interval
+        return at - now
+
+    async def wait_turn(self, chat_id: ChatId):
+        """Ожидание очереди чата, затем общего лимита"""
+        waited = 0.0
+        delay = self.chat_delay(chat_id)
+        if delay > 0:
+            await asyncio.sleep(delay)
+            waited += delay
+        delay = self.global_delay()
+        if delay > 0:
+            await asyncio.sleep(delay)
+            waited += delay
+        if waited:
+            record_span("telegram_pacing", waited)
+
+    async def __call__(
+            self,
+            make_request: NextRequestMiddlewareType[TelegramType],
+            bot: Bot,
+            method: TelegramMethod[TelegramType],
+    ) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        # Индикатор набора текста и служебные запросы (getUpdates, setWebhook) не ограничиваются
+        if chat_id is None or isinstance(method, SendChatAction):
+            return await make_request(bot, method)
+        for attempt in range(self.max_retries + 1):
+            await self.wait_turn(chat_id)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                TELEGRAM_RETRY_AFTER.inc()
+                if attempt >= self.max_retries:
+                    raise
+                logger.warning(
+                    f"Telegram flood control for chat {chat_id}: retry {attempt + 1}/{self.max_retries} "
+                    f"in {e.retry_after}s"
+                )
+                self.next_chat[chat_id] = max(self.next_chat.get(chat_id, 0.0), time.monotonic() + e.retry_after)
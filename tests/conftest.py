@@ -0,0 +1,181 @@
+"""
+Общие фикстуры тестов: моки Telegram Bot API и OpenAI из benchmarks/ запускаются
+в том же процессе на свободном порту, бот и клиент обращаются к ним вместо настоящих API.
+
+Запуск из корня проекта:
+    python -m pytest -q
+"""
+import contextlib
+import os
+import re
+import sys
+import zlib
+from typing import Dict, List, Optional
+
+import numpy as np
+import pytest
+from aiohttp import web
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+# config читает токены при импорте; настоящие токены тестам не нужны
+os.environ.setdefault("BOT_TOKEN", "123:TEST")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.aiohttp import AiohttpSession  # noqa: E402
+from aiogram.client.telegram import TelegramAPIServer  # noqa: E402
+from aiogram.types import Update  # noqa: E402
+from langchain_core.embeddings import Embeddings  # noqa: E402
+
+
+@pytest.fixture
+def serve():
+    """Асинхронный контекст, запускающий приложение aiohttp на свободном порту; отдает базовый URL"""
+    @contextlib.asynccontextmanager
+    async def run(app: web.Application):
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        try:
+            yield f"http://127.0.0.1:{port}"
+        finally:
+            await runner.cleanup()
+    return run
+
+
+@pytest.fixture(scope="session")
+def vineyard_bot_cls(tmp_path_factory):
+    """Класс VineyardBot; модуль bot при импорте создает журнал в текущем каталоге"""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp("bot"))
+    try:
+        from bot import VineyardBot
+    finally:
+        os.chdir(cwd)
+    return VineyardBot
+
+
+def make_bot(api_url: str, *middlewares) -> Bot:
+    """Бот, отправляющий запросы в мок Bot API через указанные middleware сессии"""
+    bot = Bot(token="123:TEST", session=AiohttpSession(api=TelegramAPIServer.from_base(api_url)))
+    for middleware in middlewares:
+        bot.session.middleware(middleware)
+    return bot
+
+
+def make_update(update_id: int, user_id: int, text: str = "вопрос") -> Update:
+    """Обновление с текстовым сообщением пользователя в личном чате"""
+    return Update.model_validate({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id, "date": 0, "text": text,
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Test"},
+        },
+    })
+
+
+# Небольшой корпус для тестов ассистента: файл — разделы с заголовками и абзацами
+CORPUS = {
+    "obrezka.txt": (
+        "Обрезка винограда\n\n"
+        "Обрезку винограда проводят осенью после листопада или ранней весной до начала сокодвижения. "
+        "На кусте оставляют плодовые звенья из сучка замещения и плодовой стрелки.\n\n"
+        "Летние операции\n\n"
+        "Пасынкование и чеканка побегов улучшают проветривание куста и созревание ягод.\n"
+    ),
+    "zashchita.txt": (
+        "Защита от болезней\n\n"
+        "Милдью поражает листья и грозди во влажную погоду. Профилактические обработки медьсодержащими "
+        "препаратами проводят до цветения и после него.\n\n"
+        "Оидиум развивается в жаркую погоду, против него применяют серу.\n"
+    ),
+    "ceres_about.txt": (
+        "Компания Ceres Pro\n\n"
+        "Ceres Pro выпускает метеостанции и агродатчики для виноградников.\n\n"
+        "Контакты\n\n"
+        "Телефон отдела продаж: +7 800 000-00-00, адрес электронной почты: sales@ceres.example.\n"
+    ),
+    "ukrytie.txt": (
+        "Укрытие на зиму\n\n"
+        "Виноград укрывают после первых заморозков, когда лоза вызрела. "
+        "Лозу снимают со шпалеры, укладывают на подстилку и укрывают землей или агроволокном.\n"
+    ),
+}
+
+
+class HashEmbeddings(Embeddings):
+    """
+    Детерминированная замена модели эмбеддингов для тестов: мешок слов, хэшированный
+    в dim измерений и нормированный. Запоминает пакеты кодируемых фрагментов.
+    """
+    dim = 64
+
+    def __init__(self):
+        self.batches: List[List[str]] = []
+        self.queries: List[str] = []
+
+    def vector(self, text: str) -> List[float]:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for word in re.findall(r"\w+", text.lower()):
+            vector[zlib.crc32(word.encode("utf-8")) % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        if not norm:
+            vector[0], norm = 1.0, 1.0
+        return (vector / norm).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.batches.append(list(texts))
+        return [self.vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        self.queries.append(text)
+        return self.vector(text)
+
+    def embedded_chunks(self) -> int:
+        """Число закодированных фрагментов корпуса (первый пакет — контрольные тексты запуска)"""
+        return sum(len(batch) for batch in self.batches[1:])
+
+
+@pytest.fixture
+def make_assistant(tmp_path, monkeypatch):
+    """
+    Фабрика VineyardAssistant над файлами корпуса во временном каталоге: модель
+    эмбеддингов заменена HashEmbeddings, переранжирование выключено, базы SQLite
+    создаются во временном каталоге. Повторный вызов — перезапуск над тем же индексом.
+    """
+    import main
+    monkeypatch.setattr(main, "create_embeddings", lambda *args, **kwargs: HashEmbeddings())
+    monkeypatch.setattr(main, "RERANK_ENABLED", False)
+    monkeypatch.setattr(main, "INGEST_WORKERS", 1)
+    monkeypatch.setattr(main, "ANSWER_CACHE_DB_PATH", str(tmp_path / "answer_cache.db"))
+    monkeypatch.setattr(main, "SESSION_DB_PATH", None)
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    created = []
+
+    def make(files: Optional[Dict[str, Optional[str]]] = None) -> "main.VineyardAssistant":
+        """files: имя файла корпуса -> текст (None — удалить файл); при первом запуске — CORPUS"""
+        for filename, text in (files or ({} if created else CORPUS)).items():
+            if text is None:
+                (data_dir / filename).unlink()
+            else:
+                (data_dir / filename).write_text(text, encoding="utf-8")
+        assistant = main.VineyardAssistant(data_dir=str(data_dir), query_cache_dir=None)
+        created.append(assistant)
+        return assistant
+
+    yield make
+    for assistant in created:
+        assistant.retrieval_executor.shutdown(wait=False)
+        assistant.query_embeddings.close()
+
+
+async def use_fake_openai(assistant, api_url: str):
+    """Переключение клиента ассистента на мок OpenAI"""
+    from openai_client import OpenAIClient
+    await assistant.client.close()
+    assistant.client = OpenAIClient(api_key="test", base_url=f"{api_url}/v1")
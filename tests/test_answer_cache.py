@@ -0,0 +1,50 @@
+import asyncio
+
+import main
+
+QUESTION = "Когда проводят обрезку винограда?"
+
+
+def prepare(assistant, question: str, user_id: int = 1) -> "main.PreparedQuery":
+    return asyncio.run(assistant.prepare_query(question, user_id))
+
+
+def answer(assistant, question: str, text: str, user_id: int = 1):
+    """Ответ модели на вопрос, сохраняемый в кэш, как после генерации"""
+    prepared = prepare(assistant, question, user_id)
+    assistant.store_answer(prepared, text)
+    return prepared
+
+
+def test_normalized_variant_is_answered_from_cache(make_assistant):
+    assistant = make_assistant()
+    assert answer(assistant, QUESTION, "Осенью после листопада.").cached_answer is None
+
+    # Регистр, пунктуация и лишние пробелы не меняют вопроса
+    prepared = prepare(assistant, "  когда проводят ОБРЕЗКУ винограда  ", user_id=2)
+    assert prepared.cached_answer == "Осенью после листопада."
+    assert prepare(assistant, "Чем лечить оидиум?").cached_answer is None
+
+
+def test_cached_answer_is_invalidated_when_chunks_change(make_assistant):
+    answer(make_assistant(), QUESTION, "Осенью после листопада.")
+    # Ответ переживает перезапуск, пока корпус не изменился
+    assert prepare(make_assistant(), QUESTION).cached_answer == "Осенью после листопада."
+
+    restarted = make_assistant({"obrezka.txt": "Обрезка винограда\n\nОбрезку проводят только весной.\n"})
+    assert not restarted.answer_cache.entries
+    assert prepare(restarted, QUESTION).cached_answer is None
+
+
+def test_cache_is_bypassed_with_dialog_history(make_assistant):
+    assistant = make_assistant()
+    answer(assistant, QUESTION, "Осенью после листопада.")
+    assistant.session_manager.update_session(
+        2, {"role": "user", "content": "Я живу в Сибири"}, {"role": "assistant", "content": "Учту это."}
+    )
+
+    # Ответ с учетом истории может отличаться: он не берется из кэша и не сохраняется в него
+    prepared = answer(assistant, QUESTION, "В Сибири — осенью перед укрытием.", user_id=2)
+    assert prepared.history and prepared.cached_answer is None
+    assert len(assistant.answer_cache.entries) == 1
+    assert prepare(assistant, QUESTION, user_id=3).cached_answer == "Осенью после листопада."
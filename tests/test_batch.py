@@ -0,0 +1,55 @@
+import asyncio
+
+from conftest import use_fake_openai
+from fake_openai import FakeOpenAI, create_app
+
+
+async def collect(assistant, questions, concurrency):
+    return sorted(
+        [result async for result in assistant.process_batch(questions, concurrency=concurrency)],
+        key=lambda result: result["index"]
+    )
+
+
+def test_repeated_questions_in_batch_make_one_request(serve, make_assistant):
+    assistant = make_assistant()
+    questions = [
+        "Как обрезать виноград осенью?",
+        "Когда укрывать виноград на зиму?",
+        "как обрезать виноград осенью",
+        # Другая формулировка с тем же эмбеддингом и контекстом: ответ берется из кэша
+        "Виноград осенью как обрезать?",
+        "Как обрезать виноград осенью?",
+    ]
+    fake = FakeOpenAI(latency=0.05, token_delay=0, rpm=0)
+
+    async def scenario():
+        async with serve(create_app(fake)) as url:
+            await use_fake_openai(assistant, url)
+            try:
+                return await collect(assistant, questions, concurrency=1)
+            finally:
+                await assistant.client.close()
+
+    results = asyncio.run(scenario())
+    assert not [result for result in results if "error" in result]
+    assert fake.served == 2
+    assert [result["cached"] for result in results] == [False, False, True, True, True]
+    assert len({result["answer"] for result in results}) == 1
+
+
+def test_concurrent_repeats_share_one_request(serve, make_assistant):
+    assistant = make_assistant()
+    fake = FakeOpenAI(latency=0.2, token_delay=0, rpm=0)
+
+    async def scenario():
+        async with serve(create_app(fake)) as url:
+            await use_fake_openai(assistant, url)
+            try:
+                return await collect(assistant, ["Чем обработать виноград от милдью?"] * 4, concurrency=4)
+            finally:
+                await assistant.client.close()
+
+    results = asyncio.run(scenario())
+    assert fake.served == 1
+    assert [result["cached"] for result in results] == [False, True, True, True]
@@ -0,0 +1,79 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import urllib.request
+
+import httpx
+from aiogram.fsm.storage.memory import MemoryStorage
+from openai import RateLimitError
+
+from conftest import ROOT
+
+
+def start_bot(vineyard_bot_cls, monkeypatch, metrics_port):
+    """Запуск бота без загрузки ассистента и без перехвата сигналов процесса тестов"""
+    monkeypatch.setattr("bot.ASSISTANT_PRELOAD", False)
+    vineyard_bot = vineyard_bot_cls(storage=MemoryStorage(), metrics_port=metrics_port, warm_answers=False)
+    monkeypatch.setattr(vineyard_bot, "setup_signal_handlers", lambda: None)
+    return vineyard_bot
+
+
+def test_busy_metrics_port_does_not_stop_bot(vineyard_bot_cls, monkeypatch):
+    async def scenario(port):
+        vineyard_bot = start_bot(vineyard_bot_cls, monkeypatch, port)
+        await vineyard_bot.startup()
+        await vineyard_bot.bot.session.close()
+        return vineyard_bot
+
+    with socket.socket() as taken:
+        taken.bind(("127.0.0.1", 0))
+        taken.listen()
+        vineyard_bot = asyncio.run(scenario(taken.getsockname()[1]))
+    assert vineyard_bot.metrics_runner is None
+    assert vineyard_bot.is_running
+
+
+def test_metrics_endpoint_serves_prometheus_text(vineyard_bot_cls, monkeypatch):
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+
+    async def scenario():
+        vineyard_bot = start_bot(vineyard_bot_cls, monkeypatch, port)
+        await vineyard_bot.startup()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                None, lambda: urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics").read().decode()
+            )
+        finally:
+            await vineyard_bot.metrics_runner.cleanup()
+            await vineyard_bot.bot.session.close()
+
+    assert "vineyard_" in asyncio.run(scenario())
+
+
+def test_bot_import_does_not_load_openai(tmp_path):
+    # openai загружается вместе с ассистентом, а не при запуске бота
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    loaded = subprocess.run(
+        [sys.executable, "-c", "import sys, bot; print('openai' in sys.modules)"],
+        cwd=tmp_path, env=env, capture_output=True, text=True, check=True
+    ).stdout.split()[-1]
+    assert loaded == "False"
+
+
+def test_wrapped_rate_limit_error_gets_wait_time_reply(vineyard_bot_cls):
+    response = httpx.Response(429, headers={"retry-after": "12.4"}, request=httpx.Request("POST", "http://api"))
+    try:
+        try:
+            raise RateLimitError("Rate limit reached", response=response, body=None)
+        except RateLimitError as e:
+            raise Exception(f"Error processing query: {e}") from e
+    except Exception as wrapped:
+        rate_limit = vineyard_bot_cls.find_rate_limit_error(wrapped)
+    assert isinstance(rate_limit, RateLimitError)
+    assert "подождите 13 сек." in vineyard_bot_cls.rate_limit_text(rate_limit)
+    assert vineyard_bot_cls.find_rate_limit_error(ValueError("Rate limit reached")) is None
@@ -0,0 +1,66 @@
+import pytest
+
+from ingestion import chunk_file, chunk_text, is_heading
+
+
+def texts(text: str, chunk_size: int = 200, chunk_overlap: int = 40):
+    """Фрагменты текста (номер раздела и абзацы, слитые в строки) и заголовки разделов"""
+    chunks, headings = chunk_text(text, chunk_size, chunk_overlap)
+    return [
+        (section, [' '.join(word for word, _, _ in words) for words in paragraphs])
+        for section, paragraphs in chunks
+    ], headings
+
+
+@pytest.mark.parametrize("line", ["Обрезка винограда", "2. Защита от болезней", "1.3 Летние операции", "IV. Укрытие"])
+def test_headings_are_recognized(line):
+    assert is_heading(line)
+
+
+@pytest.mark.parametrize("line", [
+    "Телефон: +7 800 000-00-00",
+    "Метеостанция — 45 000 ₽",
+    "г. Краснодар, ул. Красная",
+    "Обрезку проводят осенью.",
+    "обрезка винограда",
+    "Очень длинная строка без точки в конце, которая больше похожа на абзац текста, чем на заголовок",
+])
+def test_data_and_sentences_are_not_headings(line):
+    assert not is_heading(line)
+
+
+def test_chunks_keep_headings_and_section_boundaries():
+    chunks, headings = texts(
+        "Виноградник\n\nОбрезка винограда\n\nОбрезку проводят осенью.\n\nКуст формируют веером.\n\n"
+        "Укрытие\n\nЛозу укрывают землей.\n"
+    )
+    # Подряд идущие заголовки объединяются, текст заголовка — первый абзац раздела
+    assert headings == ["Виноградник / Обрезка винограда", "Укрытие"]
+    assert chunks == [
+        (0, ["Виноградник", "Обрезка винограда", "Обрезку проводят осенью.", "Куст формируют веером."]),
+        (1, ["Укрытие", "Лозу укрывают землей."]),
+    ]
+
+
+def test_long_paragraph_is_split_by_sentences_with_overlap():
+    sentences = [f"Предложение номер {number} о винограде." for number in range(10)]
+    chunks, _ = texts(' '.join(sentences), chunk_size=100, chunk_overlap=40)
+    parts = [paragraphs[0] for _, paragraphs in chunks]
+    assert len(parts) > 1 and all(len(part) <= 100 for part in parts)
+    assert all(part.endswith('.') for part in parts)
+    # Каждый следующий фрагмент начинается с конца предыдущего
+    assert all(later.split()[0] in earlier for earlier, later in zip(parts, parts[1:]))
+    assert sentences[0] in parts[0] and sentences[-1] in parts[-1]
+
+
+def test_chunk_offsets_point_into_file_bytes(tmp_path):
+    path = tmp_path / "obrezka.txt"
+    path.write_text("\ufeffОбрезка\n\nОбрезку   винограда\nпроводят осенью.\n", encoding="utf-8")
+    name, chunks, headings, size = chunk_file(str(path), 200, 40)
+    raw = path.read_bytes()
+    assert name == "obrezka.txt" and size == len(raw) and headings == ["Обрезка"]
+    [(text, start, end, section)] = chunks
+    # Пробелы внутри абзаца схлопнуты, границы — байты исходного файла
+    assert text == "Обрезка\nОбрезку винограда проводят осенью."
+    assert raw[start:end].decode("utf-8") == "Обрезка\n\nОбрезку   винограда\nпроводят осенью."
+    assert section == 0
@@ -0,0 +1,55 @@
+import numpy as np
+
+from conftest import HashEmbeddings
+from embedding_cache import QueryEmbeddingCache
+
+QUESTION = "Как обрезать виноград осенью?"
+
+
+def make_cache(model, cache_dir=None) -> QueryEmbeddingCache:
+    return QueryEmbeddingCache(model, capacity=8, dim=HashEmbeddings.dim, cache_dir=cache_dir, fingerprint="test")
+
+
+def test_cached_vector_equals_model_vector():
+    model = HashEmbeddings()
+    cache = make_cache(model)
+    expected = model.embed_query(QUESTION)
+
+    assert np.allclose(cache.embed_query(QUESTION), expected)
+    assert np.allclose(cache.embed_query(QUESTION), expected)
+    # Модель кодирует исходный текст, нормализованный служит только ключом
+    assert model.batches == [[QUESTION]]
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_variants_share_key_and_batch_encodes_each_key_once():
+    model = HashEmbeddings()
+    cache = make_cache(model)
+    vectors = cache.embed_documents([QUESTION, "как обрезать виноград осенью", "Когда укрывать виноград?"])
+
+    assert model.batches == [[QUESTION, "Когда укрывать виноград?"]]
+    assert vectors[0] == vectors[1]
+    assert np.allclose(vectors[2], model.vector("Когда укрывать виноград?"))
+
+
+def test_punctuation_only_queries_are_not_cached():
+    model = HashEmbeddings()
+    cache = make_cache(model)
+    cache.embed_documents(["???", "..."])
+    cache.embed_documents(["???"])
+
+    assert model.batches == [["???", "..."], ["???"]]
+    assert cache.stats()["size"] == 0
+
+
+def test_persistent_cache_survives_restart(tmp_path):
+    model = HashEmbeddings()
+    cache = make_cache(model, str(tmp_path))
+    expected = cache.embed_query(QUESTION)
+    cache.close()
+
+    restarted_model = HashEmbeddings()
+    restarted = make_cache(restarted_model, str(tmp_path))
+    assert np.allclose(restarted.embed_query(QUESTION), expected)
+    assert restarted_model.batches == []
+    restarted.close()
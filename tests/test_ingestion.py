@@ -0,0 +1,51 @@
+import asyncio
+
+from conftest import CORPUS
+
+EDITED = (
+    "Обрезка винограда\n\n"
+    "Короткую обрезку на два глазка применяют для столовых сортов с плодоносными нижними почками.\n"
+)
+
+
+def sources(assistant):
+    """Файлы, фрагменты которых найдены для вопроса"""
+    prepared = asyncio.run(assistant.prepare_query("Когда укрывают виноград и обрезают лозу?", 1))
+    return {doc.metadata["source"] for doc in prepared.documents}
+
+
+def test_edited_file_is_the_only_one_reembedded(make_assistant):
+    first = make_assistant()
+    assert first.embeddings.embedded_chunks() == first.vector_store.ntotal == len(first.chunk_store)
+
+    restarted = make_assistant({"obrezka.txt": EDITED})
+    embedded = [text for batch in restarted.embeddings.batches[1:] for text in batch]
+    new_ids = restarted.chunk_store.source_ids("obrezka.txt")
+    assert embedded == [doc.page_content for doc in restarted.chunk_store.get_documents(new_ids.tolist())]
+
+    prepared = asyncio.run(restarted.prepare_query("короткая обрезка на два глазка", 1))
+    assert "Короткую обрезку на два глазка" in prepared.documents[0].page_content
+    assert not any("плодовые звенья" in doc.page_content for doc in prepared.documents)
+
+
+def test_deleted_file_vectors_are_removed(make_assistant):
+    first = make_assistant()
+    total = first.vector_store.ntotal
+    removed = len(first.chunk_store.source_ids("ukrytie.txt"))
+    assert removed and "ukrytie.txt" in sources(first)
+
+    restarted = make_assistant({"ukrytie.txt": None})
+    assert restarted.embeddings.embedded_chunks() == 0
+    assert restarted.vector_store.ntotal == total - removed
+    assert len(restarted.chunk_store.source_ids("ukrytie.txt")) == 0
+    assert "ukrytie.txt" not in sources(restarted)
+
+
+def test_restart_without_changes_embeds_nothing(make_assistant):
+    first = make_assistant()
+    total = first.vector_store.ntotal
+
+    restarted = make_assistant()
+    assert restarted.embeddings.embedded_chunks() == 0
+    assert restarted.vector_store.ntotal == total
+    assert sources(restarted) == sources(first) and sources(first) <= set(CORPUS)
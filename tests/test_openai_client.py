@@ -0,0 +1,150 @@
+import asyncio
+import time
+
+import pytest
+from openai import APIConnectionError, RateLimitError
+
+from fake_openai import FakeOpenAI, create_app
+from openai_client import FairLimiter, OpenAIClient, TokenBucket, find_error
+
+MESSAGES = [{"role": "user", "content": "Как обрезать виноград осенью?"}]
+
+
+def scripted_retry_after(fake: FakeOpenAI, delays):
+    """Ответы 429 мока по сценарию: очередной элемент — retry-after запроса, 0 — запрос обслуживается"""
+    delays = iter(delays)
+    fake.retry_after = lambda: next(delays, 0.0)
+
+
+async def run_client(serve, fake, scenario, **options):
+    async with serve(create_app(fake)) as url:
+        client = OpenAIClient(api_key="test", base_url=f"{url}/v1", **options)
+        try:
+            return await scenario(client)
+        finally:
+            await client.close()
+
+
+def test_fair_limiter_serves_users_round_robin(serve):
+    fake = FakeOpenAI(latency=0.05, token_delay=0, rpm=0)
+    finished = []
+
+    async def ask(client, user_id):
+        await client.complete(user_id, 100, model="gpt-4o-mini", messages=MESSAGES)
+        finished.append(user_id)
+
+    async def scenario(client):
+        # Пачка запросов пользователя "a" не задерживает единственный запрос "b"
+        tasks = [asyncio.create_task(ask(client, user_id)) for user_id in ("a", "a", "a", "b")]
+        await asyncio.sleep(0)
+        assert client.limiter.active == 1 and client.limiter.waiting == 3
+        await asyncio.gather(*tasks)
+
+    asyncio.run(run_client(serve, fake, scenario, max_concurrency=1))
+    assert finished == ["a", "a", "b", "a"]
+    assert fake.served == 4
+
+
+def test_fair_limiter_cancelled_waiter_frees_nothing():
+    async def scenario():
+        limiter = FairLimiter(1)
+        await limiter.acquire("a")
+        waiter = asyncio.create_task(limiter.acquire("b"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        limiter.release()
+        return limiter
+
+    limiter = asyncio.run(scenario())
+    assert limiter.active == 0 and limiter.waiting == 0
+
+
+def test_token_bucket_waits_for_refill():
+    async def scenario():
+        bucket = TokenBucket(per_minute=600)
+        await bucket.acquire(600)
+        started = time.monotonic()
+        # 10 единиц в секунду: 3 единицы восполняются за 0.3 с
+        await bucket.acquire(3)
+        return time.monotonic() - started
+
+    assert asyncio.run(scenario()) == pytest.approx(0.3, abs=0.15)
+
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_tpm_reservation_is_settled_by_usage(serve, stream):
+    fake = FakeOpenAI(latency=0, token_delay=0, rpm=0)
+
+    async def ask(client):
+        if not stream:
+            response = await client.complete("a", 500, model="gpt-4o-mini", messages=MESSAGES)
+            return response.usage.total_tokens
+        async with client.stream("a", 500, model="gpt-4o-mini", messages=MESSAGES) as chunks:
+            usage = [chunk.usage async for chunk in chunks if chunk.usage is not None]
+        return usage[-1].total_tokens
+
+    async def scenario(client):
+        # Без возврата резерва второй запрос ждал бы восполнения TPM 40 секунд
+        started = time.monotonic()
+        used = [await ask(client), await ask(client)]
+        return used, time.monotonic() - started, client.token_bucket.tokens
+
+    used, elapsed, tokens = asyncio.run(run_client(serve, fake, scenario, tpm_limit=600))
+    assert elapsed < 5
+    assert used[0] < 500
+    assert tokens == pytest.approx(600 - sum(used), abs=5)
+
+
+def test_rate_limit_retry_honors_retry_after(serve):
+    fake = FakeOpenAI(latency=0, token_delay=0, rpm=0)
+    scripted_retry_after(fake, [0.4])
+
+    async def scenario(client):
+        started = time.monotonic()
+        first = asyncio.create_task(client.complete("a", 100, model="gpt-4o-mini", messages=MESSAGES))
+        await asyncio.sleep(0.2)
+        # Пауза после 429 общая для всех запросов клиента, а не только для повторяемого
+        await client.complete("b", 100, model="gpt-4o-mini", messages=MESSAGES)
+        second_done = time.monotonic() - started
+        await first
+        return second_done, time.monotonic() - started
+
+    second_done, elapsed = asyncio.run(run_client(serve, fake, scenario, max_retries=3, backoff_max=5))
+    assert fake.rejected == 1 and fake.served == 2
+    assert elapsed >= 0.4 and second_done >= 0.4
+    assert elapsed < 2
+
+
+def test_rate_limit_error_after_retries_exhausted(serve):
+    fake = FakeOpenAI(latency=0, token_delay=0, rpm=0)
+    scripted_retry_after(fake, [0.05] * 10)
+
+    async def scenario(client):
+        try:
+            await client.complete("a", 100, model="gpt-4o-mini", messages=MESSAGES)
+        except Exception as e:
+            # Ассистент оборачивает ошибки API; бот находит RateLimitError по цепочке причин
+            raise Exception(f"Error processing query: {e}") from e
+
+    with pytest.raises(Exception) as raised:
+        asyncio.run(run_client(serve, fake, scenario, max_retries=2))
+    assert fake.rejected == 3 and fake.served == 0
+    error = find_error(raised.value, RateLimitError)
+    assert error is not None and error.response.headers["retry-after-ms"] == "50"
+
+
+def test_backoff_without_retry_after_is_bounded():
+    async def scenario():
+        client = OpenAIClient(api_key="test", backoff_base=0.5, backoff_max=3.0)
+        error = APIConnectionError(request=None)
+        try:
+            return [[client.retry_delay(error, attempt) for _ in range(200)] for attempt in range(6)]
+        finally:
+            await client.close()
+
+    delays = asyncio.run(scenario())
+    for attempt, samples in enumerate(delays):
+        assert all(0 <= delay <= min(3.0, 0.5 * 2 ** attempt) for delay in samples)
+    # Полный разброс: задержки не совпадают у одновременных повторов
+    assert len(set(delays[3])) > 100
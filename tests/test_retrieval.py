@@ -0,0 +1,46 @@
+import asyncio
+
+import main
+from conftest import CORPUS
+
+COMPANY_QUESTION = "Как связаться с компанией Ceres Pro по телефону?"
+
+
+def prepare(assistant, question: str, user_id: int = 1) -> "main.PreparedQuery":
+    return asyncio.run(assistant.prepare_query(question, user_id))
+
+
+def test_pinned_facts_are_not_repeated_in_context(make_assistant):
+    assistant = make_assistant()
+    assert assistant.pinned_source == main.COMPANY_SOURCE
+
+    prepared = prepare(assistant, COMPANY_QUESTION)
+    system_message, user_message = prepared.messages[0]["content"], prepared.messages[-1]["content"]
+    assert prepared.documents
+    assert all(doc.metadata["source"] != main.COMPANY_SOURCE for doc in prepared.documents)
+    for paragraph in CORPUS[main.COMPANY_SOURCE].split("\n\n"):
+        assert paragraph.strip() in system_message
+        assert paragraph.strip() not in user_message
+
+
+def test_company_source_is_searched_when_facts_are_not_pinned(make_assistant, monkeypatch):
+    monkeypatch.setattr(main, "PROMPT_PINNED_FACTS_MAX_TOKENS", 0)
+    assistant = make_assistant()
+    assert assistant.pinned_source is None
+
+    prepared = prepare(assistant, COMPANY_QUESTION)
+    assert prepared.documents[0].metadata["source"] == main.COMPANY_SOURCE
+    assert "+7 800 000-00-00" in prepared.messages[-1]["content"]
+    assert {doc.metadata["source"] for doc in prepared.documents} == {main.COMPANY_SOURCE}
+
+
+def test_keyword_in_agronomy_question_does_not_restrict_search(make_assistant, monkeypatch):
+    monkeypatch.setattr(main, "PROMPT_PINNED_FACTS_MAX_TOKENS", 0)
+    assistant = make_assistant()
+    question = "Датчик показывает влажную погоду: когда проводят обработки от милдью?"
+    assert assistant.route_source(assistant.preprocess_query(question)) == main.COMPANY_SOURCE
+
+    prepared = prepare(assistant, question)
+    # Ключевое слово "датчик" не отсекает корпус: вопрос о защите винограда находит свой файл
+    assert prepared.documents[0].metadata["source"] == "zashchita.txt"
+    assert "Милдью поражает листья" in prepared.messages[-1]["content"]
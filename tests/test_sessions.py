@@ -0,0 +1,72 @@
+import sqlite3
+
+from sessions import SessionManager, SQLiteSessionStore
+
+
+def turn(number: int):
+    return (
+        {"role": "user", "content": f"вопрос {number} " * 10},
+        {"role": "assistant", "content": f"ответ {number} " * 10},
+    )
+
+
+def make_manager(db_path) -> SessionManager:
+    return SessionManager(history_token_budget=100, store=SQLiteSessionStore(str(db_path)), trim_target=0.5)
+
+
+def test_overflow_survives_restart_until_summarized(tmp_path):
+    manager = make_manager(tmp_path / "sessions.db")
+    for number in range(3):
+        manager.update_session(1, *turn(number))
+    summary, overflow = manager.pending_overflow(1)
+    assert summary == "" and overflow
+    # Свертка не удалась или процесс перезапущен: очередь не потеряна
+    assert manager.pending_overflow(1) == ("", overflow)
+
+    restarted = make_manager(tmp_path / "sessions.db")
+    restarted.get_context(1)
+    assert restarted.pending_overflow(1) == ("", overflow)
+
+    assert restarted.set_summary(1, "резюме", overflow)
+    assert restarted.pending_overflow(1) == ("резюме", [])
+    assert make_manager(tmp_path / "sessions.db").get_context(1)[0]["content"].endswith("резюме")
+
+
+def test_replies_trimmed_during_summary_stay_queued(tmp_path):
+    manager = make_manager(tmp_path / "sessions.db")
+    for number in range(3):
+        manager.update_session(1, *turn(number))
+    _, overflow = manager.pending_overflow(1)
+    for number in range(3, 6):
+        manager.update_session(1, *turn(number))
+    _, queued = manager.pending_overflow(1)
+    assert len(queued) > len(overflow)
+
+    assert manager.set_summary(1, "резюме", overflow)
+    assert manager.pending_overflow(1) == ("резюме", queued[len(overflow):])
+
+
+def test_summary_of_cleared_session_is_dropped(tmp_path):
+    manager = make_manager(tmp_path / "sessions.db")
+    for number in range(3):
+        manager.update_session(1, *turn(number))
+    _, overflow = manager.pending_overflow(1)
+    manager.clear_session(1)
+    manager.update_session(1, *turn(10))
+
+    assert not manager.set_summary(1, "резюме", overflow)
+    assert manager.get_context(1)[0]["role"] == "user"
+
+
+def test_store_of_previous_format_is_migrated(tmp_path):
+    db_path = tmp_path / "sessions.db"
+    db = sqlite3.connect(db_path)
+    db.execute("CREATE TABLE sessions (user_id INTEGER PRIMARY KEY, last_activity REAL, summary TEXT, context TEXT)")
+    db.execute("INSERT INTO sessions VALUES (1, strftime('%s', 'now'), 'резюме', '[]')")
+    db.commit()
+    db.close()
+
+    manager = make_manager(db_path)
+    assert manager.pending_overflow(1) == ("", [])
+    manager.get_context(1)
+    assert manager.pending_overflow(1) == ("резюме", [])
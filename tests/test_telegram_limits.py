@@ -0,0 +1,134 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+
+from conftest import ROOT, make_bot
+from fake_telegram import FakeTelegram, create_app
+from observability import TELEGRAM_RETRY_AFTER
+from telegram_limits import TelegramRateLimiter
+
+
+async def send_all(serve, fake, limiter, messages):
+    """Одновременная отправка сообщений (чат, текст) через ограничитель в мок Bot API"""
+    async with serve(create_app(fake)) as url:
+        bot = make_bot(url, limiter)
+        try:
+            return await asyncio.gather(
+                *(bot.send_message(chat_id, text) for chat_id, text in messages), return_exceptions=True
+            )
+        finally:
+            await bot.session.close()
+
+
+def test_retry_after_429_is_honored(serve):
+    # Ограничитель не знает интервала мока и узнает о нем только из ответов 429
+    fake = FakeTelegram(chat_interval=1.0, latency=0)
+    limiter = TelegramRateLimiter(global_rate=0, chat_interval=0, group_interval=0, max_retries=3)
+    retries_before = TELEGRAM_RETRY_AFTER.value()
+    results = asyncio.run(send_all(serve, fake, limiter, [(7, "a"), (7, "b"), (7, "c"), (8, "d")]))
+
+    assert not [r for r in results if isinstance(r, Exception)]
+    assert fake.flood_rejections >= 2
+    assert TELEGRAM_RETRY_AFTER.value() - retries_before == fake.flood_rejections
+    sent = {chat_id: [m["time"] for m in fake.messages if m["chat_id"] == chat_id] for chat_id in (7, 8)}
+    assert sorted(m["text"] for m in fake.messages if m["chat_id"] == 7) == ["a", "b", "c"]
+    # Повтор не раньше retry_after: между сообщениями в чат не меньше интервала мока (с его допуском)
+    assert all(later - earlier >= 0.9 for earlier, later in zip(sent[7], sent[7][1:]))
+    # Другой чат не ждет чужого flood control
+    assert len(sent[8]) == 1 and sent[8][0] <= sent[7][0] + 0.5
+
+
+def test_retry_after_raised_when_retries_exhausted(serve):
+    fake = FakeTelegram(chat_interval=1.0, latency=0)
+    limiter = TelegramRateLimiter(global_rate=0, chat_interval=0, group_interval=0, max_retries=0)
+    results = asyncio.run(send_all(serve, fake, limiter, [(7, "a"), (7, "b")]))
+
+    errors = [r for r in results if isinstance(r, Exception)]
+    assert len(errors) == 1 and isinstance(errors[0], TelegramRetryAfter)
+    assert errors[0].retry_after >= 1
+    assert len(fake.messages) == 1
+
+
+def test_chat_interval_prevents_flood(serve):
+    fake = FakeTelegram(chat_interval=0.5, latency=0)
+    limiter = TelegramRateLimiter(global_rate=30, chat_interval=0.5, group_interval=0.5, max_retries=0)
+    started = time.monotonic()
+    results = asyncio.run(send_all(serve, fake, limiter, [(7, str(n)) for n in range(4)]))
+
+    assert not [r for r in results if isinstance(r, Exception)]
+    assert fake.flood_rejections == 0
+    # Сообщения уходят в порядке вызовов с интервалом чата
+    assert [m["text"] for m in fake.messages] == ["0", "1", "2", "3"]
+    assert time.monotonic() - started == pytest.approx(1.5, abs=0.5)
+
+
+def send_from_process(api_url: str, chat_ids, global_rate: float, shared_clock, start):
+    """Процесс-обработчик: отправка сообщений через свой ограничитель с общим слотом лимита бота"""
+    async def send():
+        limiter = TelegramRateLimiter(global_rate, 0, 0, 0, shared_clock=shared_clock)
+        bot = make_bot(api_url, limiter)
+        try:
+            await asyncio.gather(*(bot.send_message(chat_id, "ответ") for chat_id in chat_ids))
+        finally:
+            await bot.session.close()
+
+    start.wait()
+    asyncio.run(send())
+
+
+@pytest.fixture
+def fake_telegram_process():
+    """Мок Bot API в отдельном процессе, доступный процессам-обработчикам"""
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, "benchmarks", "fake_telegram.py"),
+                               "--port", str(port)])
+    url = f"http://127.0.0.1:{port}"
+    try:
+        for _ in range(100):
+            try:
+                urllib.request.urlopen(f"{url}/messages", timeout=1)
+                break
+            except OSError:
+                time.sleep(0.1)
+        yield url
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def test_global_rate_is_shared_by_processes(fake_telegram_process):
+    global_rate, workers, per_worker = 10, 3, 8
+    context = multiprocessing.get_context("spawn")
+    shared_clock = context.Value("d", 0.0)
+    # Процессы начинают отправку одновременно, когда все готовы
+    start = context.Barrier(workers)
+    processes = [
+        context.Process(target=send_from_process, args=(
+            fake_telegram_process, range(100 * index, 100 * index + per_worker), global_rate, shared_clock, start
+        ))
+        for index in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(30)
+        assert process.exitcode == 0
+
+    with urllib.request.urlopen(f"{fake_telegram_process}/messages") as response:
+        sent = sorted(message["time"] for message in json.load(response)["messages"])
+    assert len(sent) == workers * per_worker
+    # В любом окне в секунду не больше global_rate сообщений всех процессов (плюс граничное)
+    busiest = max(sum(1 for moment in sent if first <= moment < first + 1) for first in sent)
+    assert busiest <= global_rate + 1
+    assert sent[-1] - sent[0] >= (len(sent) - 1) / global_rate * 0.9
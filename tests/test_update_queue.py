@@ -0,0 +1,80 @@
+import asyncio
+import random
+
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from conftest import make_bot, make_update
+from fake_telegram import FakeTelegram, create_app
+from telegram_limits import TelegramRateLimiter
+from update_queue import UpdateQueue
+
+
+def test_updates_of_one_user_are_answered_in_order(serve):
+    async def scenario():
+        fake = FakeTelegram(chat_interval=0, latency=0.005)
+        async with serve(create_app(fake)) as url:
+            bot = make_bot(url, TelegramRateLimiter(0, 0, 0, 0))
+            active = peak = 0
+
+            async def handler(update):
+                nonlocal active, peak
+                active += 1
+                peak = max(peak, active)
+                await asyncio.sleep(random.uniform(0, 0.02))
+                await bot.send_message(update.message.chat.id, update.message.text)
+                active -= 1
+
+            queue = UpdateQueue(handler, queue_size=100, chat_queue_size=100, max_in_flight=3)
+            update_id = 0
+            for number in range(10):
+                for user_id in (1, 2, 3, 4):
+                    update_id += 1
+                    assert queue.submit(make_update(update_id, user_id, str(number))) is None
+            assert await queue.join(timeout=10)
+            await bot.session.close()
+            return fake, queue, peak
+
+    random.seed(7)
+    fake, queue, peak = asyncio.run(scenario())
+    for user_id in (1, 2, 3, 4):
+        texts = [m["text"] for m in fake.messages if m["chat_id"] == user_id]
+        assert texts == [str(number) for number in range(10)]
+    # Полосы разных пользователей обрабатываются параллельно, но в пределах max_in_flight
+    assert 1 < peak <= 3
+    assert queue.stats() == {"pending": 0, "lanes": 0, "processed": 40, "rejected": 0}
+
+
+def test_overflow_gets_busy_reply(serve, vineyard_bot_cls):
+    async def scenario():
+        fake = FakeTelegram(chat_interval=0, latency=0)
+        async with serve(create_app(fake)) as url:
+            vineyard_bot = vineyard_bot_cls(storage=MemoryStorage(), metrics_port=None, warm_answers=False)
+            vineyard_bot.bot.session.api = TelegramAPIServer.from_base(url)
+            release = asyncio.Event()
+
+            async def handler(update):
+                await release.wait()
+
+            vineyard_bot.updates = UpdateQueue(handler, queue_size=3, chat_queue_size=2, max_in_flight=1)
+            accepted = [
+                vineyard_bot.enqueue_update(make_update(update_id, user_id))
+                for update_id, user_id in enumerate([1, 1, 1, 1, 2, 3], start=1)
+            ]
+            for _ in range(100):
+                if not vineyard_bot.busy_replies:
+                    break
+                await asyncio.sleep(0.01)
+            release.set()
+            assert await vineyard_bot.updates.join(timeout=5)
+            await vineyard_bot.bot.session.close()
+            return fake, vineyard_bot, accepted
+
+    fake, vineyard_bot, accepted = asyncio.run(scenario())
+    # У пользователя 1 в полосе уже два обновления; пользователю 3 не хватило общей очереди
+    assert accepted == [True, True, False, False, True, False]
+    replies = [(m["chat_id"], m["text"]) for m in fake.messages]
+    # Повторный отказ, пока ответ "занят" еще отправляется, второго ответа не порождает
+    assert sorted(replies) == [(1, vineyard_bot.CHAT_BUSY_TEXT), (3, vineyard_bot.BUSY_TEXT)]
+    assert vineyard_bot.updates.stats()["rejected"] == 3
+    assert vineyard_bot.updates.stats()["processed"] == 3
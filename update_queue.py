@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Hashable, Optional, Set, Tuple
+from aiogram.types import Update
+from observability import UPDATE_QUEUE, record_span
+
+
+logger = logging.getLogger(__name__)
+
+
+def routing_key(update: Update) -> int:
+    """Ключ маршрутизации обновления: пользователь, иначе чат, иначе номер обновления"""
+    event = update.event
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    chat = getattr(event, "chat", None)
+    if chat is not None:
+        return chat.id
+    return update.update_id
+
+
+class UpdateQueue:
+    """
+    Ограниченная очередь обновлений Telegram. У каждого пользователя своя полоса:
+    его обновления обрабатываются строго по порядку, разные полосы — параллельно,
+    но не более max_in_flight одновременно. Если обновлений в обработке и ожидании
+    больше queue_size (у одного пользователя — больше chat_queue_size), submit
+    отказывает сразу, чтобы вызывающий ответил "занят", а не копил задачи.
+    """
+    def __init__(self, handler: Callable[[Update], Awaitable[None]], queue_size: int,
+                 chat_queue_size: int, max_in_flight: int):
+        self.handler = handler
+        self.queue_size = queue_size
+        self.chat_queue_size = chat_queue_size
+        self.max_in_flight = max_in_flight
+        self.lanes: Dict[Hashable, Deque[Tuple[Update, float]]] = {}
+        self.pending = 0
+        self.processed = 0
+        self.rejected = 0
+        self._in_flight: Optional[asyncio.Semaphore] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def submit(self, update: Update) -> Optional[str]:
+        """Постановка обновления в полосу его пользователя; при отказе возвращает причину"""
+        key = routing_key(update)
+        lane = self.lanes.get(key)
+        if self.pending >= self.queue_size:
+            reason = "queue_full"
+        elif lane is not None and len(lane) >= self.chat_queue_size:
+            reason = "chat_queue_full"
+        else:
+            reason = None
+        if reason is not None:
+            self.rejected += 1
+            return reason
+
+        if self._in_flight is None:
+            self._in_flight = asyncio.Semaphore(self.max_in_flight)
+        if lane is None:
+            lane = self.lanes[key] = deque()
+            task = asyncio.create_task(self._run_lane(key, lane))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        lane.append((update, time.perf_counter()))
+        self.pending += 1
+        UPDATE_QUEUE.inc(state="queued")
+        return None
+
+    async def _run_lane(self, key: Hashable, lane: Deque[Tuple[Update, float]]):
+        """Последовательная обработка обновлений одной полосы; полоса удаляется, когда опустеет"""
+        try:
+            while lane:
+                update, queued_at = lane[0]
+                async with self._in_flight:
+                    record_span("update_queue", time.perf_counter() - queued_at)
+                    UPDATE_QUEUE.dec(state="queued")
+                    UPDATE_QUEUE.inc(state="in_flight")
+                    try:
+                        await self.handler(update)
+                    except Exception as e:
+                        logger.error(f"Error handling update {update.update_id}: {e}", exc_info=True)
+                    finally:
+                        UPDATE_QUEUE.dec(state="in_flight")
+                lane.popleft()
+                self.pending -= 1
+                self.processed += 1
+        finally:
+            self.lanes.pop(key, None)
+
+    async def join(self, timeout: Optional[float] = None) -> bool:
+        """Ожидание обработки принятых обновлений; False, если таймаут истек раньше"""
+        if not self._tasks:
+            return True
+        _, pending = await asyncio.wait(set(self._tasks), timeout=timeout)
+        return not pending
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "pending": self.pending,
+            "lanes": len(self.lanes),
+            "processed": self.processed,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,212 @@
+import logging
+import os
+from typing import List, Optional, Sequence, Tuple, Union
+import faiss
+import numpy as np
+
+
+logger = logging.getLogger(__name__)
+
+
+class MappedFlatIndex:
+    """
+    Точный поиск по скалярному произведению над векторами, отображенными в память
+    (np.load с mmap_mode). FAISS при IO_FLAG_MMAP отображает только списки IVF,
+    а Flat читает в память целиком, поэтому плоский индекс ищется здесь: процессы
+    делят одну копию векторов через страничный кэш ОС. Только для чтения.
+    """
+    def __init__(self, vectors: np.ndarray, ids: np.ndarray):
+        self.vectors = vectors
+        self.ids = ids
+
+    @property
+    def ntotal(self) -> int:
+        return len(self.ids)
+
+    def search(self, queries: np.ndarray, k: int, ids: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Оценки и идентификаторы k ближайших; как и FAISS, недостающие места заполняются -1."""
+        if ids is None:
+            vectors, vector_ids = self.vectors, self.ids
+        else:
+            positions = np.flatnonzero(np.isin(self.ids, ids))
+            vectors, vector_ids = self.vectors[positions], self.ids[positions]
+        found = min(k, len(vector_ids))
+        scores = np.full((len(queries), k), -np.finfo(np.float32).max, dtype=np.float32)
+        labels = np.full((len(queries), k), -1, dtype=np.int64)
+        if not found:
+            return scores, labels
+        similarities = queries @ vectors.T
+        top = np.argpartition(-similarities, found - 1, axis=1)[:, :found]
+        top_scores = np.take_along_axis(similarities, top, axis=1)
+        order = np.argsort(-top_scores, axis=1, kind="stable")
+        scores[:, :found] = np.take_along_axis(top_scores, order, axis=1)
+        labels[:, :found] = vector_ids[np.take_along_axis(top, order, axis=1)]
+        return scores, labels
+
+
+class VectorIndex:
+    """
+    Индекс FAISS с внешними int64-идентификаторами фрагментов. Тип индекса задается
+    строкой фабрики FAISS (Flat, HNSW, IVF-PQ), индексы с обучением обучаются на первых
+    train_size векторах корпуса. Сохраненный индекс может отображаться в память,
+    тогда несколько процессов делят одну копию через страничный кэш ОС: для IVF это
+    делает FAISS, плоский индекс хранится массивами numpy и ищется MappedFlatIndex,
+    HNSW отображать в память нельзя. Текст фрагментов хранится отдельно, в ChunkStore.
+    """
+    INDEX_FILENAME = "index.faiss"
+    # Плоский индекс: векторы и идентификаторы в формате .npy
+    VECTORS_FILENAME = "vectors.npy"
+    IDS_FILENAME = "ids.npy"
+
+    def __init__(self, index: Union[faiss.Index, MappedFlatIndex], train_size: int = 0):
+        self.index = index
+        self.train_size = train_size
+        self._pending: List[Tuple[np.ndarray, np.ndarray]] = []
+        self._pending_count = 0
+        self.is_mapped = isinstance(index, MappedFlatIndex)
+        base_index = faiss.downcast_index(index.index) if hasattr(index, "id_map") else index
+        self.is_flat = self.is_mapped or isinstance(base_index, faiss.IndexFlat)
+        self.is_ivf = isinstance(base_index, faiss.IndexIVF)
+        self.is_hnsw = isinstance(base_index, faiss.IndexHNSW)
+
+    @classmethod
+    def create(cls, dim: int, factory: str, train_size: int) -> "VectorIndex":
+        """Создание пустого индекса по строке фабрики FAISS."""
+        index = faiss.index_factory(dim, f"IDMap2,{factory}", faiss.METRIC_INNER_PRODUCT)
+        return cls(index, train_size)
+
+    @classmethod
+    def exists(cls, path: str) -> bool:
+        return (os.path.exists(os.path.join(path, cls.INDEX_FILENAME))
+                or os.path.exists(os.path.join(path, cls.VECTORS_FILENAME)))
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = False) -> "VectorIndex":
+        """
+        Загрузка индекса. При mmap=True индекс отображается в память только для чтения
+        (плоский — как MappedFlatIndex); изменять такой индекс нельзя.
+        """
+        vectors_file = os.path.join(path, cls.VECTORS_FILENAME)
+        if os.path.exists(vectors_file):
+            vectors = np.load(vectors_file, mmap_mode='r' if mmap else None)
+            ids = np.load(os.path.join(path, cls.IDS_FILENAME))
+            if mmap:
+                return cls(MappedFlatIndex(vectors, ids))
+            index = faiss.IndexIDMap2(faiss.IndexFlatIP(vectors.shape[1]))
+            index.add_with_ids(vectors, ids)
+            return cls(index)
+
+        index_file = os.path.join(path, cls.INDEX_FILENAME)
+        index = None
+        if mmap:
+            try:
+                index = faiss.read_index(index_file, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+            except RuntimeError as e:
+                logger.warning(f"Memory-mapped index load is not supported, reading into RAM: {e}")
+        if index is None:
+            index = faiss.read_index(index_file)
+        loaded = cls(index)
+        if mmap and not loaded.is_ivf:
+            logger.warning(
+                "FAISS maps only IVF inverted lists into memory: this index is read into RAM "
+                "and is not shared between processes"
+            )
+        return loaded
+
+    def save(self, path: str):
+        """Атомарное сохранение индекса; плоский индекс сохраняется массивами numpy."""
+        if self.is_mapped:
+            raise RuntimeError("Memory-mapped index is read-only")
+        self.finalize()
+        os.makedirs(path, exist_ok=True)
+        if self.is_flat:
+            base_index = faiss.downcast_index(self.index.index)
+            written = {
+                self.VECTORS_FILENAME: base_index.reconstruct_n(0, base_index.ntotal),
+                self.IDS_FILENAME: faiss.vector_to_array(self.index.id_map).astype(np.int64),
+            }
+            for filename, array in written.items():
+                with open(os.path.join(path, filename + ".tmp"), 'wb') as f:
+                    np.save(f, array)
+            for filename in written:
+                os.replace(os.path.join(path, filename + ".tmp"), os.path.join(path, filename))
+            stale = [self.INDEX_FILENAME]
+        else:
+            index_file = os.path.join(path, self.INDEX_FILENAME)
+            faiss.write_index(self.index, index_file + ".tmp")
+            os.replace(index_file + ".tmp", index_file)
+            stale = [self.VECTORS_FILENAME, self.IDS_FILENAME]
+        # Файлы индекса другого формата (после смены FAISS_INDEX_FACTORY) удаляются
+        for filename in stale:
+            if os.path.exists(os.path.join(path, filename)):
+                os.remove(os.path.join(path, filename))
+
+    @property
+    def supports_removal(self) -> bool:
+        return not self.is_hnsw and not self.is_mapped
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal + self._pending_count
+
+    def add(self, ids: Sequence[int], vectors: Sequence[Sequence[float]]):
+        """Добавление векторов; до обучения индекса векторы накапливаются в буфере."""
+        if self.is_mapped:
+            raise RuntimeError("Memory-mapped index is read-only")
+        ids = np.asarray(ids, dtype=np.int64)
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.index.is_trained:
+            self.index.add_with_ids(vectors, ids)
+            return
+        self._pending.append((ids, vectors))
+        self._pending_count += len(ids)
+        if self._pending_count >= self.train_size:
+            self.finalize()
+
+    def finalize(self):
+        """Обучение индекса на накопленных векторах и добавление буфера в индекс."""
+        if not self._pending:
+            return
+        ids = np.concatenate([pending_ids for pending_ids, _ in self._pending])
+        vectors = np.concatenate([pending_vectors for _, pending_vectors in self._pending])
+        self._pending, self._pending_count = [], 0
+        if not self.index.is_trained:
+            logger.info(f"Training FAISS index on {len(vectors)} vectors")
+            self.index.train(vectors)
+        self.index.add_with_ids(vectors, ids)
+
+    def remove(self, ids: Sequence[int]):
+        """Удаление векторов по идентификаторам."""
+        if not self.supports_removal:
+            raise NotImplementedError("HNSW and memory-mapped indexes do not support vector removal")
+        self.index.remove_ids(np.asarray(ids, dtype=np.int64))
+
+    def search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                      ids: Optional[np.ndarray] = None):
+        """
+        Параметры поиска для текущего типа индекса (nprobe для IVF, efSearch для HNSW)
+        и фильтр по идентификаторам фрагментов, если поиск ограничен их подмножеством.
+        """
+        options = {} if ids is None else {"sel": faiss.IDSelectorBatch(ids)}
+        if self.is_ivf and nprobe:
+            return faiss.SearchParametersIVF(nprobe=nprobe, **options)
+        if self.is_hnsw and ef_search:
+            return faiss.SearchParametersHNSW(efSearch=ef_search, **options)
+        return faiss.SearchParameters(**options) if options else None
+
+    def search(
+            self,
+            vectors: Sequence[Sequence[float]],
+            k: int,
+            nprobe: Optional[int] = None,
+            ef_search: Optional[int] = None,
+            ids: Optional[np.ndarray] = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Пакетный поиск ближайших векторов: возвращает матрицы оценок и идентификаторов.
+        ids ограничивает поиск указанными фрагментами (например, одним источником).
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.is_mapped:
+            return self.index.search(vectors, k, ids)
+        return self.index.search(vectors, k, params=self.search_params(nprobe, ef_search, ids))
@@ -0,0 +1,185 @@
+"""
+Прогрев кэша ответов частыми вопросами.
+
+Вопросы берутся из списка FAQ (по вопросу в строке) и из журнала бота: записи
+"Processing query: ..." группируются по нормализованному тексту, берутся вопросы,
+повторявшиеся не реже ANSWER_WARMUP_MIN_COUNT раз. Ответы готовятся пакетной обработкой
+без истории диалога и сохраняются в кэш ответов (SQLite), поэтому частые вопросы
+отвечаются из кэша сразу после перезапуска. Бот запускает прогрев в фоне после загрузки
+ассистента (ANSWER_WARMUP_ENABLED); вручную, например перед переключением на новую версию:
+    python warmup.py --faq data/faq/questions.txt --log bot_logs.log
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+import time
+from collections import Counter
+from typing import TYPE_CHECKING, Dict, List, Optional
+from config import (
+    ANSWER_WARMUP_FAQ_PATH, ANSWER_WARMUP_LOG_PATH, ANSWER_WARMUP_MIN_COUNT, ANSWER_WARMUP_MAX_QUESTIONS,
+    ANSWER_WARMUP_CONCURRENCY, ANSWER_WARMUP_INTERVAL
+)
+from embedding_cache import normalize_query
+from observability import ANSWER_WARMUP
+
+if TYPE_CHECKING:
+    from main import VineyardAssistant
+
+
+logger = logging.getLogger(__name__)
+
+# Запись журнала о вопросе пользователя (VineyardBot.process_message, консольный интерфейс)
+QUERY_LOG_RE = re.compile(r" - INFO - Processing query: (.+)$")
+LOG_TAIL_BYTES = 64 * 1024 * 1024  # читается только конец большого журнала
+MIN_QUESTION_LENGTH = 8
+MAX_QUESTION_LENGTH = 300
+# Вопросов в одном пакете поиска: поиск пользователей не ждет долго в пуле потоков
+SEARCH_BATCH_SIZE = 16
+
+
+def load_faq(path: str) -> List[str]:
+    """Вопросы из файла FAQ; пустые строки и комментарии (#) пропускаются"""
+    with open(path, 'r', encoding='utf-8') as f:
+        return [line.strip() for line in f if line.strip() and not line.lstrip().startswith('#')]
+
+
+def mine_log_questions(path: str, min_count: int, limit: int) -> List[str]:
+    """
+    Частые вопросы из журнала бота. Вопросы группируются по нормализованному тексту,
+    от группы берется самая частая формулировка; команды, слишком короткие
+    и слишком длинные сообщения пропускаются.
+    """
+    counts: Counter = Counter()
+    variants: Dict[str, Counter] = {}
+    with open(path, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        f.seek(max(0, size - LOG_TAIL_BYTES))
+        if size > LOG_TAIL_BYTES:
+            # Первая строка хвоста может быть неполной
+            f.readline()
+        for raw_line in f:
+            match = QUERY_LOG_RE.search(raw_line.decode('utf-8', errors='replace').rstrip('\r\n'))
+            if match is None:
+                continue
+            question = match.group(1).strip()
+            if question.startswith('/') or not MIN_QUESTION_LENGTH <= len(question) <= MAX_QUESTION_LENGTH:
+                continue
+            key = normalize_query(question)
+            if key:
+                counts[key] += 1
+                variants.setdefault(key, Counter())[question] += 1
+    return [
+        variants[key].most_common(1)[0][0]
+        for key, count in counts.most_common(limit) if count >= min_count
+    ]
+
+
+def collect_questions(
+        faq_path: Optional[str] = ANSWER_WARMUP_FAQ_PATH,
+        log_path: Optional[str] = ANSWER_WARMUP_LOG_PATH,
+        min_count: int = ANSWER_WARMUP_MIN_COUNT,
+        limit: int = ANSWER_WARMUP_MAX_QUESTIONS
+) -> List[str]:
+    """Вопросы для прогрева: сначала FAQ, затем частые вопросы из журнала, без повторов"""
+    questions: List[str] = []
+    if faq_path:
+        if os.path.exists(faq_path):
+            questions.extend(load_faq(faq_path))
+        else:
+            logger.warning(f"Warm-up FAQ file {faq_path} not found")
+    if log_path and os.path.exists(log_path):
+        questions.extend(mine_log_questions(log_path, min_count, limit))
+    unique, seen = [], set()
+    for question in questions:
+        key = normalize_query(question)
+        if key and key not in seen:
+            seen.add(key)
+            unique.append(question)
+    return unique[:limit]
+
+
+async def warm_answer_cache(
+        assistant: "VineyardAssistant",
+        questions: List[str],
+        concurrency: int = ANSWER_WARMUP_CONCURRENCY
+) -> Dict[str, int]:
+    """
+    Заполнение кэша ответов: вопросы обрабатываются пакетно без истории диалога,
+    уже закэшированные ответы повторно не запрашиваются. Запросы к модели идут
+    в очереди пакетной обработки и не вытесняют запросы пользователей.
+    """
+    started = time.perf_counter()
+    stats = {"generated": 0, "cached": 0, "error": 0}
+    async for result in assistant.process_batch(questions, concurrency=concurrency, batch_size=SEARCH_BATCH_SIZE):
+        if "error" in result:
+            outcome = "error"
+            logger.warning(f"Warm-up question failed: {result['question']}: {result['error']}")
+        else:
+            outcome = "cached" if result["cached"] else "generated"
+        stats[outcome] += 1
+        ANSWER_WARMUP.inc(result=outcome)
+    logger.info(
+        f"Answer cache warm-up of {len(questions)} questions finished "
+        f"in {time.perf_counter() - started:.1f}s: {stats}"
+    )
+    return stats
+
+
+async def keep_answer_cache_warm(assistant: "VineyardAssistant", interval: float = ANSWER_WARMUP_INTERVAL):
+    """
+    Прогрев после запуска и затем каждые interval секунд: ответы, устаревшие по TTL,
+    запрашиваются заново, список вопросов перечитывается.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            # Чтение журнала не блокирует цикл событий
+            questions = await loop.run_in_executor(None, collect_questions)
+            if questions:
+                await warm_answer_cache(assistant, questions)
+            else:
+                logger.info("No questions for answer cache warm-up")
+        except Exception as e:
+            logger.error(f"Answer cache warm-up failed: {str(e)}", exc_info=True)
+        if not interval:
+            return
+        await asyncio.sleep(interval)
+
+
+async def amain(args: argparse.Namespace):
+    questions = collect_questions(args.faq, args.log, args.min_count, args.max_questions)
+    if not questions:
+        logger.error("No questions to warm up")
+        return
+    from main import VineyardAssistant
+    assistant = VineyardAssistant()
+    try:
+        stats = await warm_answer_cache(assistant, questions, args.concurrency)
+    finally:
+        await assistant.close()
+    print(json.dumps({"questions": len(questions), **stats}, ensure_ascii=False))
+
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        stream=sys.stderr
+    )
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--faq", default=ANSWER_WARMUP_FAQ_PATH, help="файл частых вопросов, по вопросу в строке")
+    parser.add_argument("--log", default=ANSWER_WARMUP_LOG_PATH, help="журнал бота с вопросами пользователей")
+    parser.add_argument("--min-count", type=int, default=ANSWER_WARMUP_MIN_COUNT,
+                        help="минимальное число повторов вопроса в журнале")
+    parser.add_argument("--max-questions", type=int, default=ANSWER_WARMUP_MAX_QUESTIONS)
+    parser.add_argument("--concurrency", type=int, default=ANSWER_WARMUP_CONCURRENCY,
+                        help="одновременных запросов к модели")
+    asyncio.run(amain(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()